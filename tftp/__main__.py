@@ -1,17 +1,185 @@
+import argparse
 import logging
-import socketserver
+import config
+import preload
+import profiling
+import readahead
 import server
+import shaping
+import signal
+import storage
+import upstream
 import threading
 
 logging.basicConfig(
     format='%(asctime)s -- %(levelname)s: %(message)s',
     level=logging.INFO)
 
-HOST = 'localhost'
-PORT = 20069
-
 if __name__ == '__main__':
-    logging.info("Starting TFTP server on {0}:{1}".format(HOST, PORT))
-    srv = socketserver.ThreadingUDPServer((HOST, PORT), server.Handler)
-    thread = threading.Thread(target=srv.serve_forever)
-    thread.start()
+    # Only options given on the command line override the config file
+    parser = argparse.ArgumentParser(
+        prog='tftp', argument_default=argparse.SUPPRESS)
+    parser.add_argument(
+        '--config', default=None, metavar='FILE',
+        help="read settings from the [tftp] section of this file; "
+            "reloadable settings are read again on SIGHUP")
+    parser.add_argument(
+        '--host',
+        help="address to listen on")
+    parser.add_argument(
+        '--port', type=int,
+        help="port to listen on")
+    parser.add_argument(
+        '--log-level', type=config.parseLogLevel,
+        help="one of " + ", ".join(config.LogLevels))
+    parser.add_argument(
+        '--storage-dir',
+        help="persist uploaded files under this directory across restarts")
+    parser.add_argument(
+        '--compression', type=config.parseCodecs, metavar='CODECS',
+        help="compress stored files with the smallest of these, e.g. zlib,lzma")
+    parser.add_argument(
+        '--cache-bytes', type=storage.parseSize, metavar='BYTES',
+        help="memory kept for decompressed files")
+    parser.add_argument(
+        '--profile', action='store_true',
+        help="time each phase of every transfer")
+    parser.add_argument(
+        '--profile-every', type=int, metavar='N',
+        help="capture a cProfile of every Nth transfer into --profile-dir")
+    parser.add_argument(
+        '--profile-dir',
+        help="directory for captured profiles")
+    parser.add_argument(
+        '--transfer-timeout', type=float, metavar='SECONDS',
+        help="wait this long for the client before retransmitting")
+    parser.add_argument(
+        '--max-send-attempts', type=int, metavar='N',
+        help="give up on a transfer after sending a packet this many times")
+    parser.add_argument(
+        '--packet-buffer', type=storage.parseSize, metavar='BYTES',
+        help="largest packet read from a transfer socket")
+    parser.add_argument(
+        '--read-ahead-min', type=int, metavar='CHUNKS',
+        help="fewest chunks of a file on disk read ahead of the client")
+    parser.add_argument(
+        '--read-ahead-max', type=int, metavar='CHUNKS',
+        help="most chunks of a file on disk read ahead of the client")
+    parser.add_argument(
+        '--read-ahead-workers', type=int, metavar='N',
+        help="threads reading files on disk ahead of clients")
+    parser.add_argument(
+        '--session-deadline', type=float,
+        metavar='SECONDS', help="abort transfers taking longer than this")
+    parser.add_argument(
+        '--idle-timeout', type=float,
+        metavar='SECONDS', help="abort transfers whose client goes quiet this long")
+    parser.add_argument(
+        '--rate-limit', type=storage.parseSize, metavar='BYTES',
+        help="cap total DATA throughput, e.g. 100M bytes per second")
+    parser.add_argument(
+        '--subnet-rate', action='append', metavar='CIDR=BYTES',
+        help="cap DATA throughput to a client subnet; may be repeated")
+    parser.add_argument(
+        '--error-reply-rate', type=float, metavar='N',
+        help="ERROR replies to stray datagrams per source address per second")
+    parser.add_argument(
+        '--error-reply-burst', type=float, metavar='N',
+        help="burst of ERROR replies allowed per source address")
+    parser.add_argument(
+        '--error-reply-sources', type=int, metavar='N',
+        help="source addresses whose ERROR reply rate is tracked")
+    parser.add_argument(
+        '--quota', type=storage.parseSize, metavar='BYTES',
+        help="limit the total size of stored files, e.g. 4G")
+    parser.add_argument(
+        '--file-quota', type=storage.parseSize, metavar='BYTES',
+        help="limit the size of any single stored file")
+    parser.add_argument(
+        '--root',
+        help="serve files not in storage from this directory")
+    parser.add_argument(
+        '--overwrite', type=config.parseOverwrite,
+        help="whether uploads may replace existing files: never, request or "
+            "always; 'request' requires the client to send the overwrite option")
+    parser.add_argument(
+        '--preload', metavar='MANIFEST',
+        help="warm the files listed in this manifest, one path per line, at startup")
+    parser.add_argument(
+        '--preload-workers', type=int, metavar='N',
+        help="threads warming preloaded files")
+    parser.add_argument(
+        '--preload-background', action='store_true',
+        help="start serving immediately and warm files in the background")
+    parser.add_argument(
+        '--socket-pool', type=int, metavar='N',
+        help="idle transfer sockets kept bound; 0 binds one per transfer")
+    parser.add_argument(
+        '--socket-buffer', type=storage.parseSize, metavar='BYTES',
+        help="send and receive buffer size of transfer sockets")
+    parser.add_argument(
+        '--negative-cache', type=int, metavar='N',
+        help="missing paths remembered and answered without a session; 0 disables")
+    parser.add_argument(
+        '--negative-ttl', type=float,
+        metavar='SECONDS', help="how long a missing path is remembered")
+    parser.add_argument(
+        '--upstream', metavar='HOST[:PORT]',
+        help="fetch files missing from storage from this TFTP server and keep them")
+    args = vars(parser.parse_args())
+
+    path = args.pop('config')
+    if 'subnet_rate' in args:
+        args['subnet_rate'] = ','.join(args['subnet_rate'])
+    try:
+        conf = config.load(
+            path, {name.replace('_', '-'): value for name, value in args.items()})
+    except config.ErrorBadConfig as ex:
+        parser.error(str(ex))
+
+    logging.getLogger().setLevel(conf.logLevel)
+    readahead.READ_AHEAD_WORKERS = conf.readAheadWorkers
+
+    if conf.root:
+        storage.Storage().configureRoot(conf.root)
+
+    conf.apply()
+    for name, scope in shaping.Shaper().stats().items():
+        logging.info("Rate limit [{0}]: {1} bytes/s".format(name, scope['rate']))
+
+    if conf.profile or conf.profileEvery:
+        try:
+            profiling.Profiler().configure(
+                sampleEvery=conf.profileEvery, directory=conf.profileDir)
+        except OSError as ex:
+            parser.error("Can't create profile directory: {}".format(ex))
+
+    if conf.storageDir:
+        storage.Storage().open(conf.storageDir)
+
+    if conf.upstream:
+        host, _, port = conf.upstream.partition(':')
+        upstream.Upstream().configure(host, int(port) if port else config.DEFAULT_PORT)
+
+    if conf.preload:
+        preloader = preload.Preloader()
+        preloader.start(
+            preload.readManifest(conf.preload), conf.preloadWorkers,
+            encode=server.encodeNetascii)
+        if not conf.preloadBackground:
+            preloader.wait()
+
+    logging.info("Starting TFTP server on {0}:{1}".format(conf.host, conf.port))
+    srv = server.Server((conf.host, conf.port), server.Handler, conf=conf)
+
+    def reload():
+        try:
+            srv.reload(srv.config.reload())
+        except config.ErrorBadConfig as ex:
+            logging.error("Not reloading configuration: {}".format(ex))
+
+    # Reload off the signal handler so it can't block the serving thread
+    signal.signal(
+        signal.SIGHUP,
+        lambda signum, frame: threading.Thread(target=reload).start())
+    srv.serve_forever()
@@ -0,0 +1,94 @@
+"""Measures the server CPU spent per junk datagram on the listening socket,
+comparing the plain ThreadingUDPServer against the validating front door.
+
+A separate process floods the server with stray ACK, DATA and ERROR packets
+and malformed requests. CPU time is that of the server process only, taken
+from getrusage once the last datagram has been handled.
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import socket
+import socketserver
+import threading
+import time
+
+import server
+
+def junk():
+    """Returns a list of datagrams that are not valid requests"""
+    return [
+        bytes(server.packACK(1)),
+        bytes(server.packDATA(b'x' * 512, 7)),
+        bytes(server.packERROR(server.Errors['NOT_DEFINED'], "stray")),
+        b'\x00\x01no_terminators',
+        b'\x00\x02file\x00cabbage\x00',
+        os.urandom(32)]
+
+def flood(address, count):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    packets = junk()
+    for i in range(count):
+        sock.sendto(packets[i % len(packets)], address)
+        # Stay within the socket buffer so the server sees every datagram
+        if i % 64 == 0:
+            time.sleep(0.001)
+    sock.close()
+
+class Counting(object):
+    """Counts datagrams as they are taken off the listening socket"""
+    seen = 0
+
+    def verify_request(self, request, client_address):
+        self.seen += 1
+        return super().verify_request(request, client_address)
+
+class PlainServer(Counting, socketserver.ThreadingUDPServer):
+    def handle_error(self, request, client_address):
+        # Undecodable filenames raise in the handler thread; skip the traceback
+        pass
+
+class FrontDoorServer(Counting, server.Server):
+    pass
+
+def cpuTime():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+def run(cls, count):
+    srv = cls(('localhost', 0), server.Handler)
+    thread = threading.Thread(target=srv.serve_forever)
+    thread.start()
+    sender = multiprocessing.Process(target=flood, args=(srv.server_address, count))
+
+    start = cpuTime()
+    began = time.monotonic()
+    sender.start()
+    sender.join()
+    # Wait for the backlog and any handler threads to drain
+    last = -1
+    while srv.seen != last or threading.active_count() > 2:
+        last = srv.seen
+        time.sleep(0.2)
+    cpu = cpuTime() - start
+    elapsed = time.monotonic() - began
+
+    srv.shutdown()
+    srv.server_close()
+    thread.join()
+    return srv.seen, cpu, elapsed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=20000,
+        help="junk datagrams to send to each server")
+    args = parser.parse_args(argv)
+
+    for name, cls in (('plain', PlainServer), ('frontdoor', FrontDoorServer)):
+        seen, cpu, elapsed = run(cls, args.count)
+        print("{0:<10} sent={1} handled={2} cpu={3:.3f}s cpu/packet={4:.1f}us wall={5:.2f}s".format(
+            name, args.count, seen, cpu, cpu / seen * 1e6 if seen else 0.0, elapsed))
+
+if __name__ == '__main__':
+    main()
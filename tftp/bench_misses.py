@@ -0,0 +1,84 @@
+"""Measures how many requests for missing files the server answers per
+second, with and without the negative-lookup cache.
+
+Client processes each request a set of PXE-style paths the server doesn't
+have, one at a time, waiting for the FILE_NOT_FOUND before sending the
+next. Without the cache every miss starts a session; with it, repeat
+misses are answered from the listening socket.
+"""
+import argparse
+import multiprocessing
+import socket
+import threading
+import time
+
+import server
+import storage
+
+def paths(count):
+    """Returns count paths a PXE client might probe before finding its config"""
+    return ["pxelinux.cfg/01-52-54-00-{0:02x}-{1:02x}-{2:02x}".format(
+        i >> 16 & 0xff, i >> 8 & 0xff, i & 0xff) for i in range(count)]
+
+def probe(address, names, duration, conn):
+    """Requests names round robin for duration seconds and sends the number
+    of FILE_NOT_FOUND answers received through conn
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.settimeout(1.0)
+    misses = i = 0
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        name = names[i % len(names)]
+        i += 1
+        sock.sendto(server.packRWRQ(server.Opcodes['RRQ'], name, 'octet'), address)
+        try:
+            answer = sock.recv(1024)
+        except socket.timeout:
+            continue
+        if server.unpackERROR(answer)[1] == server.Errors['FILE_NOT_FOUND']:
+            misses += 1
+    sock.close()
+    conn.send(misses)
+
+def run(cacheSize, clients, names, duration):
+    storage.Storage().configureNegativeCache(cacheSize)
+    srv = server.Server(('127.0.0.1', 0), server.Handler)
+    thread = threading.Thread(target=srv.serve_forever)
+    thread.start()
+
+    pipes = [multiprocessing.Pipe() for i in range(clients)]
+    probes = [
+        multiprocessing.Process(
+            target=probe, args=(srv.server_address, names, duration, child))
+        for parent, child in pipes]
+    for p in probes:
+        p.start()
+    misses = sum(parent.recv() for parent, child in pipes)
+    for p in probes:
+        p.join()
+
+    stats = srv.stats()
+    srv.shutdown()
+    srv.server_close()
+    thread.join()
+    return misses, stats['missesAnswered']
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=4,
+        help="client processes sending requests")
+    parser.add_argument('--paths', type=int, default=64,
+        help="distinct missing paths requested")
+    parser.add_argument('--duration', type=float, default=5.0,
+        help="seconds to run each configuration")
+    args = parser.parse_args(argv)
+
+    names = paths(args.paths)
+    for label, size in (('uncached', 0), ('cached', storage.NEGATIVE_CACHE_SIZE)):
+        misses, inline = run(size, args.clients, names, args.duration)
+        print("{0:<9} misses={1} misses/s={2:.0f} answered inline={3}".format(
+            label, misses, misses / args.duration, inline))
+
+if __name__ == '__main__':
+    main()
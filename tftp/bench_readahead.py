@@ -0,0 +1,90 @@
+"""Compares per-block latency of serving a file from disk with plain reads
+against the read-ahead pipeline, starting from a cold page cache.
+
+The client is simulated by waiting --rtt seconds between block requests, as
+the RRQ loop does while waiting for each ACK. For a meaningful cold-cache
+result --path must be on a real disk rather than tmpfs.
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+import persist
+import readahead
+import server
+
+def dropCache(path):
+    """Evicts path from the page cache"""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+class PlainReader(object):
+    """Reads each block from disk as it is requested"""
+    def __init__(self, record):
+        self.record = record
+
+    def __len__(self):
+        return self.record.length
+
+    def __getitem__(self, key):
+        start, stop, step = key.indices(self.record.length)
+        return os.pread(self.record.segment.fd, stop - start, self.record.offset + start)
+
+    def close(self):
+        pass
+
+def run(reader, rtt):
+    """Returns a list of per-block latencies in seconds"""
+    latencies = []
+    blockSize = server.DATA_BLOCK_SIZE
+    for start in range(0, len(reader) + 1, blockSize):
+        begin = time.perf_counter()
+        reader[start:start + blockSize]
+        latencies.append(time.perf_counter() - begin)
+        if rtt:
+            time.sleep(rtt)
+    reader.close()
+    return latencies
+
+def report(name, latencies):
+    latencies = sorted(latencies)
+    print("{0:<10} blocks={1} total={2:8.3f}s p50={3:8.1f}us p99={4:8.1f}us max={5:8.1f}us".format(
+        name,
+        len(latencies),
+        sum(latencies),
+        statistics.median(latencies) * 1e6,
+        latencies[int(len(latencies) * 0.99)] * 1e6,
+        latencies[-1] * 1e6))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--path', help="directory for the test file")
+    parser.add_argument('--size', type=int, default=16 * 1024 * 1024)
+    parser.add_argument('--rtt', type=float, default=0.0,
+        help="seconds the simulated client takes to ACK each block")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(dir=args.path) as directory:
+        path = os.path.join(directory, 'bench_file')
+        with open(path, 'wb') as f:
+            f.write(os.urandom(args.size))
+        segment = persist.Segment(path, os.O_RDONLY)
+        record = persist.Record(segment, 0, args.size, None, args.size)
+
+        dropCache(path)
+        report('plain', run(PlainReader(record), args.rtt))
+
+        dropCache(path)
+        ahead = readahead.ReadAhead(record, server.DATA_BLOCK_SIZE)
+        report('readahead', run(ahead, args.rtt))
+        print("readahead  waited on {0} of {1} chunk reads, final depth {2}".format(
+            ahead.waits, ahead.reads, ahead.depth))
+
+if __name__ == '__main__':
+    main()
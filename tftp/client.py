@@ -0,0 +1,412 @@
+import argparse
+import asyncio
+import logging
+import os
+import time
+
+import server
+
+DEFAULT_TIMEOUT = 1.0
+DEFAULT_CONCURRENCY = 16
+MAX_BLOCK_NUM = 65536
+
+# RFC-2347 option acknowledgement, which the server codec does not decode
+OACK = 0x06
+
+class ErrorTransferFailed(Exception):
+    pass
+
+class ErrorTimeout(ErrorTransferFailed):
+    pass
+
+class ErrorRemote(ErrorTransferFailed):
+    """The server ended the transfer with an ERROR packet"""
+    def __init__(self, code, msg):
+        super().__init__(
+            "Server error [{0}] {1}: {2}"\
+            .format(code, server.Errors.get(code, code), msg))
+        self.code = code
+        self.msg = msg
+
+def unpackOACK(packet):
+    """Returns a dictionary of the option names and values in an OACK packet"""
+    fields = bytes(packet[2:]).split(b'\x00')
+    options = {}
+    for i in range(0, len(fields) - 1, 2):
+        options[fields[i].decode('utf-8').lower()] = fields[i + 1].decode('utf-8')
+    return options
+
+class Result(object):
+    """Outcome of a single transfer"""
+    def __init__(self, filename, size=0, elapsed=0.0, error=None):
+        self.filename = filename
+        self.size = size
+        self.elapsed = elapsed
+        self.error = error
+
+    @property
+    def throughput(self):
+        """Bytes per second"""
+        return self.size / self.elapsed if self.elapsed else 0.0
+
+class TransferProtocol(asyncio.DatagramProtocol):
+    """Queues datagrams received on a transfer's socket"""
+    def __init__(self):
+        self.queue = asyncio.Queue()
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.queue.put_nowait((data, addr))
+
+    def error_received(self, exc):
+        logging.debug("Transfer socket error: {}".format(exc))
+
+class Transfer(object):
+    """State shared by a single RRQ or WRQ exchange with the server"""
+    def __init__(self, client, filename, mode):
+        self.client = client
+        self.filename = filename
+        self.mode = mode
+        self.transport = None
+        self.protocol = None
+        self.peer = None
+        self.blksize = server.DATA_BLOCK_SIZE
+        self.windowsize = 1
+        self.tsize = None
+
+    async def open(self):
+        loop = asyncio.get_running_loop()
+        self.transport, self.protocol = await loop.create_datagram_endpoint(
+            TransferProtocol, local_addr=(self.client.bind, 0))
+
+    def close(self):
+        if self.transport:
+            self.transport.close()
+
+    def send(self, packet):
+        self.transport.sendto(bytes(packet), self.peer or self.client.address)
+
+    async def recv(self):
+        """Returns the next packet from the server's transfer ID, or None
+        on timeout. Raises ErrorTransferFailed on an ERROR packet.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.client.timeout
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return None
+            try:
+                packet, addr = await asyncio.wait_for(
+                    self.protocol.queue.get(), remaining)
+            except asyncio.TimeoutError:
+                return None
+
+            # The server answers from a new port, its transfer ID
+            if self.peer is None:
+                self.peer = addr
+            if addr != self.peer:
+                self.transport.sendto(bytes(server.packERROR(
+                    server.Errors['UNKNOWN_TRANSFER_ID'],
+                    "Unknown transfer ID")), addr)
+                continue
+            if len(packet) < 2:
+                continue
+
+            if int.from_bytes(packet[:2], 'big') == server.Opcodes['ERROR']:
+                opcode, code, msg = server.unpackERROR(packet)
+                raise ErrorRemote(code, msg)
+            return packet
+
+    def negotiate(self, options):
+        """Applies the options acknowledged in an OACK packet"""
+        if 'blksize' in options:
+            self.blksize = int(options['blksize'])
+        if 'windowsize' in options:
+            self.windowsize = int(options['windowsize'])
+        if 'tsize' in options:
+            self.tsize = int(options['tsize'])
+
+    def options(self, tsize):
+        options = {}
+        if self.client.blksize:
+            options['blksize'] = self.client.blksize
+        if self.client.windowsize:
+            options['windowsize'] = self.client.windowsize
+        if self.client.tsize:
+            options['tsize'] = tsize
+        return options
+
+class Client(object):
+    """asyncio TFTP client. Many transfers may run concurrently on one
+    event loop; each uses its own socket.
+
+    blksize, windowsize and tsize are requested as RFC-2347 options. A
+    server that doesn't acknowledge them is served with plain RFC-1350
+    transfers of 512 byte blocks, one block per ACK.
+    """
+    # Subclasses may substitute their own Transfer, e.g. to simulate loss
+    transferClass = Transfer
+
+    def __init__(self, host, port=20069, timeout=DEFAULT_TIMEOUT,
+            retries=server.MAX_PACKET_SEND_ATTEMPTS, blksize=None,
+            windowsize=None, tsize=False, bind='0.0.0.0'):
+        self.address = (host, port)
+        self.timeout = timeout
+        self.retries = retries
+        self.blksize = blksize
+        self.windowsize = windowsize
+        self.tsize = tsize
+        self.bind = bind
+
+    async def get(self, filename, mode=server.Modes['OCTET'], onData=None):
+        """Returns the contents of filename read from the server.
+        onData, when given, is called with each block as it arrives in order;
+        in netascii mode the blocks are still encoded.
+        """
+        t = self.transferClass(self, filename, mode)
+        await t.open()
+        try:
+            return await self._get(t, onData)
+        finally:
+            t.close()
+
+    async def _get(self, t, onData=None):
+        request = server.packRWRQ(
+            server.Opcodes['RRQ'], t.filename, t.mode, t.options(0))
+        file = bytearray()
+        # Resent whenever the server goes quiet: the request until the server
+        # answers, then the ACK for the last block received in order
+        last = request
+        block = 0
+        attempts = 0
+        t.send(request)
+
+        while True:
+            packet = await t.recv()
+            if packet is None:
+                attempts += 1
+                if attempts >= self.retries:
+                    raise ErrorTimeout(
+                        "Timed out reading '{}'".format(t.filename))
+                t.send(last)
+                continue
+
+            opcode = int.from_bytes(packet[:2], 'big')
+            if opcode == OACK and last is request:
+                t.negotiate(unpackOACK(packet))
+                last = server.packACK(0)
+                t.send(last)
+                attempts = 0
+                continue
+            if opcode != server.Opcodes['DATA']:
+                continue
+
+            opcode, blockNum, data = server.unpackDATA(packet)
+            if blockNum != (block + 1) % MAX_BLOCK_NUM:
+                # Duplicate or out of order: re-ACK the last good block
+                if last is not request:
+                    last = server.packACK(block % MAX_BLOCK_NUM)
+                    t.send(last)
+                continue
+
+            attempts = 0
+            block += 1
+            file.extend(data)
+            if onData:
+                onData(data)
+            final = len(data) < t.blksize
+            last = server.packACK(blockNum)
+            # With a window, only the last block of each window is ACKed
+            if final or block % t.windowsize == 0:
+                t.send(last)
+            if final:
+                break
+
+        if t.mode == server.Modes['NETASCII']:
+            file = server.decodeNetascii(file)
+        return bytes(file)
+
+    async def put(self, filename, data, mode=server.Modes['OCTET'],
+            overwrite=False):
+        """Writes data to filename on the server. overwrite asks the server
+        to replace an existing file, which it honours only if configured to.
+        """
+        t = self.transferClass(self, filename, mode)
+        await t.open()
+        try:
+            await self._put(t, data, overwrite)
+        finally:
+            t.close()
+
+    async def _put(self, t, data, overwrite=False):
+        if t.mode == server.Modes['NETASCII']:
+            data = server.encodeNetascii(data)
+        data = memoryview(bytes(data))
+        options = t.options(len(data))
+        if overwrite:
+            options['overwrite'] = 1
+        request = server.packRWRQ(
+            server.Opcodes['WRQ'], t.filename, t.mode, options)
+
+        attempts = 0
+        t.send(request)
+        while True:
+            packet = await t.recv()
+            if packet is None:
+                attempts += 1
+                if attempts >= self.retries:
+                    raise ErrorTimeout(
+                        "Timed out writing '{}'".format(t.filename))
+                t.send(request)
+                continue
+            opcode = int.from_bytes(packet[:2], 'big')
+            if opcode == OACK:
+                t.negotiate(unpackOACK(packet))
+                break
+            if opcode == server.Opcodes['ACK']:
+                if server.unpackACK(packet)[1] == 0:
+                    break
+
+        # A file that is an exact multiple of blksize ends with an empty block
+        blocks = len(data) // t.blksize + 1
+        acked = 0
+        attempts = 0
+        while acked < blocks:
+            if attempts >= self.retries:
+                raise ErrorTimeout(
+                    "Timed out writing '{}'".format(t.filename))
+            for n in range(acked + 1, min(acked + t.windowsize, blocks) + 1):
+                start = (n - 1) * t.blksize
+                t.send(server.packDATA(
+                    data[start:start + t.blksize], n % MAX_BLOCK_NUM))
+
+            while True:
+                packet = await t.recv()
+                if packet is None:
+                    attempts += 1
+                    break
+                if int.from_bytes(packet[:2], 'big') != server.Opcodes['ACK']:
+                    continue
+                opcode, block = server.unpackACK(packet)
+                # Map the 16-bit block number back onto the window
+                ahead = (block - acked) % MAX_BLOCK_NUM
+                if 0 < ahead <= t.windowsize and acked + ahead <= blocks:
+                    acked += ahead
+                    attempts = 0
+                    break
+
+    async def _timed(self, filename, transfer):
+        start = time.monotonic()
+        try:
+            size = await transfer
+        except (ErrorTransferFailed, OSError) as ex:
+            return Result(filename, 0, time.monotonic() - start, ex)
+        return Result(filename, size, time.monotonic() - start)
+
+    async def fetchMany(self, filenames, mode=server.Modes['OCTET'],
+            concurrency=DEFAULT_CONCURRENCY, sink=None):
+        """Reads each of filenames with at most concurrency transfers in
+        flight and returns a list of Results in the same order.
+        sink, when given, is called with (filename, data) for each file read.
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def fetch(filename):
+            async with semaphore:
+                data = await self.get(filename, mode)
+            if sink:
+                sink(filename, data)
+            return len(data)
+
+        return await asyncio.gather(
+            *(self._timed(f, fetch(f)) for f in filenames))
+
+    async def putMany(self, files, mode=server.Modes['OCTET'],
+            concurrency=DEFAULT_CONCURRENCY):
+        """Writes each (filename, data) pair of files with at most
+        concurrency transfers in flight and returns a list of Results.
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def put(filename, data):
+            async with semaphore:
+                await self.put(filename, data, mode)
+            return len(data)
+
+        return await asyncio.gather(
+            *(self._timed(f, put(f, d)) for f, d in files))
+
+def report(results, elapsed):
+    """Logs per-file and aggregate throughput for results"""
+    total = 0
+    for r in results:
+        if r.error:
+            logging.error("{0}: failed after {1:.3f}s: {2}".format(
+                r.filename, r.elapsed, r.error))
+        else:
+            total += r.size
+            logging.info("{0}: {1} bytes in {2:.3f}s ({3:.1f} KiB/s)".format(
+                r.filename, r.size, r.elapsed, r.throughput / 1024))
+    failed = sum(1 for r in results if r.error)
+    logging.info(
+        "{0} files, {1} failed, {2} bytes in {3:.3f}s ({4:.1f} KiB/s)"\
+        .format(len(results), failed, total, elapsed,
+            total / elapsed / 1024 if elapsed else 0.0))
+    return failed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='client.py',
+        description="Fetch or put many files concurrently over TFTP")
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=20069)
+    parser.add_argument('--mode', default=server.Modes['OCTET'],
+        choices=(server.Modes['OCTET'], server.Modes['NETASCII']))
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT)
+    parser.add_argument('--blksize', type=int)
+    parser.add_argument('--windowsize', type=int)
+    parser.add_argument('--tsize', action='store_true')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument('-v', '--verbose', action='store_true')
+    sub = parser.add_subparsers(dest='command', required=True)
+    g = sub.add_parser('get', help="read remote files")
+    g.add_argument('files', nargs='+')
+    g.add_argument('--output-dir',
+        help="write fetched files here instead of discarding them")
+    p = sub.add_parser('put', help="write local files")
+    p.add_argument('files', nargs='+')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        format='%(asctime)s -- %(levelname)s: %(message)s',
+        level=logging.DEBUG if args.verbose else logging.INFO)
+
+    client = Client(
+        args.host, args.port, timeout=args.timeout, blksize=args.blksize,
+        windowsize=args.windowsize, tsize=args.tsize)
+
+    def save(filename, data):
+        path = os.path.join(args.output_dir, filename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    start = time.monotonic()
+    if args.command == 'get':
+        results = asyncio.run(client.fetchMany(
+            args.files, args.mode, args.concurrency,
+            save if args.output_dir else None))
+    else:
+        files = []
+        for path in args.files:
+            with open(path, 'rb') as f:
+                files.append((os.path.basename(path), f.read()))
+        results = asyncio.run(client.putMany(files, args.mode, args.concurrency))
+    return 1 if report(results, time.monotonic() - start) else 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,305 @@
+import configparser
+import ipaddress
+import logging
+
+import preload
+import readahead
+import sessions
+import shaping
+import sockpool
+import storage
+
+# Section of the configuration file settings are read from
+CONFIG_SECTION = 'tftp'
+
+DEFAULT_HOST = 'localhost'
+DEFAULT_PORT = 20069
+
+LogLevels = ('DEBUG', 'INFO', 'WARNING', 'ERROR')
+
+class ErrorBadConfig(Exception):
+    pass
+
+def parseBool(value):
+    if isinstance(value, bool):
+        return value
+    if value.lower() in ('1', 'true', 'yes', 'on'):
+        return True
+    if value.lower() in ('0', 'false', 'no', 'off'):
+        return False
+    raise ValueError("Expected a boolean, got '{}'".format(value))
+
+def parseList(value):
+    """Parses a comma separated list"""
+    if not isinstance(value, str):
+        return tuple(value)
+    return tuple(v.strip() for v in value.split(',') if v.strip())
+
+def parseCodecs(value):
+    codecs = parseList(value)
+    for codec in codecs:
+        if codec not in storage.Codecs:
+            raise ValueError("Unknown codec '{}'".format(codec))
+    return codecs
+
+def parseNetwork(cidr):
+    """Returns the network cidr names, as the Shaper will parse it"""
+    try:
+        return ipaddress.ip_network(cidr, strict=False)
+    except ValueError:
+        raise ValueError("Invalid subnet '{}'".format(cidr))
+
+def parseSubnetRates(value):
+    """Parses a comma separated list of CIDR=BYTES into a dictionary"""
+    rates = {}
+    for subnetRate in parseList(value):
+        if '=' not in subnetRate:
+            raise ValueError("Expected CIDR=BYTES, got '{}'".format(subnetRate))
+        cidr, rate = subnetRate.split('=', 1)
+        parseNetwork(cidr.strip())
+        rates[cidr.strip()] = storage.parseSize(rate.strip())
+    return rates
+
+def parseLogLevel(value):
+    if value.upper() not in LogLevels:
+        raise ValueError("Unknown log level '{}'".format(value))
+    return value.upper()
+
+def parseOverwrite(value):
+    # Imported here as server imports this module
+    import server
+    if value not in server.OverwritePolicies:
+        raise ValueError("Unknown overwrite policy '{}'".format(value))
+    return value
+
+# Option name in the configuration file and on the command line, mapped to
+# (attribute, parser, reloadable). Settings that aren't reloadable only
+# change on restart.
+Options = {
+    'host': ('host', str, False),
+    'port': ('port', int, False),
+    'log-level': ('logLevel', parseLogLevel, False),
+    'storage-dir': ('storageDir', str, False),
+    'root': ('root', str, False),
+    'upstream': ('upstream', str, False),
+    'preload': ('preload', str, False),
+    'preload-workers': ('preloadWorkers', int, False),
+    'preload-background': ('preloadBackground', parseBool, False),
+    'read-ahead-workers': ('readAheadWorkers', int, False),
+    'profile': ('profile', parseBool, False),
+    'profile-every': ('profileEvery', int, False),
+    'profile-dir': ('profileDir', str, False),
+    'transfer-timeout': ('transferTimeout', float, True),
+    'max-send-attempts': ('maxSendAttempts', int, True),
+    'packet-buffer': ('packetBuffer', storage.parseSize, True),
+    'read-ahead-min': ('readAheadMin', int, True),
+    'read-ahead-max': ('readAheadMax', int, True),
+    'overwrite': ('overwrite', parseOverwrite, True),
+    'error-reply-rate': ('errorReplyRate', float, True),
+    'error-reply-burst': ('errorReplyBurst', float, True),
+    'error-reply-sources': ('errorReplySources', int, True),
+    'session-deadline': ('sessionDeadline', float, True),
+    'idle-timeout': ('idleTimeout', float, True),
+    'rate-limit': ('rateLimit', storage.parseSize, True),
+    'subnet-rate': ('subnetRates', parseSubnetRates, True),
+    'quota': ('quota', storage.parseSize, True),
+    'file-quota': ('fileQuota', storage.parseSize, True),
+    'compression': ('compression', parseCodecs, True),
+    'cache-bytes': ('cacheBytes', storage.parseSize, True),
+    'negative-cache': ('negativeCache', int, True),
+    'negative-ttl': ('negativeTtl', float, True),
+    'socket-pool': ('socketPool', int, True),
+    'socket-buffer': ('socketBuffer', storage.parseSize, True),
+}
+
+def minimums():
+    """Returns the smallest value allowed for each numeric option, mapped to
+    whether that value itself is allowed. Unset options aren't checked.
+    """
+    # Imported here as server imports this module
+    import server
+    return {
+        'port': (0, True),
+        'preload-workers': (1, True),
+        'read-ahead-workers': (1, True),
+        'profile-every': (0, True),
+        'transfer-timeout': (0, False),
+        'max-send-attempts': (1, True),
+        # A shorter buffer truncates full DATA blocks into final ones
+        'packet-buffer': (server.DATA_BLOCK_SIZE + 4, True),
+        'read-ahead-min': (1, True),
+        'read-ahead-max': (1, True),
+        'error-reply-rate': (0, False),
+        'error-reply-burst': (1, True),
+        'error-reply-sources': (1, True),
+        'session-deadline': (0, False),
+        'idle-timeout': (0, False),
+        'rate-limit': (0, False),
+        'subnet-rate': (0, False),
+        'quota': (0, False),
+        'file-quota': (0, False),
+        'cache-bytes': (0, True),
+        'negative-cache': (0, True),
+        'negative-ttl': (0, False),
+        # 0 binds a socket per transfer
+        'socket-pool': (0, True),
+        'socket-buffer': (0, False),
+    }
+
+def checkRange(option, value):
+    """Raises ErrorBadConfig if value is below the minimum of option"""
+    bounds = minimums()
+    if option not in bounds:
+        return
+    minimum, inclusive = bounds[option]
+    # Subnet rates are a dictionary of CIDR to rate
+    values = value.values() if isinstance(value, dict) else [value]
+    for v in values:
+        if v < minimum or (v == minimum and not inclusive):
+            raise ErrorBadConfig(
+                "Invalid value for '{0}': {1} must be {2} {3}".format(
+                    option, v, 'at least' if inclusive else 'greater than',
+                    minimum))
+
+class Config(object):
+    """Settings of a server, defaulting to the module constants they
+    replace. Handlers read the Config of their server when a session
+    starts, so a reload of these only affects sessions started after it.
+    Settings applied to shared components, like quotas and the reaper's
+    timeouts, affect sessions in progress too.
+    """
+    def __init__(self):
+        # Imported here as server imports this module
+        import server
+
+        self.path = None
+        self.overrides = {}
+
+        self.host = DEFAULT_HOST
+        self.port = DEFAULT_PORT
+        self.logLevel = 'INFO'
+        self.storageDir = None
+        self.root = None
+        self.upstream = None
+        self.preload = None
+        self.preloadWorkers = preload.PRELOAD_WORKERS
+        self.preloadBackground = False
+        self.readAheadWorkers = readahead.READ_AHEAD_WORKERS
+        self.profile = False
+        self.profileEvery = 0
+        self.profileDir = None
+
+        self.transferTimeout = server.TRANSFER_TIMEOUT
+        self.maxSendAttempts = server.MAX_PACKET_SEND_ATTEMPTS
+        self.packetBuffer = server.PACKET_BUFFER_SIZE
+        self.readAheadMin = readahead.READ_AHEAD_MIN
+        self.readAheadMax = readahead.READ_AHEAD_MAX
+        self.overwrite = server.OVERWRITE_POLICY
+        self.errorReplyRate = server.ERROR_REPLY_RATE
+        self.errorReplyBurst = server.ERROR_REPLY_BURST
+        self.errorReplySources = server.ERROR_REPLY_SOURCES
+        self.sessionDeadline = sessions.SESSION_DEADLINE
+        self.idleTimeout = sessions.SESSION_IDLE_TIMEOUT
+        self.rateLimit = None
+        self.subnetRates = {}
+        self.quota = None
+        self.fileQuota = None
+        self.compression = ()
+        self.cacheBytes = storage.DECOMPRESSED_CACHE_BYTES
+        self.negativeCache = storage.NEGATIVE_CACHE_SIZE
+        self.negativeTtl = storage.NEGATIVE_CACHE_TTL
+        self.socketPool = sockpool.SOCKET_POOL_SIZE
+        self.socketBuffer = sockpool.SOCKET_SEND_BUFFER
+
+    def set(self, option, value):
+        """Sets option to value, parsing it if it's a string. An empty
+        string or None resets options that may be unset.
+        Raises ErrorBadConfig for unknown options and invalid values.
+        """
+        if option not in Options:
+            raise ErrorBadConfig("Unknown option '{}'".format(option))
+        attribute, parse, reloadable = Options[option]
+        if value == '':
+            value = None
+        if value is not None and (isinstance(value, str) or parse is parseBool):
+            try:
+                value = parse(value)
+            except ValueError as ex:
+                raise ErrorBadConfig(
+                    "Invalid value for '{0}': {1}".format(option, ex))
+        if value is not None:
+            checkRange(option, value)
+        setattr(self, attribute, value)
+
+    def read(self, path):
+        """Sets the options in the [tftp] section of the file at path"""
+        parser = configparser.ConfigParser(interpolation=None)
+        try:
+            if not parser.read(path):
+                raise ErrorBadConfig("Can't read config file '{}'".format(path))
+        except configparser.Error as ex:
+            raise ErrorBadConfig(str(ex))
+        if parser.has_section(CONFIG_SECTION):
+            for option, value in parser.items(CONFIG_SECTION):
+                self.set(option, value)
+
+    def validate(self):
+        """Raises ErrorBadConfig if any setting is invalid, including ones
+        assigned directly rather than through set
+        """
+        for option, (attribute, parse, reloadable) in Options.items():
+            if getattr(self, attribute) is not None:
+                checkRange(option, getattr(self, attribute))
+        try:
+            for cidr in self.subnetRates or {}:
+                parseNetwork(cidr)
+            parseCodecs(self.compression or ())
+        except ValueError as ex:
+            raise ErrorBadConfig(str(ex))
+        if self.readAheadMax < self.readAheadMin:
+            raise ErrorBadConfig(
+                "'read-ahead-max' must be at least 'read-ahead-min'")
+        if self.profileEvery and not self.profileDir:
+            raise ErrorBadConfig("'profile-every' needs 'profile-dir'")
+
+    def apply(self):
+        """Configures the shared components with the reloadable settings.
+        Raises ErrorBadConfig, leaving them unchanged, if any is invalid.
+        """
+        self.validate()
+        store = storage.Storage()
+        store.configureQuota(self.quota, self.fileQuota)
+        store.configureCompression(self.compression or (), self.cacheBytes)
+        store.configureNegativeCache(self.negativeCache, self.negativeTtl)
+        shaping.Shaper().configure(self.rateLimit, self.subnetRates)
+        sessions.Reaper().configure(self.sessionDeadline, self.idleTimeout)
+        sockpool.SocketPool().configure(
+            self.socketPool, self.socketBuffer, self.socketBuffer)
+
+    def reload(self):
+        """Returns a Config read again from the same file and overrides.
+        Settings that aren't reloadable keep their current values.
+        Raises ErrorBadConfig if the file is invalid.
+        """
+        new = load(self.path, self.overrides)
+        for option, (attribute, parse, reloadable) in Options.items():
+            if reloadable or getattr(new, attribute) == getattr(self, attribute):
+                continue
+            logging.warning(
+                "Ignoring change to '{}' until the server restarts".format(option))
+            setattr(new, attribute, getattr(self, attribute))
+        return new
+
+def load(path=None, overrides=None):
+    """Returns a Config read from the file at path, if any, then with the
+    options in overrides, e.g. from the command line, set on top
+    """
+    conf = Config()
+    conf.path = path
+    conf.overrides = dict(overrides or {})
+    if path:
+        conf.read(path)
+    for option, value in conf.overrides.items():
+        conf.set(option, value)
+    conf.validate()
+    return conf
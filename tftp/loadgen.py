@@ -0,0 +1,260 @@
+"""Drives a server on loopback with many concurrent simulated clients and
+reports throughput, completion latency and server resource usage.
+
+The server runs in a subprocess by default so its RSS and thread count are
+measured on their own; --in-process runs it on a thread of this process
+instead. Reads fetch files stored before the run, writes upload new ones.
+--loss drops that fraction of the datagrams each client sends and receives.
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import random
+import resource
+import statistics
+import threading
+import time
+
+import client
+import server
+import storage
+
+SAMPLE_INTERVAL = 0.5
+
+class LossyProtocol(client.TransferProtocol):
+    """Drops received datagrams with probability loss"""
+    def __init__(self, loss):
+        super().__init__()
+        self.loss = loss
+
+    def datagram_received(self, data, addr):
+        if random.random() >= self.loss:
+            super().datagram_received(data, addr)
+
+class LossyTransfer(client.Transfer):
+    """Drops sent and received datagrams with the client's loss probability"""
+    async def open(self):
+        loop = asyncio.get_running_loop()
+        self.transport, self.protocol = await loop.create_datagram_endpoint(
+            lambda: LossyProtocol(self.client.loss),
+            local_addr=(self.client.bind, 0))
+
+    def send(self, packet):
+        if random.random() >= self.client.loss:
+            super().send(packet)
+
+class LossyClient(client.Client):
+    transferClass = LossyTransfer
+
+    def __init__(self, *args, loss=0.0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.loss = loss
+
+def fileName(size):
+    return "load-{}".format(size)
+
+def fileData(size):
+    """Returns size bytes of text with line breaks, so netascii transfers
+    have something to encode
+    """
+    line = b'abcdefghijklmnopqrstuvwxyz0123456789\n'
+    return (line * (size // len(line) + 1))[:size]
+
+def serve(sizes, conn):
+    """Stores a file of each of sizes and serves on loopback until killed,
+    sending the server's address through conn
+    """
+    store = storage.Storage()
+    for size in sizes:
+        store.put(fileName(size), fileData(size))
+    srv = server.Server(('127.0.0.1', 0), server.Handler)
+    conn.send(srv.server_address)
+    srv.serve_forever()
+
+def processStats(pid):
+    """Returns (RSS in bytes, thread count) of process pid"""
+    rss = threads = 0
+    with open('/proc/{}/status'.format(pid)) as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                rss = int(line.split()[1]) * 1024
+            elif line.startswith('Threads:'):
+                threads = int(line.split()[1])
+    return rss, threads
+
+def raiseFileLimit():
+    """Lifts the open file limit to its maximum; every transfer needs a socket"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+class Sampler(object):
+    """Records the peak RSS and thread count of a process in the background"""
+    def __init__(self, pid):
+        self.pid = pid
+        self.peakRss = 0
+        self.peakThreads = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.sample()
+            self.stopped.wait(SAMPLE_INTERVAL)
+
+    def sample(self):
+        try:
+            rss, threads = processStats(self.pid)
+        except OSError:
+            return
+        self.peakRss = max(self.peakRss, rss)
+        self.peakThreads = max(self.peakThreads, threads)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.sample()
+
+async def generate(tftp, transfers, clients, sizes, writeRatio, modes, seed):
+    """Runs transfers randomly chosen reads and writes with at most clients
+    in flight and returns their Results
+    """
+    rng = random.Random(seed)
+    semaphore = asyncio.Semaphore(clients)
+    runId = os.getpid()
+
+    async def transfer(i):
+        size = rng.choice(sizes)
+        mode = rng.choice(modes)
+        write = rng.random() < writeRatio
+        async with semaphore:
+            start = time.monotonic()
+            try:
+                if write:
+                    await tftp.put(
+                        "upload-{0}-{1}".format(runId, i), fileData(size), mode)
+                else:
+                    size = len(await tftp.get(fileName(size), mode))
+            except (client.ErrorTransferFailed, OSError) as ex:
+                return client.Result(fileName(size), 0, time.monotonic() - start, ex)
+            return client.Result(fileName(size), size, time.monotonic() - start)
+
+    return await asyncio.gather(*(transfer(i) for i in range(transfers)))
+
+def report(results, elapsed, sampler):
+    """Prints aggregate statistics of a run and returns them as a dictionary"""
+    done = [r for r in results if not r.error]
+    latencies = sorted(r.elapsed for r in done)
+    total = sum(r.size for r in done)
+    stats = {
+        'transfers': len(results),
+        'failed': len(results) - len(done),
+        'transfersPerSecond': len(done) / elapsed if elapsed else 0.0,
+        'megabytesPerSecond': total / elapsed / 1e6 if elapsed else 0.0,
+        'p50': statistics.median(latencies) if latencies else None,
+        'p99': latencies[int(len(latencies) * 0.99)] if latencies else None,
+        'peakRss': sampler.peakRss,
+        'peakThreads': sampler.peakThreads}
+
+    print("transfers={0} failed={1} elapsed={2:.2f}s".format(
+        stats['transfers'], stats['failed'], elapsed))
+    print("throughput={0:.1f} transfers/s {1:.2f} MB/s".format(
+        stats['transfersPerSecond'], stats['megabytesPerSecond']))
+    if latencies:
+        print("latency p50={0:.1f}ms p99={1:.1f}ms".format(
+            stats['p50'] * 1000, stats['p99'] * 1000))
+    print("server peak rss={0:.1f}MB threads={1}".format(
+        stats['peakRss'] / 1e6, stats['peakThreads']))
+    for r in results:
+        if r.error:
+            print("first failure: {0}: {1}".format(r.filename, r.error))
+            break
+    return stats
+
+def run(transfers=1000, clients=100, sizes=(1000,), writeRatio=0.0,
+        modes=(server.Modes['OCTET'],), loss=0.0, timeout=client.DEFAULT_TIMEOUT,
+        inProcess=False, seed=None):
+    """Starts a server, runs the load against it and returns report()'s
+    statistics
+    """
+    raiseFileLimit()
+    if inProcess:
+        store = storage.Storage()
+        for size in sizes:
+            if fileName(size) not in store.store:
+                store.put(fileName(size), fileData(size))
+        srv = server.Server(('127.0.0.1', 0), server.Handler)
+        thread = threading.Thread(target=srv.serve_forever, daemon=True)
+        thread.start()
+        address = srv.server_address
+        pid = os.getpid()
+    else:
+        parent, child = multiprocessing.Pipe()
+        process = multiprocessing.Process(
+            target=serve, args=(sizes, child), daemon=True)
+        process.start()
+        address = parent.recv()
+        pid = process.pid
+
+    tftp = LossyClient(
+        address[0], address[1], timeout=timeout, loss=loss, bind='127.0.0.1')
+    sampler = Sampler(pid)
+    sampler.start()
+    try:
+        start = time.monotonic()
+        results = asyncio.run(generate(
+            tftp, transfers, clients, sizes, writeRatio, modes, seed))
+        elapsed = time.monotonic() - start
+    finally:
+        sampler.stop()
+        if inProcess:
+            srv.shutdown()
+            srv.server_close()
+        else:
+            process.terminate()
+            process.join()
+    return report(results, elapsed, sampler)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='loadgen.py', description=__doc__.splitlines()[0])
+    parser.add_argument('--transfers', type=int, default=1000,
+        help="total transfers to run")
+    parser.add_argument('--clients', type=int, default=100,
+        help="transfers in flight at once")
+    parser.add_argument('--sizes', default='1k',
+        help="comma separated file sizes to choose from, e.g. 1k,64k,1m")
+    parser.add_argument('--write-ratio', type=float, default=0.0,
+        help="fraction of transfers that are writes")
+    parser.add_argument('--modes', default=server.Modes['OCTET'],
+        help="comma separated transfer modes to choose from")
+    parser.add_argument('--loss', type=float, default=0.0,
+        help="fraction of datagrams dropped in each direction")
+    parser.add_argument('--timeout', type=float, default=client.DEFAULT_TIMEOUT,
+        help="client retransmission timeout in seconds")
+    parser.add_argument('--in-process', action='store_true',
+        help="run the server in this process instead of a subprocess")
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        format='%(asctime)s -- %(levelname)s: %(message)s',
+        level=logging.DEBUG if args.verbose else logging.WARNING)
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    stats = run(
+        args.transfers, args.clients,
+        [storage.parseSize(s) for s in args.sizes.split(',')],
+        args.write_ratio, args.modes.split(','), args.loss, args.timeout,
+        args.in_process, args.seed)
+    return 1 if stats['failed'] else 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,221 @@
+import logging
+import os
+import struct
+import threading
+
+# Magic, codec id, path length, data length, raw (uncompressed) length
+RECORD_HEADER = struct.Struct('>4sBIQQ')
+RECORD_MAGIC = b'TFWL'
+
+SNAPSHOT_FILE = 'snapshot.dat'
+WAL_FILE = 'wal.log'
+# Logs rotated out for compaction are named WAL_FILE.<sequence> until the
+# snapshot covering them is written
+
+# Compact once the write-ahead log grows past this many bytes
+COMPACT_WAL_BYTES = 64 * 1024 * 1024
+
+CodecIds = {
+    None: 0,
+    'zlib': 1,
+    'lzma': 2,
+    0: None,
+    1: 'zlib',
+    2: 'lzma'}
+
+class ErrorCorruptJournal(Exception):
+    pass
+
+class Segment(object):
+    """An open snapshot or log file. The descriptor is closed once the last
+    Record referring to it is released, so readers holding a Record survive
+    compaction replacing the file underneath them.
+    """
+    def __init__(self, path, flags):
+        self.path = path
+        self.fd = os.open(path, flags, 0o644)
+
+    def __del__(self):
+        try:
+            os.close(self.fd)
+        except OSError:
+            pass
+
+class Record(object):
+    """Location of a file body inside a Segment. Bodies are only read from
+    disk when requested, letting the OS page them in on demand.
+    """
+    __slots__ = ('segment', 'offset', 'length', 'codec', 'size')
+
+    def __init__(self, segment, offset, length, codec, size):
+        self.segment = segment
+        self.offset = offset
+        self.length = length
+        self.codec = codec
+        self.size = size
+
+    def read(self):
+        data = os.pread(self.segment.fd, self.length, self.offset)
+        if len(data) != self.length:
+            raise ErrorCorruptJournal(
+                "Short read of [{0}] bytes from '{1}'"\
+                .format(self.length, self.segment.path))
+        return data
+
+def packRecord(path, data, codec, size):
+    """Returns the header and encoded path of a journal record"""
+    p = bytes(str(path), 'utf-8')
+    header = RECORD_HEADER.pack(RECORD_MAGIC, CodecIds[codec], len(p), len(data), size)
+    return header + p
+
+def writeAll(fd, data):
+    """Writes all of data to fd, which os.write alone may cut short"""
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+def scanSegment(segment, index):
+    """Reads record headers from segment into index, seeking past bodies.
+    Returns the offset just past the last complete record.
+    """
+    end = os.fstat(segment.fd).st_size
+    offset = 0
+    while offset + RECORD_HEADER.size <= end:
+        header = os.pread(segment.fd, RECORD_HEADER.size, offset)
+        magic, codecId, pathLen, dataLen, size = RECORD_HEADER.unpack(header)
+        if magic != RECORD_MAGIC or codecId not in CodecIds:
+            break
+        bodyOffset = offset + RECORD_HEADER.size + pathLen
+        if bodyOffset + dataLen > end:
+            break
+        path = os.pread(segment.fd, pathLen, offset + RECORD_HEADER.size)
+        index[path.decode('utf-8')] = Record(
+            segment, bodyOffset, dataLen, CodecIds[codecId], size)
+        offset = bodyOffset + dataLen
+    return offset
+
+def rotatedLogs(directory):
+    """Returns the paths of the rotated logs in directory, oldest first"""
+    prefix = WAL_FILE + '.'
+    logs = []
+    for name in os.listdir(directory):
+        if name.startswith(prefix) and name[len(prefix):].isdigit():
+            logs.append((int(name[len(prefix):]), os.path.join(directory, name)))
+    return [path for sequence, path in sorted(logs)]
+
+class Journal(object):
+    """Persists files as a snapshot plus a write-ahead log of files stored
+    since the snapshot was taken. All files share the same record format.
+
+    Compaction rotates the log out under the mutex, then writes the new
+    snapshot from the old snapshot and rotated logs without holding it, so
+    appends carry on meanwhile. Rotated logs left by a failed or interrupted
+    compaction are read at load and folded into the next snapshot.
+    """
+    def __init__(self, directory, compactBytes=COMPACT_WAL_BYTES, sync=True):
+        self.directory = directory
+        self.compactBytes = compactBytes
+        self.sync = sync
+        self.mutex = threading.Lock()
+        self.snapshot = None
+        self.wal = None
+        self.walBytes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def load(self):
+        """Returns a dictionary of path to Record for every persisted file.
+        Only record headers are read; a torn record at the end of the log
+        left by a crash is discarded.
+        """
+        index = {}
+        with self.mutex:
+            snapshotPath = os.path.join(self.directory, SNAPSHOT_FILE)
+            if os.path.exists(snapshotPath):
+                self.snapshot = Segment(snapshotPath, os.O_RDONLY)
+                scanSegment(self.snapshot, index)
+            for path in rotatedLogs(self.directory):
+                scanSegment(Segment(path, os.O_RDONLY), index)
+
+            self.wal = Segment(
+                os.path.join(self.directory, WAL_FILE),
+                os.O_RDWR | os.O_CREAT | os.O_APPEND)
+            self.walBytes = scanSegment(self.wal, index)
+            if self.walBytes != os.fstat(self.wal.fd).st_size:
+                logging.warning(
+                    "Discarding torn record at offset [{0}] of '{1}'"\
+                    .format(self.walBytes, self.wal.path))
+                os.ftruncate(self.wal.fd, self.walBytes)
+        return index
+
+    def append(self, path, data, codec=None, size=None):
+        """Appends a file body to the log and returns its Record. On failure
+        the log is truncated back to its last complete record.
+        Caller must hold the mutex.
+        """
+        if size is None:
+            size = len(data)
+        header = packRecord(path, data, codec, size)
+        try:
+            writeAll(self.wal.fd, header + data)
+            if self.sync:
+                os.fsync(self.wal.fd)
+        except OSError:
+            # Drop the partial record so later offsets stay right
+            os.ftruncate(self.wal.fd, self.walBytes)
+            raise
+        record = Record(
+            self.wal, self.walBytes + len(header), len(data), codec, size)
+        self.walBytes += len(header) + len(data)
+        return record
+
+    def needsCompaction(self):
+        return self.walBytes >= self.compactBytes
+
+    def rotate(self):
+        """Moves the log aside and starts an empty one. Returns the paths of
+        every rotated log, which the next snapshot must cover.
+        Caller must hold the mutex.
+        """
+        logs = rotatedLogs(self.directory)
+        sequence = 1
+        if logs:
+            sequence = int(logs[-1].rsplit('.', 1)[1]) + 1
+        walPath = self.wal.path
+        rotatedPath = '{0}.{1}'.format(walPath, sequence)
+        # Records still held by readers keep the old log open
+        os.rename(walPath, rotatedPath)
+        self.wal.path = rotatedPath
+        self.wal = Segment(walPath, os.O_RDWR | os.O_CREAT | os.O_APPEND)
+        self.walBytes = 0
+        return logs + [rotatedPath]
+
+    def compact(self, index, logs):
+        """Writes every Record in index to a new snapshot, atomically
+        replaces the old snapshot and deletes the rotated logs it covers.
+        index must hold every file in the old snapshot and logs.
+        Returns a new index pointing into the new snapshot.
+        Doesn't need the mutex.
+        """
+        snapshotPath = os.path.join(self.directory, SNAPSHOT_FILE)
+        tmpPath = snapshotPath + '.tmp'
+        tmp = Segment(tmpPath, os.O_RDWR | os.O_CREAT | os.O_TRUNC)
+        compacted = {}
+        offset = 0
+        for path, record in index.items():
+            data = record.read()
+            header = packRecord(path, data, record.codec, record.size)
+            writeAll(tmp.fd, header + data)
+            compacted[path] = Record(
+                tmp, offset + len(header), len(data), record.codec, record.size)
+            offset += len(header) + len(data)
+        os.fsync(tmp.fd)
+        os.replace(tmpPath, snapshotPath)
+        tmp.path = snapshotPath
+        with self.mutex:
+            self.snapshot = tmp
+
+        for path in logs:
+            os.unlink(path)
+        logging.info(
+            "Compacted [{0}] files into '{1}'".format(len(compacted), snapshotPath))
+        return compacted
@@ -0,0 +1,219 @@
+import heapq
+import logging
+import os
+import threading
+import time
+
+import persist
+import storage
+
+# Threads loading files listed in a preload manifest
+PRELOAD_WORKERS = 4
+# Upper bound on the number of pre-encoded netascii bytes kept
+NETASCII_CACHE_BYTES = 32 * 1024 * 1024
+
+# Queue priorities; lower is loaded first
+PRIORITY_REQUESTED = 0
+PRIORITY_MANIFEST = 1
+
+def readManifest(path):
+    """Returns the file paths listed in a manifest, one per line.
+    Blank lines and lines starting with '#' are ignored.
+    """
+    paths = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                paths.append(line)
+    return paths
+
+class Preloader(object):
+    """Maintains a singleton pool of threads warming files ahead of their
+    first request: compressed files are inflated into the storage cache,
+    files on disk are paged in, and netascii encodings are kept ready.
+    """
+    __instance = None
+
+    def __new__(cls):
+        if not Preloader.__instance:
+            Preloader.__instance = Preloader.__Preloader()
+        return Preloader.__instance
+
+    class __Preloader():
+        def __init__(self):
+            self.mutex = threading.Lock()
+            self.queue = []
+            self.sequence = 0
+            self.pending = set()
+            self.encode = None
+            self.encoded = {}
+            self.encodedBytes = 0
+            self.encodedLimit = NETASCII_CACHE_BYTES
+            self.threads = []
+            self.done = threading.Event()
+            self.done.set()
+            self.started = None
+            self.warmTime = None
+            self.warmed = 0
+            self.warmedBytes = 0
+            self.failed = 0
+
+        def start(self, paths, workers=PRELOAD_WORKERS, encode=None,
+                encodedBytes=NETASCII_CACHE_BYTES):
+            """Warms paths using workers threads in manifest order, except
+            that paths clients request meanwhile are warmed first. encode,
+            when given, pre-encodes each file for netascii transfers.
+            Returns immediately; wait() blocks until warm-up finishes.
+            """
+            with self.mutex:
+                self.encode = encode
+                self.encodedLimit = encodedBytes
+                self.started = time.monotonic()
+                self.warmTime = None
+                for path in paths:
+                    if path not in self.pending:
+                        self._push(PRIORITY_MANIFEST, path)
+                if not self.pending:
+                    self.warmTime = 0.0
+                    return
+                self.done.clear()
+                self.threads = [
+                    threading.Thread(
+                        target=self.run, name='preload', daemon=True)
+                    for i in range(min(workers, len(self.pending)))]
+            for thread in self.threads:
+                thread.start()
+
+        def wait(self, timeout=None):
+            """Returns the warm-up time in seconds once every queued file is
+            warm, or None on timeout
+            """
+            self.done.wait(timeout)
+            return self.warmTime
+
+        def requested(self, path):
+            """Moves path to the front of the queue if it's still waiting"""
+            if path not in self.pending:
+                return
+            with self.mutex:
+                if path in self.pending:
+                    self._push(PRIORITY_REQUESTED, path)
+
+        def netascii(self, path, version):
+            """Returns the pre-encoded netascii form of version of path, or
+            None if it hasn't been encoded
+            """
+            entry = self.encoded.get(path)
+            if entry is None:
+                return None
+            if entry[0] != version:
+                with self.mutex:
+                    if self.encoded.get(path) is entry:
+                        del self.encoded[path]
+                        self.encodedBytes -= len(entry[1])
+                return None
+            return entry[1]
+
+        def _push(self, priority, path):
+            """Caller must hold the mutex"""
+            self.sequence += 1
+            heapq.heappush(self.queue, (priority, self.sequence, path))
+            self.pending.add(path)
+
+        def run(self):
+            try:
+                while True:
+                    with self.mutex:
+                        # Requested paths leave a stale entry behind in the queue
+                        while self.queue and self.queue[0][2] not in self.pending:
+                            heapq.heappop(self.queue)
+                        if not self.queue:
+                            break
+                        priority, sequence, path = heapq.heappop(self.queue)
+                        self.pending.discard(path)
+                    try:
+                        nbytes = self.warm(path)
+                    except Exception as ex:
+                        # A corrupt file mustn't stop the rest being warmed
+                        logging.warning("Failed to preload '{0}': {1}".format(path, ex))
+                        with self.mutex:
+                            self.failed += 1
+                        continue
+                    with self.mutex:
+                        self.warmed += 1
+                        self.warmedBytes += nbytes
+                    logging.debug("Preloaded '{0}' [{1}] bytes".format(path, nbytes))
+            finally:
+                with self.mutex:
+                    if self._lastWorker():
+                        self.warmTime = time.monotonic() - self.started
+                        self.done.set()
+                        logging.info(
+                            "Preloaded [{0}] files, [{1}] bytes in [{2:.3f}] ms, [{3}] failed"\
+                            .format(self.warmed, self.warmedBytes,
+                                self.warmTime * 1000, self.failed))
+
+        def _lastWorker(self):
+            """Returns True once the calling worker is the last one running.
+            Caller must hold the mutex.
+            """
+            self.threads = [
+                t for t in self.threads if t is not threading.current_thread()]
+            return not self.threads
+
+        def warm(self, path):
+            """Loads path into the caches and returns its size in bytes"""
+            snapshot = storage.Storage().acquire(path, stream=True)
+            try:
+                # Files served from the root directory may change on disk,
+                # so only versioned files are pre-encoded
+                encode = self.encode if snapshot.version is not None else None
+                data = snapshot.data
+                size = data.size if isinstance(data, persist.Record) else len(data)
+                # Encoding never shrinks a file, so don't encode one that
+                # can't fit in what's left of the budget
+                if encode and not self._fits(size):
+                    encode = None
+                if isinstance(data, persist.Record):
+                    if not encode:
+                        self._pageIn(data)
+                        return data.size
+                    data = data.read()
+
+                if encode:
+                    encoded = bytes(encode(data))
+                    with self.mutex:
+                        if self.encodedBytes + len(encoded) <= self.encodedLimit:
+                            old = self.encoded.get(path)
+                            if old:
+                                self.encodedBytes -= len(old[1])
+                            self.encoded[path] = (snapshot.version, encoded)
+                            self.encodedBytes += len(encoded)
+                return len(data)
+            finally:
+                snapshot.release()
+
+        def _fits(self, nbytes):
+            """Returns True if nbytes more of encoded files fit the budget"""
+            with self.mutex:
+                return self.encodedBytes + nbytes <= self.encodedLimit
+
+        def _pageIn(self, record):
+            """Asks the OS to read an on-disk file into the page cache"""
+            if hasattr(os, 'posix_fadvise'):
+                os.posix_fadvise(
+                    record.segment.fd, record.offset, record.length,
+                    os.POSIX_FADV_WILLNEED)
+            else:
+                record.read()
+
+        def stats(self):
+            with self.mutex:
+                return {
+                    'pending': len(self.pending),
+                    'warmed': self.warmed,
+                    'warmedBytes': self.warmedBytes,
+                    'failed': self.failed,
+                    'encodedBytes': self.encodedBytes,
+                    'warmTime': self.warmTime}
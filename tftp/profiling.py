@@ -0,0 +1,188 @@
+import argparse
+import cProfile
+import glob
+import json
+import logging
+import os
+import pstats
+import threading
+import time
+
+class NullTimer(object):
+    """Stands in for a PhaseTimer when profiling is disabled so the
+    transfer loops can call it unconditionally at negligible cost.
+    """
+    def begin(self, phase):
+        pass
+
+    def end(self, phase):
+        pass
+
+    def mark(self, phase):
+        pass
+
+    def finish(self):
+        pass
+
+NULL_TIMER = NullTimer()
+
+class PhaseTimer(object):
+    """Accumulates the time a single session spends in each phase.
+    begin/end pairs may repeat, e.g. once per DATA packet sent; mark
+    records the time elapsed since the session started.
+    """
+    def __init__(self, profiler, kind, address, filename, profile=None):
+        self.profiler = profiler
+        self.kind = kind
+        self.address = address
+        self.filename = filename
+        self.profile = profile
+        self.started = time.perf_counter()
+        self.pending = {}
+        self.totals = {}
+        self.counts = {}
+
+    def begin(self, phase):
+        self.pending[phase] = time.perf_counter()
+
+    def end(self, phase):
+        elapsed = time.perf_counter() - self.pending.pop(phase)
+        self.totals[phase] = self.totals.get(phase, 0.0) + elapsed
+        self.counts[phase] = self.counts.get(phase, 0) + 1
+
+    def mark(self, phase):
+        if phase not in self.totals:
+            self.totals[phase] = time.perf_counter() - self.started
+            self.counts[phase] = 1
+
+    def finish(self):
+        self.totals['total'] = time.perf_counter() - self.started
+        self.counts['total'] = 1
+        if self.profile:
+            self.profile.disable()
+        self.profiler.record(self)
+
+class Profiler(object):
+    """Maintains a singleton of the profiling configuration and the
+    per-phase timings aggregated across finished sessions.
+    """
+    __instance = None
+
+    def __new__(cls):
+        if not Profiler.__instance:
+            Profiler.__instance = Profiler.__Profiler()
+        return Profiler.__instance
+
+    class __Profiler():
+        def __init__(self):
+            self.enabled = False
+            self.sampleEvery = 0
+            self.directory = None
+            self.sessions = 0
+            self.totals = {}
+            self.counts = {}
+            self.mutex = threading.Lock()
+
+        def configure(self, enabled=True, sampleEvery=0, directory=None):
+            """Enables per-phase timing of sessions. When sampleEvery and
+            directory are set, every sampleEvery-th session is also run under
+            cProfile and its stats written to directory.
+            """
+            if sampleEvery and not directory:
+                raise ValueError("Sampled profiles need a directory")
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with self.mutex:
+                self.enabled = enabled
+                self.sampleEvery = sampleEvery
+                self.directory = directory
+
+        def session(self, kind, address, filename):
+            """Returns a timer for a new session; NULL_TIMER when disabled"""
+            if not self.enabled:
+                return NULL_TIMER
+            with self.mutex:
+                self.sessions += 1
+                sample = self.sampleEvery and self.sessions % self.sampleEvery == 0
+
+            profile = None
+            if sample:
+                profile = cProfile.Profile()
+                try:
+                    profile.enable()
+                except ValueError:
+                    # Another profiler already owns the interpreter
+                    profile = None
+            return PhaseTimer(self, kind, address, filename, profile)
+
+        def record(self, timer):
+            with self.mutex:
+                for phase, elapsed in timer.totals.items():
+                    key = (timer.kind, phase)
+                    self.totals[key] = self.totals.get(key, 0.0) + elapsed
+                    self.counts[key] = self.counts.get(key, 0) + timer.counts[phase]
+                directory = self.directory
+
+            logging.debug(
+                "Client [{0}:{1}]: {2} '{3}' phase timings {4}"\
+                .format(*timer.address, timer.kind, timer.filename,
+                    {k: round(v * 1000, 3) for k, v in timer.totals.items()}))
+
+            if timer.profile and directory:
+                name = os.path.join(directory, "{0}-{1}-{2}".format(
+                    timer.kind, int(time.time() * 1000), threading.get_ident()))
+                timer.profile.dump_stats(name + '.prof')
+                with open(name + '.json', 'w') as f:
+                    json.dump({
+                        'kind': timer.kind,
+                        'filename': str(timer.filename),
+                        'phases': timer.totals}, f)
+
+        def stats(self):
+            """Returns {kind: {phase: (total seconds, count)}}"""
+            with self.mutex:
+                out = {}
+                for (kind, phase), total in self.totals.items():
+                    out.setdefault(kind, {})[phase] = (total, self.counts[(kind, phase)])
+                return out
+
+def summarize(directory, sort='cumulative', limit=30):
+    """Prints the aggregate of every profile captured in directory along
+    with the mean time spent in each phase by the sampled sessions.
+    """
+    profiles = sorted(glob.glob(os.path.join(directory, '*.prof')))
+    if not profiles:
+        print("No profiles found in '{}'".format(directory))
+        return
+
+    phases = {}
+    for path in glob.glob(os.path.join(directory, '*.json')):
+        with open(path) as f:
+            capture = json.load(f)
+        for phase, elapsed in capture['phases'].items():
+            phases.setdefault((capture['kind'], phase), []).append(elapsed)
+
+    print("Mean phase timings over sampled sessions:")
+    for (kind, phase), values in sorted(phases.items()):
+        print("  {0:<4} {1:<12} {2:10.3f} ms  ({3} sessions)".format(
+            kind, phase, sum(values) / len(values) * 1000, len(values)))
+    print()
+
+    stats = pstats.Stats(*profiles)
+    print("Aggregated {} profiles:".format(len(profiles)))
+    stats.sort_stats(sort).print_stats(limit)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='profiling.py',
+        description="Summarize sampled session profiles")
+    sub = parser.add_subparsers(dest='command', required=True)
+    s = sub.add_parser('summary', help="aggregate captured profiles")
+    s.add_argument('directory')
+    s.add_argument('--sort', default='cumulative')
+    s.add_argument('--limit', type=int, default=30)
+    args = parser.parse_args(argv)
+    summarize(args.directory, args.sort, args.limit)
+
+if __name__ == '__main__':
+    main()
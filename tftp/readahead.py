@@ -0,0 +1,151 @@
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Files are read from disk in chunks of this many bytes
+CHUNK_BYTES = 64 * 1024
+# Bounds on how many chunks ahead of the client are read
+READ_AHEAD_MIN = 1
+READ_AHEAD_MAX = 32
+# Threads shared by every transfer for reading ahead
+READ_AHEAD_WORKERS = 4
+# Idle chunk buffers kept for reuse
+BUFFER_POOL_SIZE = 256
+
+# Weight given to the newest sample in moving averages
+EWMA_WEIGHT = 0.2
+
+class BufferPool(object):
+    """Recycles fixed-size bytearrays so chunk reads don't allocate"""
+    def __init__(self, size, limit=BUFFER_POOL_SIZE):
+        self.size = size
+        self.limit = limit
+        self.free = []
+        self.mutex = threading.Lock()
+
+    def get(self):
+        with self.mutex:
+            if self.free:
+                return self.free.pop()
+        return bytearray(self.size)
+
+    def put(self, buf):
+        with self.mutex:
+            if len(self.free) < self.limit:
+                self.free.append(buf)
+
+_pool = BufferPool(CHUNK_BYTES)
+_executor = None
+_executorMutex = threading.Lock()
+
+def executor():
+    """Returns the thread pool shared by all read-ahead pipelines"""
+    global _executor
+    with _executorMutex:
+        if not _executor:
+            _executor = ThreadPoolExecutor(
+                READ_AHEAD_WORKERS, thread_name_prefix='readahead')
+        return _executor
+
+def ewma(average, sample):
+    return sample if average is None else average + EWMA_WEIGHT * (sample - average)
+
+class ReadAhead(object):
+    """Serves slices of an on-disk file while reading the chunks after the
+    current one in the background.
+
+    Looks like a bytes object to the RRQ loop: len() is the file size and
+    slices within a chunk return a view of it. The number of chunks read
+    ahead adapts so that a chunk is normally ready by the time the client's
+    ACKs reach it: the slower the disk relative to the ACK rate, the deeper.
+    """
+    def __init__(self, record, blockSize, minDepth=READ_AHEAD_MIN,
+            maxDepth=READ_AHEAD_MAX):
+        self.fd = record.segment.fd
+        # Keeps the Segment, and so the descriptor, open while reading
+        self.segment = record.segment
+        self.offset = record.offset
+        self.length = record.length
+        self.blockSize = blockSize
+        self.chunkBytes = CHUNK_BYTES - CHUNK_BYTES % blockSize
+        self.chunks = math.ceil(self.length / self.chunkBytes)
+        self.minDepth = minDepth
+        self.maxDepth = maxDepth
+        self.depth = minDepth
+        self.pending = {}
+        self.current = None
+        self.currentIndex = None
+        self.lastAdvance = None
+        self.chunkInterval = None
+        self.readLatency = None
+        self.waits = 0
+        self.reads = 0
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            raise TypeError("ReadAhead only supports slicing")
+        start, stop, step = key.indices(self.length)
+        if stop <= start:
+            return b''
+        index, within = divmod(start, self.chunkBytes)
+        if step != 1 or within + (stop - start) > self.chunkBytes:
+            return os.pread(self.fd, stop - start, self.offset + start)
+
+        if index != self.currentIndex:
+            self._advance(index)
+        buf, n = self.current
+        return memoryview(buf)[within:min(stop - start + within, n)]
+
+    def _advance(self, index):
+        """Makes chunk index current, waiting for it if necessary, and reads
+        ahead of it. The previous chunk's buffer is recycled as the client
+        has moved past it.
+        """
+        now = time.monotonic()
+        if self.lastAdvance is not None:
+            self.chunkInterval = ewma(self.chunkInterval, now - self.lastAdvance)
+        self.lastAdvance = now
+
+        future = self.pending.pop(index, None)
+        if future is None:
+            future = executor().submit(self._read, index)
+        if not future.done():
+            self.waits += 1
+        chunk = future.result()
+        if self.current:
+            _pool.put(self.current[0])
+        self.current = chunk
+        self.currentIndex = index
+
+        if self.chunkInterval and self.readLatency:
+            # Chunks the client gets through while one chunk is being read
+            self.depth = max(self.minDepth, min(
+                self.maxDepth, math.ceil(self.readLatency / self.chunkInterval) + 1))
+        for i in range(index + 1, min(index + 1 + self.depth, self.chunks)):
+            if i not in self.pending:
+                self.pending[i] = executor().submit(self._read, i)
+
+    def _read(self, index):
+        buf = _pool.get()
+        start = time.monotonic()
+        n = os.preadv(self.fd, [buf], self.offset + index * self.chunkBytes)
+        n = min(n, self.length - index * self.chunkBytes)
+        self.readLatency = ewma(self.readLatency, time.monotonic() - start)
+        self.reads += 1
+        return (buf, n)
+
+    def close(self):
+        """Returns every buffer to the pool, abandoning reads in flight"""
+        for future in self.pending.values():
+            if not future.cancel():
+                future.add_done_callback(lambda f: _pool.put(f.result()[0]))
+        self.pending = {}
+        if self.current:
+            _pool.put(self.current[0])
+            self.current = None
+            self.currentIndex = None
@@ -1,10 +1,39 @@
+import errno
 import logging
 import socketserver
 import socket
+import time
+from collections import OrderedDict
+import config
+import persist
+import preload
+import profiling
+import readahead
+import sessions
+import shaping
+import sockpool
 import storage
+import upstream
+import virtual
 
 DATA_BLOCK_SIZE = 512
 MAX_PACKET_SEND_ATTEMPTS = 10
+# Largest packet read from a transfer socket
+PACKET_BUFFER_SIZE = 1024
+# Seconds to wait for the client before retransmitting
+TRANSFER_TIMEOUT = 1.0
+# Whether a WRQ may replace an existing file: 'never', 'always', or only
+# when the request carries the overwrite option ('request')
+OVERWRITE_POLICY = 'never'
+
+OverwritePolicies = ('never', 'request', 'always')
+
+# ERROR replies to rejected datagrams allowed per source address per second,
+# with bursts of up to ERROR_REPLY_BURST
+ERROR_REPLY_RATE = 5
+ERROR_REPLY_BURST = 10
+# Source addresses whose ERROR reply rate is tracked at once
+ERROR_REPLY_SOURCES = 4096
 
 class ErrorUnknownOpcode(Exception):
     pass
@@ -51,6 +80,9 @@ Errors = {
     0x06: 'FILE_EXISTS',
     0x07: 'NO_SUCH_USER'}
 
+# Storage write failures reported to the client as ALLOCATION_EXCEEDED
+DiskFullErrors = (errno.ENOSPC, errno.EDQUOT)
+
 Modes = {
     'OCTET': 'octet',
     'NETASCII': 'netascii',
@@ -89,6 +121,25 @@ def packDATA(data, blockNum):
         b.extend(data)
     return b
 
+def unpackERROR(packet):
+    """Returns tuple of (Opcode, ErrorCode, Message)
+    Raises ErrorIllegalOperation when passed a non-ERROR packet
+    Raises ErrorMalformedPacket if packet is missized
+    """
+    opcode = unpackOpcode(packet)
+    if opcode != Opcodes['ERROR']:
+        raise ErrorIllegalOperation(
+            "Expected ERROR packet, but got '{0}'"\
+            .format(Opcodes[opcode]))
+
+    if len(packet) < 4:
+        raise ErrorMalformedPacket("Error packet missing error code")
+
+    code = int.from_bytes(packet[2:4], 'big')
+    end = packet.find(0, 4)
+    msg = packet[4:end if end >= 4 else None].decode('utf-8', 'replace')
+    return (opcode, code, msg)
+
 def unpackDATA(packet):
     """Returns tuple of (Opcode, BlockNum, Data)
     Raises ErrorIllegalOperation when passed a non-DATA packet
@@ -107,6 +158,29 @@ def unpackDATA(packet):
     data = packet[4:]
     return (opcode, blockNum, data)
 
+def packRWRQ(opcode, filename, mode, options=None):
+    """Returns a byte-formatted RRQ or WRQ packet. options is an optional
+    dictionary of RFC-2347 option names to values appended after mode.
+    Raises ErrorIllegalOperation when opcode is not RRQ or WRQ
+    """
+    if opcode not in (Opcodes['RRQ'], Opcodes['WRQ']):
+        raise ErrorIllegalOperation(
+            "Expected RRQ or WRQ but got '{0}'"\
+            .format(Opcodes.get(opcode, opcode)))
+
+    b = bytearray()
+    b.extend(opcode.to_bytes(2, 'big'))
+    b.extend(bytes(filename, 'utf-8'))
+    b.append(0)
+    b.extend(bytes(mode, 'utf-8'))
+    b.append(0)
+    for name, value in (options or {}).items():
+        b.extend(bytes(name, 'utf-8'))
+        b.append(0)
+        b.extend(bytes(str(value), 'utf-8'))
+        b.append(0)
+    return b
+
 def unpackRWRQ(packet):
     """Returns a tuple of (Opcode, Filename, Mode)
     Raises ErrorIllegalOperation when passed a non-RRQ/WRQ packet
@@ -139,6 +213,29 @@ def unpackRWRQ(packet):
             .format(mode))
     return (opcode, filename, mode.lower())
 
+def unpackOptions(packet):
+    """Returns a dictionary of the RFC-2347 options following the mode in
+    an RRQ or WRQ packet, with lower-cased names. An incomplete trailing
+    option is ignored.
+    """
+    fields = bytes(packet[2:]).split(b'\x00')[2:-1]
+    options = {}
+    for i in range(0, len(fields) - 1, 2):
+        name = fields[i].decode('utf-8', 'replace').lower()
+        options[name] = fields[i + 1].decode('utf-8', 'replace')
+    return options
+
+def allowOverwrite(options, policy=None):
+    """Returns whether a WRQ with options may replace an existing file
+    under policy, by default OVERWRITE_POLICY
+    """
+    policy = policy or OVERWRITE_POLICY
+    if policy == 'always':
+        return True
+    if policy == 'request':
+        return options.get('overwrite', '').lower() in ('1', 'true', 'yes')
+    return False
+
 def unpackACK(packet):
     """Returns a tuple of (Opcode, BlockNum)
     Raises ErrorIllegalOperation if passed a non-ACK packet
@@ -227,36 +324,144 @@ def decodeNetascii(data):
             out.append(b)
     return out
 
-def handleRRQ(address, sock, filename, mode):
+def receive(sock, address, bufferSize=PACKET_BUFFER_SIZE):
+    """Returns the next packet sent to sock from address, answering packets
+    from anywhere else with UNKNOWN_TRANSFER_ID. Pooled sockets may still
+    receive retransmissions meant for the session that used them before.
+    Returns an empty packet on timeout or once sock is shut down.
+    """
+    while True:
+        try:
+            packet, source = sock.recvfrom(bufferSize)
+        except (socket.timeout, ConnectionRefusedError):
+            # Refused when an ICMP error shows the client has gone away
+            return b''
+        if not packet or source == address:
+            return packet
+        err = packERROR(
+            Errors['UNKNOWN_TRANSFER_ID'],
+            "Unknown transfer ID")
+        try:
+            sock.sendto(err, source)
+        except OSError:
+            pass
+        logClientError(source, "Unknown transfer ID")
+
+def dally(address, sock, ack, timeout=TRANSFER_TIMEOUT,
+        bufferSize=PACKET_BUFFER_SIZE):
+    """Waits one timeout after the final ACK of a WRQ, ACKing again if the
+    client resends its last DATA because the ACK was lost
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        sock.settimeout(remaining)
+        packet = receive(sock, address, bufferSize)
+        if not packet:
+            return
+        if packet[:4] == packDATA(None, int.from_bytes(ack[2:4], 'big')):
+            sock.sendto(ack, address)
+
+def abortSession(address, sock, session):
+    """Tells the client of a session aborted by the reaper why it ended"""
+    err = packERROR(
+        Errors['NOT_DEFINED'],
+        session.aborted)
+    try:
+        sock.sendto(err, address)
+    except OSError:
+        pass
+    logClientError(address, session.aborted)
+
+def handleRRQ(address, sock, filename, mode, timer=profiling.NULL_TIMER,
+        session=None, conf=None):
     """Acknowledges RRQ packet by sending DATA packets.
     Each DATA packet is 4 header bytes + 512 bytes long, except for the last
     packet which is 4 header bytes + (0 <= data bytes < 512).
     Each transmitted DATA packet expects to receive a corresponding ACK packet.
+    conf is the server's config.Config, by default the module settings.
     """
     logging.info(
         "Client [{0}:{1}] requested to read file [{2}] using transfer mode [{3}]"\
         .format(*address, filename, mode))
     store = storage.Storage()
+    if conf is None:
+        conf = config.Config()
+    if session is None:
+        session = sessions.Session('RRQ', address, filename, sock)
+    preloader = preload.Preloader()
+    preloader.requested(filename)
 
     try:
-        file = store.get(filename)
-    except (storage.ErrorFileNotFound, storage.ErrorEmptyPath) as ex:
+        timer.begin('lookup')
+        file = virtual.VirtualFiles().render(address, filename)
+        if file is None:
+            try:
+                # Held until the session ends so a WRQ replacing the file
+                # doesn't disturb this transfer
+                session.snapshot = store.acquire(filename, stream=True)
+                file = session.snapshot.data
+            except storage.ErrorFileNotFound:
+                # Read through to the upstream server, if there is one,
+                # streaming the file to the client as it arrives
+                file = upstream.Upstream().fetch(filename)
+                if file is None:
+                    raise
+        timer.end('lookup')
+    except storage.ErrorFileNotFound as ex:
+        # Let the listening socket answer further requests for it
+        store.markMissing(filename)
         err = packERROR(
             Errors['FILE_NOT_FOUND'],
             str(ex))
         sock.sendto(err, address)
         logClientError(address, ex)
         return
+    except storage.ErrorEmptyPath as ex:
+        err = packERROR(
+            Errors['FILE_NOT_FOUND'],
+            str(ex))
+        sock.sendto(err, address)
+        logClientError(address, ex)
+        return
+    except (virtual.ErrorRenderFailed, upstream.ErrorUpstreamFailed) as ex:
+        err = packERROR(
+            Errors['NOT_DEFINED'],
+            str(ex))
+        sock.sendto(err, address)
+        logClientError(address, ex)
+        return
+
+    # Files on disk are read a chunk at a time ahead of the client, except
+    # in netascii mode where encoding shifts block boundaries
+    if isinstance(file, upstream.Fill):
+        if mode == Modes['NETASCII']:
+            file = file.result()
+    elif isinstance(file, persist.Record):
+        if mode == Modes['NETASCII']:
+            file = file.read()
+        else:
+            file = readahead.ReadAhead(
+                file, DATA_BLOCK_SIZE, conf.readAheadMin, conf.readAheadMax)
+            session.reader = file
 
     if mode == Modes['NETASCII']:
-        file = encodeNetascii(file)
+        encoded = None
+        if session.snapshot:
+            encoded = preloader.netascii(filename, session.snapshot.version)
+        if encoded is None:
+            timer.begin('encode')
+            encoded = encodeNetascii(file)
+            timer.end('encode')
+        file = encoded
 
     data = None
     sendDATA = False
     readACK = False
     dataBlock = 0
     ackBlock = 0
-    fileSize = len(file)
     sendCount = 0
     # start and end are initially incremented by 512 to give file[0:512] slice
     start = -512
@@ -269,17 +474,30 @@ def handleRRQ(address, sock, filename, mode):
             dataBlock += 1
             start += 512
             end += 512
-            if end > fileSize:
-                end = None
 
-            data = packDATA(file[start:end], dataBlock)
+            timer.begin('pack')
+            try:
+                chunk = file[start:end]
+            except upstream.ErrorUpstreamFailed as ex:
+                err = packERROR(
+                    Errors['NOT_DEFINED'],
+                    str(ex))
+                sock.sendto(err, address)
+                logClientError(address, ex)
+                return
+            # A short block, possibly empty, ends the transfer. Files still
+            # being fetched from upstream don't know their size up front.
+            if len(chunk) < DATA_BLOCK_SIZE:
+                end = None
+            data = packDATA(chunk, dataBlock)
+            timer.end('pack')
             sendDATA = True
             logging.debug(
                 "Client [{0}:{1}]: Creating datablock [{2}] on file {3}[{4}:{5}]"\
                 .format(*address, dataBlock, filename, start, end))
 
         # Don't loop forever trying to send the same data packet
-        if sendCount >= MAX_PACKET_SEND_ATTEMPTS:
+        if sendCount >= conf.maxSendAttempts:
             err = packERROR(
                 Errors['ACCESS_VIOLATION'],
                 "Maximum number of packet send attempts reached: [{}]"\
@@ -296,7 +514,14 @@ def handleRRQ(address, sock, filename, mode):
             logging.debug(
                 "Client [{0}:{1}]: Sending datablock [{2}]"\
                 .format(*address, dataBlock))
+            timer.begin('throttle')
+            session.flow.throttle(len(data))
+            timer.end('throttle')
+            timer.begin('send')
             sock.sendto(data, address)
+            sentAt = time.monotonic()
+            timer.end('send')
+            timer.mark('firstBlock')
             sendDATA = False
             readACK = True
             sendCount += 1
@@ -306,7 +531,12 @@ def handleRRQ(address, sock, filename, mode):
             logging.debug(
                 "Client [{0}:{1}]: Waiting for ACK for datablock [{2}]"\
                 .format(*address, dataBlock))
-            packet = sock.recv(1024)
+            timer.begin('ackWait')
+            packet = receive(sock, address, conf.packetBuffer)
+            timer.end('ackWait')
+            if session.aborted:
+                abortSession(address, sock, session)
+                return
             if not packet:
                 # If we've timed out waiting for ACK, resend DATA
                 readACK = False
@@ -315,6 +545,7 @@ def handleRRQ(address, sock, filename, mode):
                     "Client [{0}:{1}]: Timed out waiting for ACK [{2}]. Resending data."\
                     .format(*address, dataBlock))
             else:
+                session.touch()
                 try:
                     opcode, block = unpackACK(packet)
                     # Ignore all ACKs other than for current block
@@ -327,9 +558,13 @@ def handleRRQ(address, sock, filename, mode):
                             .format(*address, block))
                     else:
                         logging.debug(
-                            "Client [{0}:{1}]: Received ACK [{2}] for datablock [{3}]"\
-                            + " Still waiting for ACK [{2}]"\
+                            "Client [{0}:{1}]: Received ACK [{2}] Still waiting for ACK [{3}]"\
                             .format(*address, block, dataBlock))
+                        # A client resending its last ACK mustn't hold off our
+                        # retransmission, nor trigger one early
+                        if time.monotonic() - sentAt >= conf.transferTimeout:
+                            readACK = False
+                            sendDATA = True
                 except ErrorIllegalOperation as ex:
                     err = packERROR(
                         Errors['ILLEGAL_OPERATION'],
@@ -343,21 +578,28 @@ def handleRRQ(address, sock, filename, mode):
             logging.debug(
                 "Client [{0}:{1}]: Finished sending file {2}"\
                 .format(*address, filename))
-            sock.close()
+            store.served()
             return
 
 
-def handleWRQ(address, sock, filename, mode):
+def handleWRQ(address, sock, filename, mode, timer=profiling.NULL_TIMER,
+        session=None, overwrite=False, conf=None):
     """Acknowleges WRQ request by sending ACK[0] packet to client.
     Reads DATA from sock until len(DATA) < 512.
     ACKs each DATA packet with DATA's block number.
+    With overwrite, an existing file is replaced by a new version.
+    conf is the server's config.Config, by default the module settings.
     """
     logging.info(
         "Client [{0}:{1}] requested to put file [{2}] using transfer mode [{3}]"\
         .format(*address, filename, mode))
     store = storage.Storage()
+    if conf is None:
+        conf = config.Config()
+    if session is None:
+        session = sessions.Session('WRQ', address, filename, sock)
 
-    if filename in store.store:
+    if filename in store.store and not overwrite:
         err = packERROR(
             Errors['FILE_EXISTS'],
             "File '{}' already exists".format(filename))
@@ -368,6 +610,8 @@ def handleWRQ(address, sock, filename, mode):
         return
 
     file = bytearray()
+    session.buffer = file
+    session.allocation = store.allocate(filename)
     ackBlock = -1
     dataBlock = 0
     sendCount = 0
@@ -391,7 +635,9 @@ def handleWRQ(address, sock, filename, mode):
                 logging.debug(
                     "Client [{0}:{1}]: Sending ACK [{2}]"\
                     .format(*address, ackBlock))
+                timer.begin('send')
                 sock.sendto(ack, address)
+                timer.end('send')
                 sendCount += 1
                 sendACK = False
                 readDATA = True
@@ -402,18 +648,13 @@ def handleWRQ(address, sock, filename, mode):
             # File transfer is terminated by acknowledging the last data packet
             if terminateTransfer:
                 logging.debug(
-                    "Client [{0}:{1}]: Terminating transfer. Writing [{2}] bytes of '{3}'"\
-                    .format(*address, len(file), filename))
-
-                sock.close()
-                if mode == Modes['NETASCII']:
-                    file = decodeNetascii(file)
-
-                store.put(filename, file)
+                    "Client [{0}:{1}]: Terminated transfer of '{2}'"\
+                    .format(*address, filename))
+                dally(address, sock, ack, conf.transferTimeout, conf.packetBuffer)
                 return
 
         # Don't try and send ACK packets for ever...
-        if sendCount >= MAX_PACKET_SEND_ATTEMPTS:
+        if sendCount >= conf.maxSendAttempts:
             err = packERROR(
                 Errors['ACCESS_VIOLATION'],
                 "Maximum number of packet send attempts reached: [{}]"\
@@ -432,8 +673,19 @@ def handleWRQ(address, sock, filename, mode):
 
         # Read DATA
         if readDATA:
-            packet = sock.recv(1024)
-            if packet:
+            timer.begin('dataWait')
+            packet = receive(sock, address, conf.packetBuffer)
+            timer.end('dataWait')
+            if session.aborted:
+                abortSession(address, sock, session)
+                return
+            if not packet:
+                # Our ACK or the client's DATA was lost; ACK again
+                sendACK = True
+                logging.debug(
+                    "Client [{0}:{1}]: Timed out waiting for DATA [{2}]. Resending ACK."\
+                    .format(*address, dataBlock + 1))
+            else:
                 try:
                     opcode, block, chunk = unpackDATA(packet)
                 except (ErrorMalformedPacket, ErrorIllegalOperation) as ex:
@@ -448,18 +700,74 @@ def handleWRQ(address, sock, filename, mode):
                     logging.debug(
                         "Client [{0}:{1}]: Reading DATA [{2}]"\
                         .format(*address, block))
+                    session.touch()
                     sendCount = 0
                     dataBlock = block
                     # Chunk could be zero-length if last packet
                     if chunk:
+                        try:
+                            session.allocation.grow(len(chunk))
+                        except storage.ErrorAllocationExceeded as ex:
+                            file.clear()
+                            err = packERROR(
+                                Errors['ALLOCATION_EXCEEDED'],
+                                str(ex))
+                            sock.sendto(err, address)
+                            logClientError(address, ex)
+                            return
                         file.extend(chunk)
 
                     if len(chunk) < DATA_BLOCK_SIZE:
                         terminateTransfer = True
+                        # Commit the file before the final ACK so it is
+                        # readable as soon as the client sees the ACK
+                        logging.debug(
+                            "Client [{0}:{1}]: Terminating transfer. Writing [{2}] bytes of '{3}'"\
+                            .format(*address, len(file), filename))
+                        if not session.commit():
+                            abortSession(address, sock, session)
+                            return
+                        if mode == Modes['NETASCII']:
+                            timer.begin('decode')
+                            file = decodeNetascii(file)
+                            timer.end('decode')
+                        try:
+                            timer.begin('commit')
+                            store.put(
+                                filename, file, session.allocation, overwrite)
+                            timer.end('commit')
+                        except storage.ErrorFileExists as ex:
+                            err = packERROR(
+                                Errors['FILE_EXISTS'],
+                                str(ex))
+                            sock.sendto(err, address)
+                            logClientError(address, ex)
+                            return
+                        except storage.ErrorAllocationExceeded as ex:
+                            err = packERROR(
+                                Errors['ALLOCATION_EXCEEDED'],
+                                str(ex))
+                            sock.sendto(err, address)
+                            logClientError(address, ex)
+                            return
+                        except (OSError, persist.ErrorCorruptJournal) as ex:
+                            logging.error(
+                                "Failed to store '{0}': {1}".format(filename, ex))
+                            if getattr(ex, 'errno', None) in DiskFullErrors:
+                                code = Errors['ALLOCATION_EXCEEDED']
+                            else:
+                                code = Errors['NOT_DEFINED']
+                            err = packERROR(code, "Failed to store file")
+                            sock.sendto(err, address)
+                            logClientError(address, ex)
+                            return
                 else:
                     logging.debug(
                         "Client [{0}:{1}]: Received duplicate DATA [{2}] Still waiting for DATA [{3}]"\
                         .format(*address, block, dataBlock + 1))
+                    # The client didn't see our ACK for it
+                    if block == dataBlock:
+                        sendACK = True
 
 class Handler(socketserver.BaseRequestHandler):
     """Main TFTP socketserver handler class"""
@@ -483,7 +791,8 @@ class Handler(socketserver.BaseRequestHandler):
             sock.sendto(err, self.client_address)
             logClientError(self.client_address, err)
             return
-        except (ErrorIllegalOperation, ErrorUnknownOpcode) as ex:
+        except (ErrorIllegalOperation, ErrorUnknownOpcode,
+                ErrorMalformedPacket) as ex:
             err = packERROR(
                 Errors['ILLEGAL_OPERATION'],
                 str(ex))
@@ -491,12 +800,133 @@ class Handler(socketserver.BaseRequestHandler):
             logClientError(self.client_address, err)
             return
 
-        # Create a new UDP socket for remainder of session
-        stid = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        host = self.server.server_address[0]
-        stid.bind((host, 0))
+        # Settings are fixed for the session even if the server reloads
+        conf = getattr(self.server, 'config', None) or config.Config()
+
+        # Use a separate UDP socket for remainder of session
+        pool = sockpool.SocketPool()
+        stid = pool.checkout(self.server.server_address[0])
+        stid.settimeout(conf.transferTimeout)
 
+        timer = profiling.Profiler().session(
+            Opcodes[opcode], self.client_address, filename)
+        session = sessions.Session(
+            Opcodes[opcode], self.client_address, filename, stid)
         if opcode == Opcodes['RRQ']:
-            handleRRQ(self.client_address, stid, filename, mode)
+            session.flow = shaping.Shaper().open(self.client_address)
+        reaper = sessions.Reaper()
+        reaper.register(session)
+        try:
+            if opcode == Opcodes['RRQ']:
+                handleRRQ(self.client_address, stid, filename, mode, timer,
+                    session, conf)
+            else:
+                handleWRQ(self.client_address, stid, filename, mode, timer,
+                    session, allowOverwrite(unpackOptions(packet), conf.overwrite),
+                    conf)
+        except OSError:
+            # Sends race with the reaper shutting the socket down
+            if not session.aborted:
+                raise
+        finally:
+            reaper.unregister(session)
+            session.flow.close()
+            if session.allocation:
+                session.allocation.release()
+            if session.reader:
+                session.reader.close()
+            if session.snapshot:
+                session.snapshot.release()
+            pool.checkin(stid, reusable=not session.aborted)
+            timer.finish()
+
+class Server(socketserver.ThreadingUDPServer):
+    """ThreadingUDPServer that validates datagrams on the listening socket
+    and only starts a thread for well-formed RRQ and WRQ packets. Anything
+    else is answered with a rate-limited ERROR, or dropped if it is itself
+    an ERROR.
+
+    Handlers are configured by conf, a config.Config, which reload()
+    replaces while the server runs.
+    """
+    def __init__(self, server_address, RequestHandlerClass=Handler,
+            bind_and_activate=True, conf=None):
+        super().__init__(server_address, RequestHandlerClass, bind_and_activate)
+        self.config = conf or config.Config()
+        sockpool.SocketPool().fill(self.server_address[0])
+        # Only touched by the thread serving the listening socket
+        self.sources = OrderedDict()
+        self.rejected = 0
+        self.missesAnswered = 0
+        self.errorsSent = 0
+        self.errorsSuppressed = 0
+
+    def verify_request(self, request, client_address):
+        packet, sock = request
+        try:
+            opcode, filename, mode = unpackRWRQ(packet)
+            if opcode != Opcodes['RRQ'] or not storage.Storage().isMissing(filename):
+                return True
+            # Answer known misses without starting a session
+            self.missesAnswered += 1
+            try:
+                sock.sendto(packERROR(
+                    Errors['FILE_NOT_FOUND'],
+                    "No such file '{}'".format(filename)), client_address)
+            except OSError:
+                pass
+            return False
+        except ErrorUnknownMode as ex:
+            code, msg = Errors['ACCESS_VIOLATION'], str(ex)
+        except storage.ErrorEmptyPath as ex:
+            code, msg = Errors['FILE_NOT_FOUND'], str(ex)
+        except (ErrorIllegalOperation, ErrorUnknownOpcode,
+                ErrorMalformedPacket, UnicodeDecodeError) as ex:
+            code, msg = Errors['ILLEGAL_OPERATION'], str(ex)
+
+        self.rejected += 1
+        # Replying to an ERROR risks a loop of errors between two servers
+        if packet[:2] == Opcodes['ERROR'].to_bytes(2, 'big'):
+            return False
+        if not self._mayReply(client_address[0]):
+            self.errorsSuppressed += 1
+            return False
+        try:
+            sock.sendto(packERROR(code, msg), client_address)
+        except OSError:
+            return False
+        self.errorsSent += 1
+        logging.debug(
+            "Rejected datagram from Client [{0}:{1}]: {2}"\
+            .format(*client_address, msg))
+        return False
+
+    def reload(self, conf):
+        """Applies conf to the shared components and to sessions starting
+        from now on. Sessions in progress keep their transfer settings, but
+        quotas and the reaper's deadline and idle timeout apply to them too.
+        """
+        conf.apply()
+        self.config = conf
+        # Swapped rather than cleared as the serving thread may be using it
+        self.sources = OrderedDict()
+        logging.info("Reloaded configuration")
+
+    def _mayReply(self, host):
+        conf = self.config
+        bucket = self.sources.get(host)
+        if bucket is None:
+            bucket = shaping.TokenBucket(conf.errorReplyRate, conf.errorReplyBurst)
+            self.sources[host] = bucket
+            if len(self.sources) > conf.errorReplySources:
+                self.sources.popitem(last=False)
         else:
-            handleWRQ(self.client_address, stid, filename, mode)
+            self.sources.move_to_end(host)
+        return bucket.take(1)
+
+    def stats(self):
+        return {
+            'rejected': self.rejected,
+            'missesAnswered': self.missesAnswered,
+            'errorsSent': self.errorsSent,
+            'errorsSuppressed': self.errorsSuppressed}
@@ -0,0 +1,151 @@
+import logging
+import socket
+import threading
+import time
+
+import shaping
+
+# Longest a whole transfer may take, in seconds
+SESSION_DEADLINE = 600.0
+# Longest a transfer may go without hearing from its client, in seconds
+SESSION_IDLE_TIMEOUT = 30.0
+# How often the reaper looks for stalled sessions, in seconds
+REAP_INTERVAL = 1.0
+
+class Session(object):
+    """A single RRQ or WRQ transfer and the resources it holds.
+    Handlers call touch() whenever a packet arrives from the client and
+    check aborted after every blocking receive.
+    """
+    def __init__(self, kind, address, filename, sock):
+        self.kind = kind
+        self.address = address
+        self.filename = filename
+        self.sock = sock
+        self.buffer = None
+        self.allocation = None
+        self.reader = None
+        self.snapshot = None
+        self.flow = shaping.UNLIMITED
+        self.started = time.monotonic()
+        self.lastActivity = self.started
+        self.aborted = None
+        self.committed = False
+        self.mutex = threading.Lock()
+
+    def touch(self):
+        self.lastActivity = time.monotonic()
+
+    def commit(self):
+        """Exempts the session from being aborted while its result is
+        stored. Returns False if it was aborted first.
+        """
+        with self.mutex:
+            if self.aborted:
+                return False
+            self.committed = True
+            self.buffer = None
+            return True
+
+    def abort(self, reason):
+        """Marks the session aborted, releases any partially received file
+        and its storage allocation, and wakes a handler blocked receiving on
+        the socket. The handler reports the abort to its client and closes
+        the socket once it wakes. Returns False if the session has already
+        committed.
+        """
+        with self.mutex:
+            if self.committed:
+                return False
+            self.aborted = reason
+            if self.buffer is not None:
+                self.buffer.clear()
+                self.buffer = None
+            if self.allocation:
+                self.allocation.release()
+        try:
+            self.sock.shutdown(socket.SHUT_RD)
+        except OSError:
+            # Unconnected UDP sockets report ENOTCONN but are still shut down
+            pass
+        return True
+
+class Reaper(object):
+    """Maintains a singleton registry of active sessions and a background
+    thread aborting those past their deadline or idle timeout.
+    """
+    __instance = None
+
+    def __new__(cls):
+        if not Reaper.__instance:
+            Reaper.__instance = Reaper.__Reaper()
+        return Reaper.__instance
+
+    class __Reaper():
+        def __init__(self):
+            self.sessions = set()
+            self.mutex = threading.Lock()
+            self.deadline = SESSION_DEADLINE
+            self.idleTimeout = SESSION_IDLE_TIMEOUT
+            self.interval = REAP_INTERVAL
+            self.thread = None
+            self.deadlineAborts = 0
+            self.idleAborts = 0
+
+        def configure(self, deadline=SESSION_DEADLINE,
+                idleTimeout=SESSION_IDLE_TIMEOUT, interval=REAP_INTERVAL):
+            with self.mutex:
+                self.deadline = deadline
+                self.idleTimeout = idleTimeout
+                self.interval = interval
+
+        def register(self, session):
+            with self.mutex:
+                self.sessions.add(session)
+                if not self.thread:
+                    self.thread = threading.Thread(
+                        target=self.run, name='reaper', daemon=True)
+                    self.thread.start()
+
+        def unregister(self, session):
+            with self.mutex:
+                self.sessions.discard(session)
+
+        def run(self):
+            while True:
+                time.sleep(self.interval)
+                self.reap()
+
+        def reap(self):
+            """Aborts every session past its deadline or idle timeout"""
+            now = time.monotonic()
+            expired = []
+            with self.mutex:
+                for s in self.sessions:
+                    if now - s.started > self.deadline:
+                        expired.append((s, "Session deadline exceeded"))
+                    elif now - s.lastActivity > self.idleTimeout:
+                        expired.append((s, "Session idle timeout exceeded"))
+                for s, reason in expired:
+                    self.sessions.discard(s)
+
+            for s, reason in expired:
+                # Counted under the mutex held while aborting, so stats()
+                # include the abort before the client can see its ERROR
+                with self.mutex:
+                    if not s.abort(reason):
+                        continue
+                    if s.started + self.deadline < now:
+                        self.deadlineAborts += 1
+                    else:
+                        self.idleAborts += 1
+                logging.warning(
+                    "Client [{0}:{1}]: Aborted {2} of '{3}' after [{4:.1f}]s: {5}"\
+                    .format(*s.address, s.kind, s.filename, now - s.started, reason))
+
+        def stats(self):
+            with self.mutex:
+                return {
+                    'active': len(self.sessions),
+                    'deadlineAborts': self.deadlineAborts,
+                    'idleAborts': self.idleAborts}
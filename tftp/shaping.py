@@ -0,0 +1,241 @@
+import asyncio
+import ipaddress
+import logging
+import threading
+import time
+
+# Seconds worth of traffic a bucket may accumulate while idle
+DEFAULT_BURST_SECONDS = 0.1
+# How often the achieved throughput of each cap is logged, in seconds
+REPORT_INTERVAL = 60.0
+
+class TokenBucket(object):
+    """Allows rate bytes per second with bursts of up to burst bytes.
+
+    reserve() debits the bucket immediately, letting it go into deficit,
+    and returns how long the caller must wait before sending. Callers
+    therefore sleep once per packet instead of polling for tokens.
+    """
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate * DEFAULT_BURST_SECONDS))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.sent = 0
+        self.mutex = threading.Lock()
+
+    def setRate(self, rate):
+        with self.mutex:
+            self._refill(time.monotonic())
+            self.rate = rate
+
+    def reserve(self, nbytes):
+        """Debits nbytes and returns the delay in seconds before sending"""
+        with self.mutex:
+            self._refill(time.monotonic())
+            self.tokens -= nbytes
+            self.sent += nbytes
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def take(self, nbytes):
+        """Debits nbytes and returns True if the bucket holds that many
+        tokens, otherwise returns False without going into deficit
+        """
+        with self.mutex:
+            self._refill(time.monotonic())
+            if self.tokens < nbytes:
+                return False
+            self.tokens -= nbytes
+            self.sent += nbytes
+            return True
+
+    def _refill(self, now):
+        self.tokens = min(
+            self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+class Scope(object):
+    """A rate cap shared by every flow it contains"""
+    def __init__(self, name, rate, burst=None):
+        self.name = name
+        self.rate = rate
+        self.bucket = TokenBucket(rate, burst)
+        self.flows = set()
+        # Bytes sent and time as of the last report
+        self.reported = (0, time.monotonic())
+
+class Flow(object):
+    """Shaping state for one transfer. Each flow also has its own bucket
+    holding it to a fair share of the scopes it belongs to, so one fast
+    client can't starve the others.
+    """
+    def __init__(self, shaper, scopes):
+        self.shaper = shaper
+        self.scopes = scopes
+        self.bucket = None
+
+    def delay(self, nbytes):
+        delay = self.bucket.reserve(nbytes) if self.bucket else 0.0
+        for scope in self.scopes:
+            delay = max(delay, scope.bucket.reserve(nbytes))
+        return delay
+
+    def throttle(self, nbytes):
+        """Blocks the calling thread until nbytes may be sent"""
+        delay = self.delay(nbytes)
+        if delay:
+            time.sleep(delay)
+
+    async def throttleAsync(self, nbytes):
+        """Suspends the calling coroutine until nbytes may be sent"""
+        delay = self.delay(nbytes)
+        if delay:
+            await asyncio.sleep(delay)
+
+    def close(self):
+        self.shaper.close(self)
+
+class UnlimitedFlow(object):
+    """Stands in for a Flow when no rate limits apply"""
+    def delay(self, nbytes):
+        return 0.0
+
+    def throttle(self, nbytes):
+        pass
+
+    async def throttleAsync(self, nbytes):
+        pass
+
+    def close(self):
+        pass
+
+UNLIMITED = UnlimitedFlow()
+
+class Shaper(object):
+    """Maintains a singleton of the configured global and per-subnet rate
+    caps and the flows currently sharing them.
+    """
+    __instance = None
+
+    def __new__(cls):
+        if not Shaper.__instance:
+            Shaper.__instance = Shaper.__Shaper()
+        return Shaper.__instance
+
+    class __Shaper():
+        def __init__(self):
+            self.mutex = threading.Lock()
+            self.thread = None
+            self.configure()
+
+        def configure(self, globalRate=None, subnetRates=None,
+                interval=REPORT_INTERVAL):
+            """Caps the total DATA rate at globalRate bytes per second and
+            the rate to each subnet in subnetRates, a dictionary of CIDR
+            strings to bytes per second. A client in several subnets is
+            capped by the most specific one. No arguments removes all caps.
+            While any cap applies, its throughput is logged every interval
+            seconds.
+            """
+            subnets = []
+            for cidr, rate in (subnetRates or {}).items():
+                network = ipaddress.ip_network(cidr, strict=False)
+                subnets.append((network, Scope(str(network), rate)))
+            subnets.sort(key=lambda s: s[0].prefixlen, reverse=True)
+
+            with self.mutex:
+                self.globalScope = Scope('global', globalRate) if globalRate else None
+                self.subnets = subnets
+                self.configured = time.monotonic()
+                self.interval = interval
+                if (self.globalScope or self.subnets) and not self.thread:
+                    self.thread = threading.Thread(
+                        target=self.run, name='shaper', daemon=True)
+                    self.thread.start()
+
+        def run(self):
+            while True:
+                time.sleep(self.interval)
+                self.report()
+
+        def report(self):
+            """Logs the throughput each cap achieved since the last report,
+            skipping caps that were idle throughout
+            """
+            now = time.monotonic()
+            with self.mutex:
+                for scope in self._scopes():
+                    sent, since = scope.reported
+                    scope.reported = (scope.bucket.sent, now)
+                    if scope.bucket.sent == sent and not scope.flows:
+                        continue
+                    logging.info(
+                        "Rate limit [{0}]: {1:.0f} of {2} bytes/s over [{3:.1f}]s, [{4}] transfers"\
+                        .format(scope.name, (scope.bucket.sent - sent) / (now - since),
+                            scope.rate, now - since, len(scope.flows)))
+
+        def _scopes(self):
+            """Returns every configured scope. Caller must hold the mutex."""
+            scopes = [self.globalScope] if self.globalScope else []
+            scopes.extend(scope for network, scope in self.subnets)
+            return scopes
+
+        def open(self, address):
+            """Returns the Flow for a new transfer to address, or UNLIMITED
+            when no caps apply to it
+            """
+            with self.mutex:
+                scopes = []
+                if self.globalScope:
+                    scopes.append(self.globalScope)
+                if self.subnets:
+                    ip = ipaddress.ip_address(address[0])
+                    for network, scope in self.subnets:
+                        if ip.version == network.version and ip in network:
+                            scopes.append(scope)
+                            break
+                if not scopes:
+                    return UNLIMITED
+
+                flow = Flow(self, scopes)
+                for scope in scopes:
+                    scope.flows.add(flow)
+                self._rebalance(scopes)
+                return flow
+
+        def close(self, flow):
+            with self.mutex:
+                for scope in flow.scopes:
+                    scope.flows.discard(flow)
+                self._rebalance(flow.scopes)
+
+        def _rebalance(self, scopes):
+            """Gives each flow in scopes an equal share of its tightest
+            scope. Caller must hold the mutex.
+            """
+            flows = set()
+            for scope in scopes:
+                flows.update(scope.flows)
+            for flow in flows:
+                share = min(s.rate / len(s.flows) for s in flow.scopes)
+                if flow.bucket:
+                    flow.bucket.setRate(share)
+                else:
+                    flow.bucket = TokenBucket(share)
+
+        def stats(self):
+            """Returns the configured rate, bytes sent and achieved
+            throughput of every scope since it was configured
+            """
+            with self.mutex:
+                elapsed = time.monotonic() - self.configured
+                scopes = self._scopes()
+                return {
+                    scope.name: {
+                        'rate': scope.rate,
+                        'flows': len(scope.flows),
+                        'bytes': scope.bucket.sent,
+                        'throughput': scope.bucket.sent / elapsed if elapsed else 0.0}
+                    for scope in scopes}
@@ -0,0 +1,126 @@
+import logging
+import socket
+import threading
+from collections import deque
+
+# Idle transfer sockets kept bound per listening address
+SOCKET_POOL_SIZE = 32
+# Send and receive buffer sizes for transfer sockets; None keeps the OS default
+SOCKET_SEND_BUFFER = None
+SOCKET_RECEIVE_BUFFER = None
+
+class SocketPool(object):
+    """Maintains a singleton pool of bound UDP sockets for transfers so a
+    session doesn't create, bind and close a socket of its own.
+
+    Sockets are returned with checkin() once a session ends, drained of any
+    datagrams that arrived late, and handed out again oldest first so late
+    retransmissions to a recently used socket have time to die down. Sockets shut down by the reaper can't be
+    reused and must be returned with reusable=False.
+    """
+    __instance = None
+
+    def __new__(cls):
+        if not SocketPool.__instance:
+            SocketPool.__instance = SocketPool.__SocketPool()
+        return SocketPool.__instance
+
+    class __SocketPool():
+        def __init__(self):
+            self.mutex = threading.Lock()
+            self.idle = {}
+            self.size = SOCKET_POOL_SIZE
+            self.sendBuffer = SOCKET_SEND_BUFFER
+            self.receiveBuffer = SOCKET_RECEIVE_BUFFER
+            self.created = 0
+            self.reused = 0
+            self.discarded = 0
+            self.drained = 0
+
+        def configure(self, size=SOCKET_POOL_SIZE, sendBuffer=SOCKET_SEND_BUFFER,
+                receiveBuffer=SOCKET_RECEIVE_BUFFER):
+            """Keeps up to size idle sockets per address, each with the given
+            buffer sizes in bytes. A size of 0 disables pooling. Idle sockets
+            of the old configuration are closed.
+            """
+            with self.mutex:
+                self.size = size
+                self.sendBuffer = sendBuffer
+                self.receiveBuffer = receiveBuffer
+                idle, self.idle = self.idle, {}
+            for socks in idle.values():
+                for sock in socks:
+                    sock.close()
+
+        def fill(self, host):
+            """Binds sockets on host until the pool for it is full"""
+            with self.mutex:
+                missing = self.size - len(self.idle.get(host, ()))
+            socks = [self._create(host) for i in range(max(0, missing))]
+            with self.mutex:
+                self.idle.setdefault(host, deque()).extend(socks)
+            logging.info(
+                "Bound [{0}] transfer sockets on [{1}]".format(len(socks), host))
+
+        def checkout(self, host):
+            """Returns an idle socket bound on host, binding a new one if
+            none are idle
+            """
+            with self.mutex:
+                idle = self.idle.get(host)
+                if idle:
+                    self.reused += 1
+                    return idle.popleft()
+            return self._create(host)
+
+        def checkin(self, sock, reusable=True):
+            """Returns sock to the pool, or closes it if it can't be reused
+            or the pool is full
+            """
+            if reusable:
+                try:
+                    host = sock.getsockname()[0]
+                    self._drain(sock)
+                except OSError:
+                    reusable = False
+            with self.mutex:
+                if reusable:
+                    idle = self.idle.setdefault(host, deque())
+                    if len(idle) < self.size:
+                        idle.append(sock)
+                        return
+                self.discarded += 1
+            sock.close()
+
+        def _create(self, host):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            if self.sendBuffer:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.sendBuffer)
+            if self.receiveBuffer:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.receiveBuffer)
+            sock.bind((host, 0))
+            with self.mutex:
+                self.created += 1
+            return sock
+
+        def _drain(self, sock):
+            """Discards datagrams queued on sock and leaves it blocking"""
+            sock.setblocking(False)
+            try:
+                while True:
+                    sock.recv(65536)
+                    with self.mutex:
+                        self.drained += 1
+            except BlockingIOError:
+                pass
+            finally:
+                sock.setblocking(True)
+
+        def stats(self):
+            with self.mutex:
+                return {
+                    'idle': sum(len(socks) for socks in self.idle.values()),
+                    'created': self.created,
+                    'reused': self.reused,
+                    'discarded': self.discarded,
+                    'drained': self.drained}
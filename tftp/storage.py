@@ -1,4 +1,40 @@
+import logging
+import lzma
+import os
 import threading
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import persist
+
+# Upper bound on the number of decompressed bytes kept in the hot cache
+DECOMPRESSED_CACHE_BYTES = 32 * 1024 * 1024
+# Files up to this size are compressed before put returns. Larger files are
+# stored as they are and compressed in the background, so a WRQ isn't kept
+# from sending its final ACK for longer than the client waits.
+COMPRESS_INLINE_BYTES = 256 * 1024
+# Number of missing paths remembered, and for how many seconds. Paths may
+# appear without a put, e.g. on disk under the root directory or upstream.
+NEGATIVE_CACHE_SIZE = 4096
+NEGATIVE_CACHE_TTL = 5.0
+
+Codecs = {
+    'zlib': (zlib.compress, zlib.decompress),
+    'lzma': (lzma.compress, lzma.decompress)}
+
+SizeSuffixes = {
+    'k': 1000,
+    'm': 1000 ** 2,
+    'g': 1000 ** 3}
+
+def parseSize(size):
+    """Returns a number of bytes from strings like '500k' or '4G'"""
+    size = str(size).strip().lower()
+    if size and size[-1] in SizeSuffixes:
+        return int(float(size[:-1]) * SizeSuffixes[size[-1]])
+    return int(size)
 
 class ErrorEmptyPath(Exception):
     pass
@@ -9,6 +45,93 @@ class ErrorFileNotFound(Exception):
 class ErrorFileExists(Exception):
     pass
 
+class ErrorAllocationExceeded(Exception):
+    pass
+
+class CompressedFile(object):
+    """Compressed file body along with the codec used and its raw size."""
+    __slots__ = ('codec', 'data', 'size')
+
+    def __init__(self, codec, data, size):
+        self.codec = codec
+        self.data = data
+        self.size = size
+
+    def decompress(self):
+        return Codecs[self.codec][1](self.data)
+
+def rawSize(file):
+    """Returns the uncompressed size of a stored file in bytes"""
+    if isinstance(file, (CompressedFile, persist.Record)):
+        return file.size
+    if isinstance(file, (bytes, bytearray, memoryview)):
+        return len(file)
+    return 0
+
+def storedSize(file):
+    """Returns the number of bytes a stored file occupies"""
+    if isinstance(file, CompressedFile):
+        return len(file.data)
+    if isinstance(file, persist.Record):
+        return file.length
+    if isinstance(file, (bytes, bytearray, memoryview)):
+        return len(file)
+    return 0
+
+class Snapshot(object):
+    """One version of a file held open by a reader. The version stays
+    readable, even once replaced, until release() is called.
+    """
+    __slots__ = ('store', 'path', 'version', 'data')
+
+    def __init__(self, store, path, version, data):
+        self.store = store
+        self.path = path
+        self.version = version
+        self.data = data
+
+    def release(self):
+        store, self.store = self.store, None
+        if store:
+            store._releaseSnapshot(self)
+
+class Allocation(object):
+    """Bytes reserved against the storage quotas for a file still being
+    received. Reserved bytes are handed over to the file when it is put,
+    or returned by release().
+    """
+    def __init__(self, store, path):
+        self.store = store
+        self.path = path
+        self.reserved = 0
+
+    def grow(self, nbytes):
+        """Reserves nbytes more for the file.
+        Raises ErrorAllocationExceeded, releasing the allocation, if that
+        would exceed the per-file or total quota.
+        """
+        self.store._grow(self, nbytes)
+
+    def release(self):
+        self.store._release(self)
+
+def compress(file, codecs):
+    """Returns a CompressedFile using whichever of codecs gives the smallest
+    output, or file unchanged if no codec makes it smaller.
+    Only bytes-like objects are compressed.
+    """
+    if not isinstance(file, (bytes, bytearray, memoryview)):
+        return file
+
+    best = file
+    bestSize = len(file)
+    for codec in codecs:
+        data = Codecs[codec][0](file)
+        if len(data) < bestSize:
+            best = CompressedFile(codec, data, len(file))
+            bestSize = len(data)
+    return best
+
 class Storage(object):
     """Maintains a singleton of an in-memory dictionary for file storage."""
     __instance = None
@@ -21,22 +144,485 @@ class Storage(object):
     class __Storage():
         def __init__(self):
             self.store = {}
+            # Current version number of each path and, for versions being
+            # read, how many readers hold them
+            self.versions = {}
+            self.readers = {}
+            # Replaced versions kept until their last reader releases them
+            self.retired = {}
             self.mutex = threading.Lock()
+            self.codecs = ()
+            self.compressor = None
+            self.compressing = set()
+            self.cache = OrderedDict()
+            self.cacheBytes = 0
+            self.cacheLimit = DECOMPRESSED_CACHE_BYTES
+            self.cacheHits = 0
+            self.cacheMisses = 0
+            self.rawBytes = 0
+            self.storedBytes = 0
+            self.reservedBytes = 0
+            self.quotaTotal = None
+            self.quotaFile = None
+            self.root = None
+            # Paths known to be missing, mapped to when that expires
+            self.missing = OrderedDict()
+            self.missingLimit = NEGATIVE_CACHE_SIZE
+            self.missingTtl = NEGATIVE_CACHE_TTL
+            self.missingHits = 0
+            self.journal = None
+            self.pending = set()
+            self.compacting = False
+            self.openedAt = time.monotonic()
+            self.loadTime = None
+            self.firstServedTime = None
 
-        def get(self, path=None):
+        def open(self, directory, compactBytes=persist.COMPACT_WAL_BYTES, sync=True):
+            """Persists files stored from now on under directory and makes
+            previously persisted files available. Only the index is loaded;
+            file bodies are read from disk when first requested.
+            """
+            journal = persist.Journal(directory, compactBytes, sync)
+            self.openedAt = time.monotonic()
+            index = journal.load()
             with self.mutex:
-                if not path:
-                    raise ErrorEmptyPath("Must supply a file path!")
-                if path in self.store:
-                    return self.store[path]
+                self.journal = journal
+                for path, record in index.items():
+                    self._publish(path, record)
+                self.loadTime = time.monotonic() - self.openedAt
+                self.firstServedTime = None
+            logging.info(
+                "Loaded index of [{0}] files from '{1}' in [{2:.3f}] ms"\
+                .format(len(index), directory, self.loadTime * 1000))
+
+        def close(self):
+            """Stops persisting files. Persisted files remain readable."""
+            with self.mutex:
+                self.journal = None
+
+        def compact(self):
+            """Folds the write-ahead log into a new snapshot. Only rotating
+            the log holds up puts; the snapshot is written without the lock.
+            """
+            journal = self.journal
+            if not journal:
+                return
+            try:
+                with journal.mutex:
+                    with self.mutex:
+                        index = {
+                            path: file for path, file in self.store.items()
+                            if isinstance(file, persist.Record)}
+                    logs = journal.rotate()
+                compacted = journal.compact(index, logs)
+                with self.mutex:
+                    for path, record in compacted.items():
+                        if self.store.get(path) is index[path]:
+                            self.store[path] = record
+            except (OSError, persist.ErrorCorruptJournal) as ex:
+                logging.error("Compaction failed: {}".format(ex))
+            finally:
+                with self.mutex:
+                    self.compacting = False
+
+        def served(self):
+            """Records the time from startup until the first completed read"""
+            if self.firstServedTime is not None:
+                return
+            with self.mutex:
+                if self.firstServedTime is not None:
+                    return
+                self.firstServedTime = time.monotonic() - self.openedAt
+            logging.info(
+                "First request served [{0:.3f}] ms after startup"\
+                .format(self.firstServedTime * 1000))
+
+        def configureQuota(self, totalBytes=None, fileBytes=None):
+            """Limits the total uncompressed size of all files and the size of
+            any single file. None removes a limit. Existing files are kept
+            even if they already exceed a new limit.
+            """
+            with self.mutex:
+                self.quotaTotal = totalBytes
+                self.quotaFile = fileBytes
+
+        def allocate(self, path):
+            """Returns an Allocation to track a file as it is received"""
+            return Allocation(self, path)
+
+        def _grow(self, allocation, nbytes):
+            with self.mutex:
+                size = allocation.reserved + nbytes
+                try:
+                    self._checkQuota(allocation.path, size, allocation.reserved)
+                except ErrorAllocationExceeded:
+                    self.reservedBytes -= allocation.reserved
+                    allocation.reserved = 0
+                    raise
+                self.reservedBytes += nbytes
+                allocation.reserved = size
+
+        def _release(self, allocation):
+            with self.mutex:
+                self.reservedBytes -= allocation.reserved
+                allocation.reserved = 0
+
+        def _checkQuota(self, path, size, reserved=0):
+            """Raises ErrorAllocationExceeded if a file of size bytes doesn't
+            fit, not counting reserved bytes already held for it.
+            Caller must hold the mutex.
+            """
+            if self.quotaFile is not None and size > self.quotaFile:
+                raise ErrorAllocationExceeded(
+                    "File '{0}' exceeds the [{1}] byte file quota"\
+                    .format(path, self.quotaFile))
+            used = self.rawBytes + self.reservedBytes - reserved
+            if self.quotaTotal is not None and used + size > self.quotaTotal:
+                raise ErrorAllocationExceeded(
+                    "Storing '{0}' would exceed the [{1}] byte storage quota"\
+                    .format(path, self.quotaTotal))
+
+        def _admit(self, path, stored, allocation, overwrite=False):
+            """Checks stored may be added as path and holds its size in
+            reservedBytes, taking over any bytes reserved by allocation.
+            Caller must hold the mutex.
+            """
+            if path in self.pending or (path in self.store and not overwrite):
+                raise ErrorFileExists("File '{}' already exists!".format(path))
+            reserved = allocation.reserved if allocation else 0
+            size = rawSize(stored)
+            # Replacing a version nobody is reading frees it straight away
+            freed = 0
+            if path in self.store and not self.readers.get((path, self.versions[path])):
+                freed = rawSize(self.store[path])
+            self._checkQuota(path, size, reserved + freed)
+            if allocation:
+                allocation.reserved = 0
+            self.reservedBytes += size - reserved
+
+        def configureCompression(self, codecs=('zlib', 'lzma'),
+                cacheBytes=DECOMPRESSED_CACHE_BYTES):
+            """Compresses files on subsequent puts using the smallest of
+            codecs. Files larger than COMPRESS_INLINE_BYTES are compressed
+            in the background. Passing an empty codecs disables compression;
+            files already stored compressed remain readable.
+            """
+            for codec in codecs:
+                if codec not in Codecs:
+                    raise ValueError("Unknown codec '{}'".format(codec))
+            with self.mutex:
+                self.codecs = tuple(codecs)
+                self.cacheLimit = cacheBytes
+                self._evict()
+
+        def configureNegativeCache(self, size=NEGATIVE_CACHE_SIZE,
+                ttl=NEGATIVE_CACHE_TTL):
+            """Remembers up to size missing paths for ttl seconds each.
+            A size of 0 disables the negative cache.
+            """
+            with self.mutex:
+                self.missingLimit = size
+                self.missingTtl = ttl
+                self.missing.clear()
+
+        def isMissing(self, path):
+            """Returns True if path was recently found to be missing.
+            Doesn't take the lock so misses can be answered cheaply.
+            """
+            expires = self.missing.get(path)
+            if expires is None or expires < time.monotonic():
+                return False
+            self.missingHits += 1
+            return True
+
+        def markMissing(self, path):
+            """Remembers that a lookup of path found nothing anywhere"""
+            with self.mutex:
+                if not self.missingLimit or path in self.store:
+                    return
+                self.missing.pop(path, None)
+                self.missing[path] = time.monotonic() + self.missingTtl
+                while len(self.missing) > self.missingLimit:
+                    self.missing.popitem(last=False)
+
+        def forgetMissing(self, path=None):
+            """Forgets that path, or every path if None, was missing"""
+            with self.mutex:
+                if path is None:
+                    self.missing.clear()
                 else:
-                    raise ErrorFileNotFound("No such file '{}'".format(path))
+                    self.missing.pop(path, None)
 
-        def put(self, path=None, file=None):
+        def configureRoot(self, directory=None):
+            """Serves files missing from storage out of directory on disk.
+            None stops serving from disk.
+            """
+            with self.mutex:
+                self.root = os.path.realpath(directory) if directory else None
+                self.missing.clear()
+
+        def _getFromRoot(self, root, path):
+            """Returns a Record for path under root without reading it.
+            Raises ErrorFileNotFound if it doesn't exist or escapes root.
+            """
+            full = os.path.realpath(os.path.join(root, str(path).lstrip('/')))
+            if not full.startswith(root + os.sep) or not os.path.isfile(full):
+                raise ErrorFileNotFound("No such file '{}'".format(path))
+            try:
+                segment = persist.Segment(full, os.O_RDONLY)
+            except OSError:
+                raise ErrorFileNotFound("No such file '{}'".format(path))
+            size = os.fstat(segment.fd).st_size
+            return persist.Record(segment, 0, size, None, size)
+
+        def get(self, path=None, stream=False):
+            """Returns the contents of path. With stream, uncompressed files
+            on disk are returned as a persist.Record to be read incrementally.
+            """
+            snapshot = self.acquire(path, stream)
+            snapshot.release()
+            return snapshot.data
+
+        def acquire(self, path=None, stream=False):
+            """Returns a Snapshot of the current version of path, read as by
+            get(). The snapshot's data is unaffected by later puts replacing
+            path until it is released. Files served from the root directory
+            are not versioned.
+            """
             with self.mutex:
                 if not path:
                     raise ErrorEmptyPath("Must supply a file path!")
-                if path in self.store:
-                    raise ErrorFileExists("File '{}' already exists!".format(path))
+                if path not in self.store:
+                    root = self.root
+                    if not root:
+                        raise ErrorFileNotFound("No such file '{}'".format(path))
+                    file = None
                 else:
-                    self.store[path] = file
+                    file = self.store[path]
+                    key = (path, self.versions[path])
+                    self.readers[key] = self.readers.get(key, 0) + 1
+                    snapshot = Snapshot(self, path, key[1], file)
+                    persisted = isinstance(file, persist.Record)
+                    if not persisted and not isinstance(file, CompressedFile):
+                        return snapshot
+                    if persisted and not file.codec:
+                        if stream:
+                            return snapshot
+                    elif key in self.cache:
+                        self.cache.move_to_end(key)
+                        self.cacheHits += 1
+                        snapshot.data = self.cache[key]
+                        return snapshot
+                    else:
+                        self.cacheMisses += 1
+
+            if file is None:
+                file = self._getFromRoot(root, path)
+                return Snapshot(None, path, None, file if stream else file.read())
+
+            # Page in and inflate outside the lock so other sessions aren't
+            # held up. Raw persisted files rely on the OS page cache.
+            try:
+                if isinstance(file, persist.Record):
+                    if not file.codec:
+                        snapshot.data = file.read()
+                        return snapshot
+                    file = CompressedFile(file.codec, file.read(), file.size)
+                data = file.decompress()
+            except BaseException:
+                snapshot.release()
+                raise
+            with self.mutex:
+                # Don't cache a version replaced while it was inflated
+                if (key not in self.cache and self.versions.get(path) == key[1]
+                        and file.size <= self.cacheLimit):
+                    self.cache[key] = data
+                    self.cacheBytes += file.size
+                    self._evict()
+            snapshot.data = data
+            return snapshot
+
+        def _releaseSnapshot(self, snapshot):
+            with self.mutex:
+                key = (snapshot.path, snapshot.version)
+                count = self.readers.get(key, 0) - 1
+                if count > 0:
+                    self.readers[key] = count
+                    return
+                self.readers.pop(key, None)
+                file = self.retired.pop(key, None)
+                if file is not None:
+                    self._free(file)
+
+        def put(self, path=None, file=None, allocation=None, overwrite=False):
+            """Stores file as path. Bytes reserved by allocation while the
+            file was received count towards its quota. With overwrite, an
+            existing path is replaced by a new version; readers of the old
+            version keep it until they finish.
+            Raises ErrorFileExists if path is taken and
+            ErrorAllocationExceeded if file doesn't fit within the quotas.
+            """
+            if not path:
+                raise ErrorEmptyPath("Must supply a file path!")
+            codecs = self.codecs
+            later = (codecs and isinstance(file, (bytes, bytearray, memoryview))
+                and len(file) > COMPRESS_INLINE_BYTES)
+            stored = compress(file, codecs) if codecs and not later else file
+            journal = self.journal
+            if journal and isinstance(stored, (CompressedFile, bytes, bytearray, memoryview)):
+                published = self._persist(journal, path, stored, allocation, overwrite)
+            else:
+                with self.mutex:
+                    self._admit(path, stored, allocation, overwrite)
+                    self.reservedBytes -= rawSize(stored)
+                    self._publish(path, stored)
+                published = stored
+                journal = None
+
+            if later:
+                self._compressLater(journal, path, published, bytes(file), codecs)
+
+        def _compressLater(self, journal, path, published, file, codecs):
+            """Replaces published, the stored form of path, with file
+            compressed by codecs once a background thread has done so
+            """
+            with self.mutex:
+                if not self.compressor:
+                    self.compressor = ThreadPoolExecutor(
+                        1, thread_name_prefix='compress')
+                future = self.compressor.submit(
+                    self._compress, journal, path, published, file, codecs)
+                self.compressing.add(future)
+            future.add_done_callback(self._compressed)
+
+        def _compressed(self, future):
+            with self.mutex:
+                self.compressing.discard(future)
+
+        def _compress(self, journal, path, published, file, codecs):
+            try:
+                stored = compress(file, codecs)
+                if not isinstance(stored, CompressedFile):
+                    return
+                if not journal:
+                    with self.mutex:
+                        self._replace(path, published, stored)
+                    return
+                # Appending only while published is current keeps a newer
+                # version of path last in the log
+                with journal.mutex:
+                    with self.mutex:
+                        if self.store.get(path) is not published:
+                            return
+                    record = journal.append(
+                        path, stored.data, stored.codec, stored.size)
+                    with self.mutex:
+                        self._replace(path, published, record)
+            except Exception as ex:
+                logging.error("Couldn't compress '{0}': {1}".format(path, ex))
+
+        def _replace(self, path, old, new):
+            """Swaps the stored form of the current version of path from old
+            to new, which hold the same content. Caller must hold the mutex.
+            """
+            if self.store.get(path) is not old:
+                return
+            self.store[path] = new
+            self.storedBytes += storedSize(new) - storedSize(old)
+
+        def flushCompression(self, timeout=None):
+            """Waits for files being compressed in the background"""
+            with self.mutex:
+                pending = list(self.compressing)
+            wait(pending, timeout)
+
+        def _persist(self, journal, path, stored, allocation, overwrite=False):
+            """Commits stored to the write-ahead log before making it visible
+            and returns its Record. The body is then served from disk rather
+            than held in memory. A replaced file's old record is superseded
+            when the log is read.
+            """
+            with self.mutex:
+                self._admit(path, stored, allocation, overwrite)
+                self.pending.add(path)
+
+            compact = False
+            try:
+                with journal.mutex:
+                    if isinstance(stored, CompressedFile):
+                        record = journal.append(
+                            path, stored.data, stored.codec, stored.size)
+                    else:
+                        record = journal.append(path, bytes(stored))
+                    with self.mutex:
+                        self._publish(path, record)
+                        compact = journal.needsCompaction() and not self.compacting
+                        self.compacting = self.compacting or compact
+            finally:
+                with self.mutex:
+                    self.pending.discard(path)
+                    self.reservedBytes -= rawSize(stored)
+
+            if compact:
+                threading.Thread(target=self.compact, daemon=True).start()
+            return record
+
+        def _publish(self, path, stored):
+            """Makes stored the next version of path, retiring the current one.
+            Caller must hold the mutex.
+            """
+            version = self.versions.get(path, 0)
+            if path in self.store:
+                self._retire((path, version), self.store[path])
+            self.store[path] = stored
+            self.versions[path] = version + 1
+            self.missing.pop(path, None)
+            self.rawBytes += rawSize(stored)
+            self.storedBytes += storedSize(stored)
+
+        def _retire(self, key, file):
+            """Frees a replaced version, or keeps it until its readers are
+            done. Caller must hold the mutex.
+            """
+            data = self.cache.pop(key, None)
+            if data is not None:
+                self.cacheBytes -= len(data)
+            if self.readers.get(key):
+                self.retired[key] = file
+            else:
+                self._free(file)
+
+        def _free(self, file):
+            self.rawBytes -= rawSize(file)
+            self.storedBytes -= storedSize(file)
+
+        def stats(self):
+            """Returns a dictionary of compression, cache and quota statistics"""
+            with self.mutex:
+                lookups = self.cacheHits + self.cacheMisses
+                return {
+                    'rawBytes': self.rawBytes,
+                    'storedBytes': self.storedBytes,
+                    'compressionRatio':
+                        self.rawBytes / self.storedBytes if self.storedBytes else 1.0,
+                    'cacheBytes': self.cacheBytes,
+                    'cacheHits': self.cacheHits,
+                    'cacheMisses': self.cacheMisses,
+                    'cacheHitRate': self.cacheHits / lookups if lookups else 0.0,
+                    'reservedBytes': self.reservedBytes,
+                    'quotaTotal': self.quotaTotal,
+                    'quotaFile': self.quotaFile,
+                    'retiredVersions': len(self.retired),
+                    'compressing': len(self.compressing),
+                    'missingPaths': len(self.missing),
+                    'missingHits': self.missingHits,
+                    'loadTime': self.loadTime,
+                    'firstServedTime': self.firstServedTime}
+
+        def _evict(self):
+            """Drops least recently used decompressed files until the cache
+            fits within its limit. Caller must hold the mutex.
+            """
+            while self.cacheBytes > self.cacheLimit and self.cache:
+                key, data = self.cache.popitem(last=False)
+                self.cacheBytes -= len(data)
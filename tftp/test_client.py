@@ -0,0 +1,80 @@
+import asyncio
+import socketserver
+import threading
+import unittest
+import uuid
+
+import client
+import server
+
+class TestClientHelpers(unittest.TestCase):
+    def test_unpackOACK(self):
+        b = bytearray()
+        b.extend(client.OACK.to_bytes(2, 'big'))
+        b.extend(b'BLKSIZE\x001428\x00tsize\x00100\x00')
+        self.assertEqual(
+            client.unpackOACK(b),
+            {'blksize': '1428', 'tsize': '100'})
+
+    def test_resultThroughput(self):
+        r = client.Result('my_file', 1024, 2.0)
+        self.assertEqual(r.throughput, 512)
+        self.assertEqual(client.Result('my_file').throughput, 0)
+
+class TestClient(unittest.TestCase):
+    def setUp(self):
+        self.server = socketserver.ThreadingUDPServer(('localhost', 0), server.Handler)
+        self.server_thread = threading.Thread(target=self.server.serve_forever)
+        self.server_thread.start()
+        self.client = client.Client(
+            'localhost', self.server.server_address[1], timeout=0.5)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_putAndGet(self):
+        fileName = str(uuid.uuid1())
+        file = bytes(fileName * 100, 'utf-8')
+
+        async def transfer():
+            await self.client.put(fileName, file)
+            return await self.client.get(fileName)
+
+        self.assertEqual(asyncio.run(transfer()), file)
+
+    def test_putAndGetNetascii(self):
+        fileName = str(uuid.uuid1())
+        file = b'First\nSecond\r\nThird\rFourth\n\r' * 100
+
+        async def transfer():
+            await self.client.put(fileName, file, 'netascii')
+            return await self.client.get(fileName, 'netascii')
+
+        self.assertEqual(asyncio.run(transfer()), file)
+
+    def test_getFileNotFound(self):
+        self.assertRaises(
+            client.ErrorTransferFailed,
+            asyncio.run,
+            self.client.get('not_a_file'))
+
+    def test_fetchMany(self):
+        files = [(str(uuid.uuid1()), bytes(i * 100)) for i in range(1, 11)]
+        fetched = {}
+
+        async def transfer():
+            await self.client.putMany(files, concurrency=4)
+            return await self.client.fetchMany(
+                [f for f, d in files],
+                concurrency=4,
+                sink=fetched.__setitem__)
+
+        results = asyncio.run(transfer())
+        self.assertEqual([r.error for r in results], [None] * len(files))
+        self.assertEqual([r.size for r in results], [len(d) for f, d in files])
+        self.assertEqual(fetched, dict(files))
+
+
+if __name__ == '__main__':
+    unittest.main()
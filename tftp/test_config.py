@@ -0,0 +1,138 @@
+import os
+import socket
+import tempfile
+import threading
+import unittest
+
+import config
+import server
+import storage
+
+class TestConfig(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.ini')
+        os.close(fd)
+        self.addCleanup(os.remove, self.path)
+
+    def write(self, text):
+        with open(self.path, 'w') as f:
+            f.write("[tftp]\n" + text)
+
+    def test_defaults(self):
+        conf = config.Config()
+        self.assertEqual(conf.transferTimeout, server.TRANSFER_TIMEOUT)
+        self.assertEqual(conf.maxSendAttempts, server.MAX_PACKET_SEND_ATTEMPTS)
+        self.assertEqual(conf.overwrite, server.OVERWRITE_POLICY)
+        self.assertEqual(conf.port, config.DEFAULT_PORT)
+
+    def test_read(self):
+        self.write(
+            "transfer-timeout = 2.5\n"
+            "quota = 4M\n"
+            "subnet-rate = 10.0.0.0/8=1M, 192.168.0.0/16=2k\n"
+            "compression = zlib\n")
+        conf = config.load(self.path)
+        self.assertEqual(conf.transferTimeout, 2.5)
+        self.assertEqual(conf.quota, storage.parseSize('4M'))
+        self.assertEqual(conf.subnetRates,
+            {'10.0.0.0/8': storage.parseSize('1M'),
+             '192.168.0.0/16': storage.parseSize('2k')})
+        self.assertEqual(conf.compression, ('zlib',))
+
+    def test_overridesWin(self):
+        self.write("transfer-timeout = 2.5\nport = 6969\n")
+        conf = config.load(self.path, {'transfer-timeout': 0.5})
+        self.assertEqual(conf.transferTimeout, 0.5)
+        self.assertEqual(conf.port, 6969)
+
+    def test_invalid(self):
+        self.write("overwrite = sometimes\n")
+        self.assertRaises(config.ErrorBadConfig, config.load, self.path)
+        self.write("no-such-option = 1\n")
+        self.assertRaises(config.ErrorBadConfig, config.load, self.path)
+        self.assertRaises(
+            config.ErrorBadConfig, config.load, self.path + '.missing')
+
+    def test_outOfRange(self):
+        for text in (
+                "packet-buffer = 300\n",
+                "transfer-timeout = 0\n",
+                "max-send-attempts = 0\n",
+                "socket-buffer = 0\n",
+                "rate-limit = 0\n",
+                "quota = -1\n",
+                "subnet-rate = 10.0.0.0/8=0\n",
+                "read-ahead-min = 8\nread-ahead-max = 4\n",
+                "profile-every = 10\n"):
+            self.write(text)
+            self.assertRaises(config.ErrorBadConfig, config.load, self.path)
+        self.assertRaises(
+            config.ErrorBadConfig, config.load, None, {'transfer-timeout': -1.0})
+        self.write("packet-buffer = 516\nsocket-pool = 0\n")
+        self.assertEqual(config.load(self.path).packetBuffer, 516)
+
+    def test_badSubnet(self):
+        for text in (
+                "subnet-rate = 10.0.0/8=1M\n",
+                "subnet-rate = 10.0.0.0/33=1M\n",
+                "subnet-rate = 10.0.0.0/8\n"):
+            self.write(text)
+            self.assertRaises(config.ErrorBadConfig, config.load, self.path)
+
+    def test_reloadKeepsRestartOnlySettings(self):
+        self.write("port = 6969\nmax-send-attempts = 3\n")
+        conf = config.load(self.path)
+        self.write("port = 7070\nmax-send-attempts = 5\n")
+        new = conf.reload()
+        self.assertEqual(new.port, 6969)
+        self.assertEqual(new.maxSendAttempts, 5)
+
+    def test_apply(self):
+        conf = config.Config()
+        conf.fileQuota = 1000
+        conf.apply()
+        self.addCleanup(config.Config().apply)
+        self.assertEqual(storage.Storage().stats()['quotaFile'], 1000)
+
+    def test_invalidApplyChangesNothing(self):
+        conf = config.Config()
+        conf.quota = 5000000
+        conf.subnetRates = {'10.0.0/8': 1000}
+        self.assertRaises(config.ErrorBadConfig, conf.apply)
+        self.assertIsNone(storage.Storage().stats()['quotaTotal'])
+
+class TestServerReload(unittest.TestCase):
+    def setUp(self):
+        self.server = server.Server(('localhost', 0))
+        self.server_thread = threading.Thread(target=self.server.serve_forever)
+        self.send_to = self.server.server_address
+        self.client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.client.settimeout(2)
+        self.server_thread.start()
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+        config.Config().apply()
+
+    def test_reloadAppliesToNewSessions(self):
+        storage.Storage().put('reload_file', b'old')
+        b = server.packRWRQ(server.Opcodes['WRQ'], 'reload_file', 'octet')
+        self.client.sendto(b, self.send_to)
+        answer, addr = self.client.recvfrom(1024)
+        self.assertEqual(
+            server.unpackERROR(answer)[1], server.Errors['FILE_EXISTS'])
+
+        conf = config.Config()
+        conf.overwrite = 'always'
+        self.server.reload(conf)
+        self.client.sendto(b, self.send_to)
+        answer, addr = self.client.recvfrom(1024)
+        self.assertEqual(server.unpackACK(answer), (server.Opcodes['ACK'], 0))
+        self.client.sendto(server.packDATA(b'new', 1), addr)
+        self.client.recvfrom(1024)
+        self.assertEqual(storage.Storage().get('reload_file'), b'new')
+
+if __name__ == '__main__':
+    unittest.main()
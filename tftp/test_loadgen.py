@@ -0,0 +1,26 @@
+import contextlib
+import io
+import unittest
+
+import loadgen
+import server
+
+class TestLoadgen(unittest.TestCase):
+    def test_fileData(self):
+        self.assertEqual(len(loadgen.fileData(1000)), 1000)
+        self.assertIn(b'\n', loadgen.fileData(100))
+
+    def test_run(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            stats = loadgen.run(
+                transfers=20, clients=5, sizes=(600, 1500), writeRatio=0.5,
+                modes=(server.Modes['OCTET'], server.Modes['NETASCII']),
+                inProcess=True, seed=1)
+        self.assertEqual(stats['transfers'], 20)
+        self.assertEqual(stats['failed'], 0)
+        self.assertGreater(stats['transfersPerSecond'], 0)
+        self.assertGreater(stats['peakThreads'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
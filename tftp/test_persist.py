@@ -0,0 +1,204 @@
+import os
+import tempfile
+import unittest
+import uuid
+from unittest import mock
+
+import persist
+import storage
+
+class TestJournal(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_appendAndReload(self):
+        j = persist.Journal(self.dir.name)
+        self.assertEqual(j.load(), {})
+        with j.mutex:
+            r = j.append('my_file', b'Cabbage Icecream!')
+        self.assertEqual(r.read(), b'Cabbage Icecream!')
+
+        index = persist.Journal(self.dir.name).load()
+        self.assertIn('my_file', index)
+        self.assertEqual(index['my_file'].read(), b'Cabbage Icecream!')
+
+    def test_tornRecordDiscarded(self):
+        j = persist.Journal(self.dir.name)
+        j.load()
+        with j.mutex:
+            j.append('first', b'complete')
+        walPath = os.path.join(self.dir.name, persist.WAL_FILE)
+        with open(walPath, 'ab') as f:
+            f.write(persist.packRecord('second', b'x' * 100, None, 100))
+            f.write(b'x' * 10)
+
+        j = persist.Journal(self.dir.name)
+        index = j.load()
+        self.assertEqual(list(index), ['first'])
+        self.assertEqual(os.path.getsize(walPath), j.walBytes)
+
+    def test_shortWriteCompleted(self):
+        j = persist.Journal(self.dir.name)
+        j.load()
+        write = os.write
+        with j.mutex, mock.patch(
+                'os.write', side_effect=lambda fd, data: write(fd, data[:7])):
+            j.append('first', b'Cabbage Icecream!')
+            r = j.append('second', b'Broccoli Sorbet')
+        self.assertEqual(r.read(), b'Broccoli Sorbet')
+        index = persist.Journal(self.dir.name).load()
+        self.assertEqual(index['first'].read(), b'Cabbage Icecream!')
+
+    def test_failedAppendRolledBack(self):
+        j = persist.Journal(self.dir.name)
+        j.load()
+        write = os.write
+        def fill(fd, data):
+            write(fd, data[:7])
+            raise OSError(28, 'No space left on device')
+        with j.mutex:
+            j.append('first', b'complete')
+            with mock.patch('os.write', side_effect=fill):
+                self.assertRaises(OSError, j.append, 'lost', b'x' * 100)
+            r = j.append('second', b'also complete')
+        self.assertEqual(r.read(), b'also complete')
+        walPath = os.path.join(self.dir.name, persist.WAL_FILE)
+        self.assertEqual(os.path.getsize(walPath), j.walBytes)
+
+        index = persist.Journal(self.dir.name).load()
+        self.assertEqual(sorted(index), ['first', 'second'])
+
+    def test_compact(self):
+        j = persist.Journal(self.dir.name)
+        j.load()
+        with j.mutex:
+            held = j.append('a', b'aaaa')
+            other = j.append('b', b'bbbb', 'zlib', 40)
+            logs = j.rotate()
+            self.assertEqual(j.walBytes, 0)
+            # Appends carry on while the snapshot is written
+            j.append('c', b'cccc')
+        j.compact({'a': held, 'b': other}, logs)
+        self.assertEqual(held.read(), b'aaaa')
+        self.assertEqual(persist.rotatedLogs(self.dir.name), [])
+
+        index = persist.Journal(self.dir.name).load()
+        self.assertEqual(sorted(index), ['a', 'b', 'c'])
+        self.assertEqual(index['a'].read(), b'aaaa')
+        self.assertEqual(index['b'].codec, 'zlib')
+        self.assertEqual(index['b'].size, 40)
+
+    def test_rotatedLogsLoaded(self):
+        # As if compaction failed after rotating the log
+        j = persist.Journal(self.dir.name)
+        j.load()
+        with j.mutex:
+            j.append('a', b'old')
+            j.rotate()
+            j.append('b', b'bbbb')
+            j.rotate()
+            j.append('a', b'new')
+
+        index = persist.Journal(self.dir.name).load()
+        self.assertEqual(index['a'].read(), b'new')
+        self.assertEqual(index['b'].read(), b'bbbb')
+        self.assertEqual(len(persist.rotatedLogs(self.dir.name)), 2)
+
+class TestPersistentStorage(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.store = storage.Storage()
+        self.store.open(self.dir.name)
+
+    def tearDown(self):
+        self.store.close()
+        self.store.configureCompression(codecs=())
+        self.dir.cleanup()
+
+    def test_putPersistsFile(self):
+        fileName = str(uuid.uuid1())
+        file = bytearray(bytes(fileName * 10, 'utf-8'))
+        self.store.put(fileName, file)
+        self.assertIsInstance(self.store.store[fileName], persist.Record)
+        self.assertEqual(self.store.get(fileName), file)
+
+        index = persist.Journal(self.dir.name).load()
+        self.assertEqual(index[fileName].read(), file)
+
+    def test_putPersistsCompressedFile(self):
+        self.store.configureCompression(codecs=('zlib',))
+        fileName = str(uuid.uuid1())
+        file = bytes(fileName * 100, 'utf-8')
+        self.store.put(fileName, file)
+        self.assertEqual(self.store.store[fileName].codec, 'zlib')
+        self.assertEqual(self.store.get(fileName), file)
+
+    def test_largeFileCompressedLater(self):
+        self.store.configureCompression(codecs=('zlib',))
+        fileName = str(uuid.uuid1())
+        file = bytes(fileName, 'utf-8') * (storage.COMPRESS_INLINE_BYTES // 10)
+        self.store.put(fileName, file)
+        self.store.flushCompression(5)
+        self.assertEqual(self.store.store[fileName].codec, 'zlib')
+        self.assertEqual(self.store.get(fileName), file)
+
+        index = persist.Journal(self.dir.name).load()
+        self.assertEqual(index[fileName].codec, 'zlib')
+
+    def test_compressedLaterDoesNotOverrideNewerVersion(self):
+        self.store.configureCompression(codecs=('zlib',))
+        fileName = str(uuid.uuid1())
+        file = bytes(fileName, 'utf-8') * (storage.COMPRESS_INLINE_BYTES // 10)
+        with mock.patch.object(self.store, '_compressLater') as later:
+            self.store.put(fileName, file)
+        self.store.put(fileName, b'newer', overwrite=True)
+        # The compression queued for the first version finishes afterwards
+        self.store._compress(self.store.journal, fileName, *later.call_args[0][2:])
+        self.assertEqual(self.store.get(fileName), b'newer')
+
+        index = persist.Journal(self.dir.name).load()
+        self.assertEqual(index[fileName].read(), b'newer')
+
+    def test_compactKeepsFiles(self):
+        fileName = str(uuid.uuid1())
+        self.store.put(fileName, b'Cabbage Icecream!')
+        self.store.compact()
+        self.assertEqual(self.store.get(fileName), b'Cabbage Icecream!')
+
+        index = persist.Journal(self.dir.name).load()
+        self.assertEqual(index[fileName].read(), b'Cabbage Icecream!')
+
+    def test_failedCompactionRetried(self):
+        fileName = str(uuid.uuid1())
+        self.store.put(fileName, b'Cabbage Icecream!')
+        with mock.patch.object(
+                persist.Journal, 'compact', side_effect=OSError("disk full")):
+            self.store.compact()
+        self.assertFalse(self.store.compacting)
+        self.assertEqual(len(persist.rotatedLogs(self.dir.name)), 1)
+
+        self.store.compact()
+        self.assertEqual(persist.rotatedLogs(self.dir.name), [])
+        index = persist.Journal(self.dir.name).load()
+        self.assertEqual(index[fileName].read(), b'Cabbage Icecream!')
+
+    def test_overwriteLastRecordWins(self):
+        fileName = str(uuid.uuid1())
+        self.store.put(fileName, b'old')
+        snapshot = self.store.acquire(fileName, stream=True)
+        self.store.put(fileName, b'newer', overwrite=True)
+        self.assertEqual(snapshot.data.read(), b'old')
+        snapshot.release()
+
+        index = persist.Journal(self.dir.name).load()
+        self.assertEqual(index[fileName].read(), b'newer')
+
+    def test_loadTimeRecorded(self):
+        self.assertIsNotNone(self.store.stats()['loadTime'])
+
+
+if __name__ == '__main__':
+    unittest.main()
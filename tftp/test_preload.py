@@ -0,0 +1,69 @@
+import os
+import tempfile
+import unittest
+import uuid
+import zlib
+from unittest import mock
+
+import preload
+import server
+import storage
+
+class TestPreload(unittest.TestCase):
+    def setUp(self):
+        self.preloader = preload.Preloader()
+        self.store = storage.Storage()
+
+    def test_readManifest(self):
+        with tempfile.NamedTemporaryFile('w', delete=False) as f:
+            f.write("# boot images\npxelinux.0\n\n  ldlinux.c32  \n")
+        self.addCleanup(os.remove, f.name)
+        self.assertEqual(
+            preload.readManifest(f.name), ['pxelinux.0', 'ldlinux.c32'])
+
+    def test_warmEncodesNetascii(self):
+        fileName = str(uuid.uuid1())
+        self.store.put(fileName, b'first\nsecond\r')
+        self.preloader.start([fileName, 'missing_file'], encode=server.encodeNetascii)
+        self.assertIsNotNone(self.preloader.wait(5))
+
+        version = self.store.acquire(fileName)
+        version.release()
+        self.assertEqual(
+            self.preloader.netascii(fileName, version.version),
+            b'first\r\nsecond\r\x00')
+        self.assertIsNone(self.preloader.netascii(fileName, version.version + 1))
+        self.assertIsNone(self.preloader.netascii(fileName, version.version))
+
+    def test_overBudgetNotEncoded(self):
+        fileName = str(uuid.uuid1())
+        self.store.put(fileName, b'x' * 100)
+        encode = mock.Mock(side_effect=server.encodeNetascii)
+        self.preloader.start([fileName], encode=encode, encodedBytes=99)
+        self.assertIsNotNone(self.preloader.wait(5))
+        encode.assert_not_called()
+
+    def test_requestedFilesFirst(self):
+        order = []
+        with mock.patch.object(self.preloader, 'warm',
+                side_effect=lambda path: order.append(path) or 0):
+            self.preloader.start(['a', 'b', 'c'], workers=0)
+            self.preloader.requested('c')
+            self.preloader.run()
+        self.assertEqual(order, ['c', 'a', 'b'])
+        self.assertEqual(self.preloader.stats()['pending'], 0)
+
+    def test_unexpectedErrorFinishes(self):
+        def warm(path):
+            if path == 'corrupt':
+                raise zlib.error("invalid stored block lengths")
+            return 1
+        before = self.preloader.stats()['failed']
+        with mock.patch.object(self.preloader, 'warm', side_effect=warm):
+            self.preloader.start(['corrupt', 'fine'], workers=1)
+            self.assertIsNotNone(self.preloader.wait(5))
+        self.assertEqual(self.preloader.stats()['failed'] - before, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
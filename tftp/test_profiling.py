@@ -0,0 +1,72 @@
+import asyncio
+import contextlib
+import io
+import socketserver
+import tempfile
+import threading
+import unittest
+import uuid
+
+import client
+import profiling
+import server
+
+class TestProfiler(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.profiler = profiling.Profiler()
+
+    def tearDown(self):
+        self.profiler.configure(enabled=False)
+        self.dir.cleanup()
+
+    def test_singleton(self):
+        self.assertEqual(profiling.Profiler(), self.profiler)
+
+    def test_disabledReturnsNullTimer(self):
+        self.profiler.configure(enabled=False)
+        t = self.profiler.session('RRQ', ('127.0.0.1', 1), 'my_file')
+        self.assertIs(t, profiling.NULL_TIMER)
+
+    def test_sampleNeedsDirectory(self):
+        self.assertRaises(
+            ValueError,
+            self.profiler.configure,
+            sampleEvery=1)
+
+    def test_phaseTimer(self):
+        self.profiler.configure()
+        t = self.profiler.session('TEST', ('127.0.0.1', 1), 'my_file')
+        for i in range(3):
+            t.begin('send')
+            t.end('send')
+        t.mark('firstBlock')
+        t.mark('firstBlock')
+        t.finish()
+        self.assertEqual(t.counts['send'], 3)
+        self.assertEqual(t.counts['firstBlock'], 1)
+        self.assertIn('total', self.profiler.stats()['TEST'])
+
+    def test_sampledSessionsSummarized(self):
+        self.profiler.configure(sampleEvery=1, directory=self.dir.name)
+        srv = socketserver.ThreadingUDPServer(('localhost', 0), server.Handler)
+        thread = threading.Thread(target=srv.serve_forever)
+        thread.start()
+        try:
+            c = client.Client('localhost', srv.server_address[1], timeout=0.5)
+            fileName = str(uuid.uuid1())
+            asyncio.run(c.put(fileName, bytes(2000)))
+            asyncio.run(c.get(fileName))
+        finally:
+            srv.shutdown()
+            srv.server_close()
+
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            profiling.summarize(self.dir.name)
+        self.assertIn('ackWait', out.getvalue())
+        self.assertIn('Aggregated 2 profiles', out.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+import asyncio
+import os
+import socketserver
+import tempfile
+import threading
+import unittest
+
+import client
+import persist
+import readahead
+import server
+import storage
+
+class TestReadAhead(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'my_file')
+        self.file = os.urandom(readahead.CHUNK_BYTES * 3 + 100)
+        with open(self.path, 'wb') as f:
+            f.write(self.file)
+        segment = persist.Segment(self.path, os.O_RDONLY)
+        self.record = persist.Record(segment, 0, len(self.file), None, len(self.file))
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_blocks(self):
+        r = readahead.ReadAhead(self.record, 512)
+        self.assertEqual(len(r), len(self.file))
+        data = bytearray()
+        for start in range(0, len(self.file) + 1, 512):
+            end = start + 512
+            data.extend(r[start:end if end <= len(self.file) else None])
+        r.close()
+        self.assertEqual(data, self.file)
+        self.assertEqual(r.reads, 4)
+
+    def test_unalignedSlice(self):
+        r = readahead.ReadAhead(self.record, 512)
+        start = readahead.CHUNK_BYTES - 10
+        self.assertEqual(r[start:start + 20], self.file[start:start + 20])
+        self.assertEqual(r[len(self.file):], b'')
+        r.close()
+
+    def test_offsetRecord(self):
+        record = persist.Record(self.record.segment, 100, 1000, None, 1000)
+        r = readahead.ReadAhead(record, 512)
+        self.assertEqual(bytes(r[512:None]), self.file[612:1100])
+        r.close()
+
+    def test_depthAdapts(self):
+        r = readahead.ReadAhead(self.record, 512, maxDepth=8)
+        r[0:512]
+        # A disk much slower than the client's ACKs should read further ahead
+        r.chunkInterval = 0.001
+        r.readLatency = 0.1
+        r[readahead.CHUNK_BYTES:readahead.CHUNK_BYTES + 512]
+        self.assertEqual(r.depth, 8)
+        r.close()
+
+    def test_bufferPoolReuse(self):
+        pool = readahead.BufferPool(16, limit=1)
+        a = pool.get()
+        pool.put(a)
+        pool.put(bytearray(16))
+        self.assertIs(pool.get(), a)
+        self.assertIsNot(pool.get(), a)
+
+class TestRootDirectory(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        os.makedirs(os.path.join(self.dir.name, 'pxelinux.cfg'))
+        self.file = os.urandom(readahead.CHUNK_BYTES + 1000)
+        with open(os.path.join(self.dir.name, 'pxelinux.cfg', 'default'), 'wb') as f:
+            f.write(self.file)
+        self.store = storage.Storage()
+        self.store.configureRoot(self.dir.name)
+
+    def tearDown(self):
+        self.store.configureRoot()
+        self.dir.cleanup()
+
+    def test_getFromRoot(self):
+        self.assertEqual(self.store.get('pxelinux.cfg/default'), self.file)
+        r = self.store.get('/pxelinux.cfg/default', stream=True)
+        self.assertIsInstance(r, persist.Record)
+        self.assertEqual(r.length, len(self.file))
+
+    def test_getOutsideRoot(self):
+        self.assertRaises(
+            storage.ErrorFileNotFound,
+            self.store.get,
+            '../' + os.path.basename(self.dir.name) + '_not_a_file')
+        self.assertRaises(
+            storage.ErrorFileNotFound,
+            self.store.get,
+            'pxelinux.cfg/../../etc/passwd')
+        self.assertRaises(
+            storage.ErrorFileNotFound,
+            self.store.get,
+            'pxelinux.cfg')
+
+    def test_handleRRQ(self):
+        srv = socketserver.ThreadingUDPServer(('localhost', 0), server.Handler)
+        thread = threading.Thread(target=srv.serve_forever)
+        thread.start()
+        try:
+            c = client.Client('localhost', srv.server_address[1], timeout=0.5)
+            data = asyncio.run(c.get('pxelinux.cfg/default'))
+        finally:
+            srv.shutdown()
+            srv.server_close()
+        self.assertEqual(data, self.file)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,12 +1,15 @@
+import errno
 import logging
 import unittest
 import uuid
 import socket
 import socketserver
 import threading
+from unittest import mock
 
 import server
 import storage
+import virtual
 
 logging.basicConfig(
     format='%(asctime)s -- %(levelname)s: %(message)s',
@@ -223,6 +226,68 @@ class TestHandlerHelpers(unittest.TestCase):
         self.assertEqual(tFile, filename)
         self.assertEqual(tMode.lower(), mode)
 
+    def test_packRWRQ(self):
+        b = bytearray()
+        b.extend(server.Opcodes['WRQ'].to_bytes(2, 'big'))
+        b.extend(bytes('myfile', 'utf-8'))
+        b.append(0)
+        b.extend(bytes('octet', 'utf-8'))
+        b.append(0)
+        b.extend(bytes('blksize', 'utf-8'))
+        b.append(0)
+        b.extend(bytes('1428', 'utf-8'))
+        b.append(0)
+
+        tP = server.packRWRQ(server.Opcodes['WRQ'], 'myfile', 'octet', {'blksize': 1428})
+        self.assertEqual(tP, b)
+        tOp, tFile, tMode = server.unpackRWRQ(tP)
+        self.assertEqual(tOp, server.Opcodes['WRQ'])
+        self.assertEqual(tFile, 'myfile')
+        self.assertEqual(tMode, 'octet')
+
+    def test_packRWRQ_illegalOperation(self):
+        self.assertRaises(
+            server.ErrorIllegalOperation,
+            server.packRWRQ,
+            server.Opcodes['DATA'],
+            'myfile',
+            'octet')
+
+    def test_unpackOptions(self):
+        b = server.packRWRQ(
+            server.Opcodes['WRQ'], 'file', 'octet', {'Overwrite': 1, 'tsize': 10})
+        self.assertEqual(
+            server.unpackOptions(b), {'overwrite': '1', 'tsize': '10'})
+        b = server.packRWRQ(server.Opcodes['WRQ'], 'file', 'octet')
+        self.assertEqual(server.unpackOptions(b), {})
+
+    def test_receiveIgnoresOtherAddresses(self):
+        sock, client, stray = (
+            socket.socket(socket.AF_INET, socket.SOCK_DGRAM) for i in range(3))
+        for s in (sock, client, stray):
+            s.bind(('127.0.0.1', 0))
+            s.settimeout(1)
+            self.addCleanup(s.close)
+
+        stray.sendto(b'stray', sock.getsockname())
+        client.sendto(b'expected', sock.getsockname())
+        self.assertEqual(server.receive(sock, client.getsockname()), b'expected')
+        opcode, code, msg = server.unpackERROR(stray.recv(1024))
+        self.assertEqual(code, server.Errors['UNKNOWN_TRANSFER_ID'])
+
+    def test_unpackERROR(self):
+        e = server.packERROR(server.Errors['FILE_EXISTS'], 'Cabbage Icecream!')
+        tOp, tCode, tMsg = server.unpackERROR(e)
+        self.assertEqual(tOp, server.Opcodes['ERROR'])
+        self.assertEqual(tCode, server.Errors['FILE_EXISTS'])
+        self.assertEqual(tMsg, 'Cabbage Icecream!')
+
+    def test_unpackERROR_illegalOperation(self):
+        self.assertRaises(
+            server.ErrorIllegalOperation,
+            server.unpackERROR,
+            server.packACK(1))
+
     def test_unpackACK_illegalOperation(self):
         b = bytearray()
         b.extend(server.Opcodes['ERROR'].to_bytes(2, 'big'))
@@ -333,6 +398,110 @@ class TestServer(unittest.TestCase):
         self.assertEqual(answer2[4:], file[512:1024])
         self.assertEqual(answer3[4:], file[1024:])
 
+    def test_handleRRQ_virtualFile(self):
+        pattern = r'pxelinux\.cfg/01-(?P<mac>[0-9a-f-]+)'
+        virtual.VirtualFiles().register(pattern, 'host {ip} mac {mac}')
+        self.addCleanup(virtual.VirtualFiles().unregister, pattern)
+
+        b = bytearray()
+        b.extend(server.Opcodes['RRQ'].to_bytes(2, 'big'))
+        b.extend(bytes('pxelinux.cfg/01-aa-bb', 'utf-8'))
+        b.append(0)
+        b.extend(bytes('octet', 'utf-8'))
+        b.append(0)
+        self.client.sendto(b, self.send_to)
+
+        answer, self.send_to = self.client.recvfrom(1024)
+        a = server.packACK(1)
+        self.client.sendto(a, self.send_to)
+
+        op, block, data = server.unpackDATA(answer)
+        self.assertEqual(data, b'host 127.0.0.1 mac aa-bb')
+
+    def test_handleRRQ_retransmits(self):
+        storage.Storage().put('retransmit_file', b'lost once')
+        self.addCleanup(setattr, server, 'TRANSFER_TIMEOUT', server.TRANSFER_TIMEOUT)
+        server.TRANSFER_TIMEOUT = 0.2
+
+        b = server.packRWRQ(server.Opcodes['RRQ'], 'retransmit_file', 'octet')
+        self.client.sendto(b, self.send_to)
+        first, addr = self.client.recvfrom(1024)
+        # Don't ACK, as if the DATA was lost
+        again, addr = self.client.recvfrom(1024)
+        self.client.sendto(server.packACK(1), addr)
+        self.assertEqual(again, first)
+
+    def test_handleWRQ_reacksDuplicate(self):
+        b = server.packRWRQ(server.Opcodes['WRQ'], 'duplicate_file', 'octet')
+        self.client.sendto(b, self.send_to)
+        answer, addr = self.client.recvfrom(1024)
+        data = server.packDATA(bytes(512), 1)
+        self.client.sendto(data, addr)
+        self.assertEqual(server.unpackACK(self.client.recv(1024))[1], 1)
+        # As if the ACK was lost
+        self.client.sendto(data, addr)
+        self.assertEqual(server.unpackACK(self.client.recv(1024))[1], 1)
+        self.client.sendto(server.packDATA(b'', 2), addr)
+        self.assertEqual(server.unpackACK(self.client.recv(1024))[1], 2)
+        self.assertEqual(storage.Storage().get('duplicate_file'), bytes(512))
+
+    def test_handleWRQ_allocationExceeded(self):
+        store = storage.Storage()
+        store.configureQuota(fileBytes=1000)
+        self.addCleanup(store.configureQuota)
+
+        b = server.packRWRQ(server.Opcodes['WRQ'], 'quota_file', 'octet')
+        self.client.sendto(b, self.send_to)
+        answer, self.send_to = self.client.recvfrom(1024)
+
+        self.client.sendto(server.packDATA(bytes(512), 1), self.send_to)
+        answer, self.send_to = self.client.recvfrom(1024)
+        self.assertEqual(server.unpackACK(answer), (server.Opcodes['ACK'], 1))
+
+        self.client.sendto(server.packDATA(bytes(512), 2), self.send_to)
+        answer, self.send_to = self.client.recvfrom(1024)
+        opcode, code, msg = server.unpackERROR(answer)
+        self.assertEqual(code, server.Errors['ALLOCATION_EXCEEDED'])
+        self.assertNotIn('quota_file', store.store)
+        self.assertEqual(store.stats()['reservedBytes'], 0)
+
+    def test_handleWRQ_storeFailed(self):
+        store = storage.Storage()
+        for error, code in (
+                (errno.ENOSPC, server.Errors['ALLOCATION_EXCEEDED']),
+                (errno.EIO, server.Errors['NOT_DEFINED'])):
+            with mock.patch.object(store, 'put', side_effect=OSError(error, 'failed')):
+                b = server.packRWRQ(server.Opcodes['WRQ'], 'failed_file', 'octet')
+                self.client.sendto(b, self.send_to)
+                answer, addr = self.client.recvfrom(1024)
+                self.client.sendto(server.packDATA(b'lost', 1), addr)
+                answer, addr = self.client.recvfrom(1024)
+            opcode, errorCode, msg = server.unpackERROR(answer)
+            self.assertEqual(errorCode, code)
+        self.assertNotIn('failed_file', store.store)
+
+    def test_handleWRQ_overwrite(self):
+        store = storage.Storage()
+        store.put('overwrite_file', b'old')
+        self.addCleanup(setattr, server, 'OVERWRITE_POLICY', server.OVERWRITE_POLICY)
+        server.OVERWRITE_POLICY = 'request'
+
+        b = server.packRWRQ(server.Opcodes['WRQ'], 'overwrite_file', 'octet')
+        self.client.sendto(b, self.send_to)
+        answer, addr = self.client.recvfrom(1024)
+        opcode, code, msg = server.unpackERROR(answer)
+        self.assertEqual(code, server.Errors['FILE_EXISTS'])
+
+        b = server.packRWRQ(
+            server.Opcodes['WRQ'], 'overwrite_file', 'octet', {'overwrite': 1})
+        self.client.sendto(b, self.send_to)
+        answer, addr = self.client.recvfrom(1024)
+        self.assertEqual(server.unpackACK(answer), (server.Opcodes['ACK'], 0))
+        self.client.sendto(server.packDATA(b'new', 1), addr)
+        answer, addr = self.client.recvfrom(1024)
+        self.assertEqual(server.unpackACK(answer), (server.Opcodes['ACK'], 1))
+        self.assertEqual(store.get('overwrite_file'), b'new')
+
     def test_handleWRQ(self):
         store = storage.Storage()
         fileName = 'writing_file'
@@ -438,5 +607,70 @@ class TestServer(unittest.TestCase):
 
         self.assertEqual(data, file2)
 
+class TestFrontDoor(unittest.TestCase):
+    def setUp(self):
+        self.server = server.Server(('localhost', 0))
+        self.server_thread = threading.Thread(target=self.server.serve_forever)
+        self.send_to = self.server.server_address
+        self.client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.client.settimeout(0.5)
+        self.server_thread.start()
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_strayPacketRejected(self):
+        threads = threading.active_count()
+        self.client.sendto(server.packACK(1), self.send_to)
+        answer = self.client.recv(1024)
+        opcode, code, msg = server.unpackERROR(answer)
+        self.assertEqual(code, server.Errors['ILLEGAL_OPERATION'])
+        self.assertEqual(threading.active_count(), threads)
+        self.assertEqual(self.server.stats()['rejected'], 1)
+
+    def test_errorNotAnswered(self):
+        self.client.sendto(server.packERROR(0, 'stray'), self.send_to)
+        self.assertRaises(socket.timeout, self.client.recv, 1024)
+        self.assertEqual(self.server.stats()['errorsSent'], 0)
+
+    def test_errorRepliesRateLimited(self):
+        for i in range(server.ERROR_REPLY_BURST + 5):
+            self.client.sendto(b'\xff\xff junk', self.send_to)
+        for i in range(server.ERROR_REPLY_BURST):
+            self.client.recv(1024)
+        self.assertRaises(socket.timeout, self.client.recv, 1024)
+        self.assertGreaterEqual(self.server.stats()['errorsSuppressed'], 4)
+
+    def test_validRequestServed(self):
+        storage.Storage().put('front_door_file', b'front door')
+        self.client.sendto(
+            server.packRWRQ(server.Opcodes['RRQ'], 'front_door_file', 'octet'),
+            self.send_to)
+        answer, addr = self.client.recvfrom(1024)
+        self.client.sendto(server.packACK(1), addr)
+        self.assertEqual(server.unpackDATA(answer)[2], b'front door')
+
+    def test_knownMissAnswered(self):
+        storage.Storage().markMissing('front_door_missing')
+        threads = threading.active_count()
+        self.client.sendto(
+            server.packRWRQ(server.Opcodes['RRQ'], 'front_door_missing', 'octet'),
+            self.send_to)
+        answer, addr = self.client.recvfrom(1024)
+        opcode, code, msg = server.unpackERROR(answer)
+        self.assertEqual(code, server.Errors['FILE_NOT_FOUND'])
+        self.assertEqual(addr, self.send_to)
+        self.assertEqual(threading.active_count(), threads)
+        self.assertEqual(self.server.stats()['missesAnswered'], 1)
+
+    def test_missRemembered(self):
+        rrq = server.packRWRQ(server.Opcodes['RRQ'], 'front_door_unknown', 'octet')
+        self.client.sendto(rrq, self.send_to)
+        answer, addr = self.client.recvfrom(1024)
+        self.assertNotEqual(addr, self.send_to)
+        self.assertTrue(storage.Storage().isMissing('front_door_unknown'))
+
 if __name__ == '__main__':
     unittest.main()
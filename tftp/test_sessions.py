@@ -0,0 +1,111 @@
+import socket
+import socketserver
+import threading
+import time
+import unittest
+
+import server
+import sessions
+import storage
+
+class TestReaper(unittest.TestCase):
+    def setUp(self):
+        self.reaper = sessions.Reaper()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('localhost', 0))
+
+    def tearDown(self):
+        self.reaper.configure()
+        self.sock.close()
+
+    def test_singleton(self):
+        self.assertEqual(sessions.Reaper(), self.reaper)
+
+    def test_reapIdleSession(self):
+        self.reaper.configure(idleTimeout=0)
+        s = sessions.Session('WRQ', ('127.0.0.1', 1), 'my_file', self.sock)
+        s.buffer = bytearray(1024)
+        buffer = s.buffer
+        received = []
+        t = threading.Thread(target=lambda: received.append(self.sock.recv(1024)))
+        t.start()
+
+        before = self.reaper.stats()['idleAborts']
+        self.reaper.register(s)
+        time.sleep(0.01)
+        self.reaper.reap()
+        t.join(1)
+
+        self.assertFalse(t.is_alive())
+        self.assertEqual(received, [b''])
+        self.assertEqual(s.aborted, "Session idle timeout exceeded")
+        self.assertEqual(len(buffer), 0)
+        self.assertEqual(self.reaper.stats()['idleAborts'] - before, 1)
+
+    def test_reapDeadline(self):
+        self.reaper.configure(deadline=0)
+        s = sessions.Session('RRQ', ('127.0.0.1', 1), 'my_file', self.sock)
+        before = self.reaper.stats()['deadlineAborts']
+        self.reaper.register(s)
+        time.sleep(0.01)
+        self.reaper.reap()
+        self.assertEqual(s.aborted, "Session deadline exceeded")
+        self.assertEqual(self.reaper.stats()['deadlineAborts'] - before, 1)
+
+    def test_committedSessionNotAborted(self):
+        s = sessions.Session('WRQ', ('127.0.0.1', 1), 'my_file', self.sock)
+        self.assertTrue(s.commit())
+        self.assertFalse(s.abort("Cabbage Icecream!"))
+        self.assertIsNone(s.aborted)
+
+class TestReaperServer(unittest.TestCase):
+    def setUp(self):
+        sessions.Reaper().configure(idleTimeout=0.2, interval=0.05)
+        self.server = socketserver.ThreadingUDPServer(('localhost', 0), server.Handler)
+        self.server_thread = threading.Thread(target=self.server.serve_forever)
+        self.server_thread.start()
+        self.client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.client.settimeout(3)
+
+    def tearDown(self):
+        sessions.Reaper().configure()
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_stalledWRQAborted(self):
+        before = sessions.Reaper().stats()['idleAborts']
+        b = server.packRWRQ(server.Opcodes['WRQ'], 'stalled_file', 'octet')
+        self.client.sendto(b, self.server.server_address)
+
+        ack, addr = self.client.recvfrom(1024)
+        self.assertEqual(server.unpackACK(ack), (server.Opcodes['ACK'], 0))
+
+        # Never send DATA; the reaper should abort and report it
+        err, addr = self.client.recvfrom(1024)
+        opcode, code, msg = server.unpackERROR(err)
+        self.assertEqual(code, server.Errors['NOT_DEFINED'])
+        self.assertEqual(msg, "Session idle timeout exceeded")
+        self.assertEqual(sessions.Reaper().stats()['idleAborts'] - before, 1)
+        self.assertNotIn('stalled_file', storage.Storage().store)
+
+    def test_stalledRRQAborted(self):
+        # Retransmission timeouts mustn't count as activity from the client
+        self.addCleanup(setattr, server, 'TRANSFER_TIMEOUT', server.TRANSFER_TIMEOUT)
+        server.TRANSFER_TIMEOUT = 0.2
+        storage.Storage().put('stalled_read', b'never acked')
+        before = sessions.Reaper().stats()['idleAborts']
+        b = server.packRWRQ(server.Opcodes['RRQ'], 'stalled_read', 'octet')
+        self.client.sendto(b, self.server.server_address)
+
+        while True:
+            packet, addr = self.client.recvfrom(1024)
+            if server.unpackOpcode(packet) == server.Opcodes['ERROR']:
+                break
+        opcode, code, msg = server.unpackERROR(packet)
+        self.assertEqual(msg, "Session idle timeout exceeded")
+        self.assertEqual(sessions.Reaper().stats()['idleAborts'] - before, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import asyncio
+import socketserver
+import threading
+import time
+import unittest
+import uuid
+
+import client
+import server
+import shaping
+import storage
+
+class TestTokenBucket(unittest.TestCase):
+    def test_burstThenDelay(self):
+        b = shaping.TokenBucket(1000, burst=100)
+        self.assertEqual(b.reserve(100), 0.0)
+        self.assertAlmostEqual(b.reserve(100), 0.1, places=2)
+        self.assertAlmostEqual(b.reserve(100), 0.2, places=2)
+        self.assertEqual(b.sent, 300)
+
+    def test_takeDoesNotGoIntoDeficit(self):
+        b = shaping.TokenBucket(1, burst=2)
+        self.assertTrue(b.take(1))
+        self.assertTrue(b.take(1))
+        self.assertFalse(b.take(1))
+        self.assertGreaterEqual(b.tokens, 0)
+        self.assertEqual(b.sent, 2)
+
+class TestShaper(unittest.TestCase):
+    def setUp(self):
+        self.shaper = shaping.Shaper()
+
+    def tearDown(self):
+        self.shaper.configure()
+
+    def test_singleton(self):
+        self.assertEqual(shaping.Shaper(), self.shaper)
+
+    def test_unlimited(self):
+        self.assertIs(self.shaper.open(('10.0.0.1', 1)), shaping.UNLIMITED)
+
+    def test_mostSpecificSubnet(self):
+        self.shaper.configure(subnetRates={'10.0.0.0/8': 1000, '10.1.0.0/16': 500})
+        f = self.shaper.open(('10.1.2.3', 1))
+        self.assertEqual([s.name for s in f.scopes], ['10.1.0.0/16'])
+        self.assertIs(self.shaper.open(('192.168.0.1', 1)), shaping.UNLIMITED)
+        f.close()
+
+    def test_fairShare(self):
+        self.shaper.configure(globalRate=1000, subnetRates={'10.0.0.0/8': 400})
+        a = self.shaper.open(('10.0.0.1', 1))
+        b = self.shaper.open(('10.0.0.2', 1))
+        c = self.shaper.open(('192.168.0.1', 1))
+        self.assertEqual(a.bucket.rate, 200)
+        self.assertEqual(b.bucket.rate, 200)
+        self.assertAlmostEqual(c.bucket.rate, 1000 / 3)
+
+        b.close()
+        self.assertEqual(a.bucket.rate, 400)
+        self.assertEqual(c.bucket.rate, 500)
+        self.assertEqual(self.shaper.stats()['global']['flows'], 2)
+
+    def test_report(self):
+        self.shaper.configure(globalRate=1000, subnetRates={'10.0.0.0/8': 400})
+        f = self.shaper.open(('192.168.0.1', 1))
+        f.delay(500)
+        with self.assertLogs(level='INFO') as logs:
+            self.shaper.report()
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn("Rate limit [global]", logs.output[0])
+        self.assertIn("of 1000 bytes/s", logs.output[0])
+
+        # Idle caps aren't reported
+        f.close()
+        with self.assertNoLogs(level='INFO'):
+            self.shaper.report()
+
+    def test_throttleAsync(self):
+        self.shaper.configure(globalRate=10000)
+        f = self.shaper.open(('10.0.0.1', 1))
+        start = time.monotonic()
+
+        async def send():
+            for i in range(3):
+                await f.throttleAsync(1000)
+
+        asyncio.run(send())
+        self.assertGreaterEqual(time.monotonic() - start, 0.1)
+        self.assertEqual(self.shaper.stats()['global']['bytes'], 3000)
+        f.close()
+
+    def test_throttledRRQ(self):
+        fileName = str(uuid.uuid1())
+        storage.Storage().put(fileName, bytes(4096))
+        self.shaper.configure(globalRate=10000)
+        srv = socketserver.ThreadingUDPServer(('localhost', 0), server.Handler)
+        thread = threading.Thread(target=srv.serve_forever)
+        thread.start()
+        try:
+            c = client.Client('localhost', srv.server_address[1])
+            start = time.monotonic()
+            data = asyncio.run(c.get(fileName))
+            elapsed = time.monotonic() - start
+        finally:
+            srv.shutdown()
+            srv.server_close()
+
+        self.assertEqual(len(data), 4096)
+        # 4096 bytes plus headers at 10000 bytes/s, less the initial burst
+        self.assertGreater(elapsed, 0.3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import socket
+import unittest
+
+import sockpool
+
+class TestSocketPool(unittest.TestCase):
+    def setUp(self):
+        self.pool = sockpool.SocketPool()
+        self.pool.configure(size=2)
+
+    def tearDown(self):
+        self.pool.configure()
+
+    def test_singleton(self):
+        self.assertEqual(sockpool.SocketPool(), self.pool)
+
+    def test_reuse(self):
+        sock = self.pool.checkout('127.0.0.1')
+        self.pool.checkin(sock)
+        before = self.pool.stats()
+        self.assertIs(self.pool.checkout('127.0.0.1'), sock)
+        self.assertEqual(self.pool.stats()['reused'] - before['reused'], 1)
+        sock.close()
+
+    def test_oldestFirst(self):
+        first = self.pool.checkout('127.0.0.1')
+        second = self.pool.checkout('127.0.0.1')
+        self.pool.checkin(first)
+        self.pool.checkin(second)
+        self.assertIs(self.pool.checkout('127.0.0.1'), first)
+        self.assertIs(self.pool.checkout('127.0.0.1'), second)
+        first.close()
+        second.close()
+
+    def test_fill(self):
+        self.pool.fill('127.0.0.1')
+        self.assertEqual(self.pool.stats()['idle'], 2)
+
+    def test_checkinDrains(self):
+        sock = self.pool.checkout('127.0.0.1')
+        client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.addCleanup(client.close)
+        client.sendto(b'late retransmission', sock.getsockname())
+        client.sendto(b'another', sock.getsockname())
+        before = self.pool.stats()
+        self.pool.checkin(sock)
+        self.assertEqual(self.pool.stats()['drained'] - before['drained'], 2)
+        self.assertIs(self.pool.checkout('127.0.0.1'), sock)
+        sock.setblocking(False)
+        self.assertRaises(BlockingIOError, sock.recv, 1024)
+        sock.close()
+
+    def test_shutDownSocketDiscarded(self):
+        sock = self.pool.checkout('127.0.0.1')
+        try:
+            sock.shutdown(socket.SHUT_RD)
+        except OSError:
+            pass
+        before = self.pool.stats()
+        self.pool.checkin(sock, reusable=False)
+        self.assertEqual(self.pool.stats()['discarded'] - before['discarded'], 1)
+        self.assertEqual(sock.fileno(), -1)
+
+    def test_bufferSizes(self):
+        self.pool.configure(size=2, sendBuffer=65536, receiveBuffer=65536)
+        sock = self.pool.checkout('127.0.0.1')
+        self.addCleanup(sock.close)
+        # Linux doubles the requested size for bookkeeping
+        self.assertGreaterEqual(
+            sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF), 65536)
+        self.assertGreaterEqual(
+            sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF), 65536)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,8 @@
+import os
+import time
 import unittest
 import uuid
+from unittest import mock
 
 import storage
 
@@ -54,6 +57,219 @@ class TestStorage(unittest.TestCase):
             a.put,
             fileName)
 
+class TestCompressedStorage(unittest.TestCase):
+    def tearDown(self):
+        storage.Storage().configureCompression(codecs=())
+
+    def test_putCompressesFile(self):
+        a = storage.Storage()
+        a.configureCompression()
+        file = bytes(str(uuid.uuid1()) * 100, 'utf-8')
+        fileName = uuid.uuid1()
+        a.put(fileName, file)
+        self.assertIsInstance(a.store[fileName], storage.CompressedFile)
+        self.assertLess(len(a.store[fileName].data), len(file))
+        self.assertEqual(a.get(fileName), file)
+        self.assertGreater(a.stats()['compressionRatio'], 1.0)
+
+    def test_putIncompressibleFile(self):
+        a = storage.Storage()
+        a.configureCompression()
+        file = os.urandom(1024)
+        fileName = uuid.uuid1()
+        a.put(fileName, file)
+        self.assertIs(a.store[fileName], file)
+
+    def test_getCachesDecompressedFile(self):
+        a = storage.Storage()
+        a.configureCompression(codecs=('zlib',))
+        file = bytes(str(uuid.uuid1()) * 100, 'utf-8')
+        fileName = uuid.uuid1()
+        a.put(fileName, file)
+        before = a.stats()
+        a.get(fileName)
+        a.get(fileName)
+        after = a.stats()
+        self.assertEqual(after['cacheMisses'] - before['cacheMisses'], 1)
+        self.assertEqual(after['cacheHits'] - before['cacheHits'], 1)
+
+    def test_cacheEviction(self):
+        a = storage.Storage()
+        a.configureCompression(codecs=('zlib',), cacheBytes=0)
+        file = bytes(str(uuid.uuid1()) * 100, 'utf-8')
+        fileName = uuid.uuid1()
+        a.put(fileName, file)
+        a.get(fileName)
+        self.assertFalse(a.cache)
+
+    def test_largeFileCompressedLater(self):
+        a = storage.Storage()
+        a.configureCompression(codecs=('zlib',))
+        file = bytes(str(uuid.uuid1()), 'utf-8') * (storage.COMPRESS_INLINE_BYTES // 10)
+        fileName = uuid.uuid1()
+        before = a.stats()['storedBytes']
+        with mock.patch.object(storage, 'compress', wraps=storage.compress) as c:
+            a.put(fileName, file)
+            c.assert_not_called()
+        self.assertEqual(a.get(fileName), file)
+
+        a.flushCompression(5)
+        self.assertIsInstance(a.store[fileName], storage.CompressedFile)
+        self.assertEqual(a.get(fileName), file)
+        self.assertLess(a.stats()['storedBytes'] - before, len(file))
+
+    def test_unknownCodec(self):
+        self.assertRaises(
+            ValueError,
+            storage.Storage().configureCompression,
+            codecs=('cabbage',))
+
+class TestQuota(unittest.TestCase):
+    def setUp(self):
+        self.store = storage.Storage()
+
+    def tearDown(self):
+        self.store.configureQuota()
+
+    def test_parseSize(self):
+        self.assertEqual(storage.parseSize('500'), 500)
+        self.assertEqual(storage.parseSize('1.5k'), 1500)
+        self.assertEqual(storage.parseSize('4G'), 4 * 1000 ** 3)
+        self.assertRaises(ValueError, storage.parseSize, 'cabbage')
+
+    def test_putFileQuota(self):
+        self.store.configureQuota(fileBytes=10)
+        self.assertRaises(
+            storage.ErrorAllocationExceeded,
+            self.store.put,
+            uuid.uuid1(),
+            bytes(11))
+        self.store.put(uuid.uuid1(), bytes(10))
+
+    def test_putTotalQuota(self):
+        used = self.store.stats()['rawBytes']
+        self.store.configureQuota(totalBytes=used + 100)
+        self.store.put(uuid.uuid1(), bytes(60))
+        self.assertRaises(
+            storage.ErrorAllocationExceeded,
+            self.store.put,
+            uuid.uuid1(),
+            bytes(60))
+
+    def test_allocationGrow(self):
+        used = self.store.stats()['rawBytes']
+        self.store.configureQuota(totalBytes=used + 100)
+        a = self.store.allocate('a')
+        b = self.store.allocate('b')
+        a.grow(60)
+        self.assertEqual(self.store.stats()['reservedBytes'], 60)
+        self.assertRaises(storage.ErrorAllocationExceeded, b.grow, 60)
+        self.assertEqual(b.reserved, 0)
+        a.release()
+        b.grow(60)
+        b.release()
+        self.assertEqual(self.store.stats()['reservedBytes'], 0)
+
+    def test_putTakesOverAllocation(self):
+        used = self.store.stats()['rawBytes']
+        self.store.configureQuota(totalBytes=used + 100)
+        fileName = uuid.uuid1()
+        a = self.store.allocate(fileName)
+        a.grow(80)
+        self.store.put(fileName, bytes(80), a)
+        self.assertEqual(a.reserved, 0)
+        stats = self.store.stats()
+        self.assertEqual(stats['reservedBytes'], 0)
+        self.assertEqual(stats['rawBytes'], used + 80)
+
 
 if __name__ == '__main__':
     unittest.main()
+
+class TestVersions(unittest.TestCase):
+    def setUp(self):
+        self.store = storage.Storage()
+
+    def test_putRefusesOverwrite(self):
+        fileName = uuid.uuid1()
+        self.store.put(fileName, b'old')
+        self.assertRaises(
+            storage.ErrorFileExists, self.store.put, fileName, b'new')
+
+    def test_overwrite(self):
+        fileName = uuid.uuid1()
+        self.store.put(fileName, b'old')
+        before = self.store.stats()['rawBytes']
+        self.store.put(fileName, b'newer', overwrite=True)
+        self.assertEqual(self.store.get(fileName), b'newer')
+        self.assertEqual(self.store.stats()['rawBytes'] - before, 2)
+
+    def test_snapshotSurvivesOverwrite(self):
+        fileName = uuid.uuid1()
+        self.store.put(fileName, b'old')
+        before = self.store.stats()
+        snapshot = self.store.acquire(fileName)
+        self.store.put(fileName, b'newer', overwrite=True)
+
+        self.assertEqual(snapshot.data, b'old')
+        self.assertEqual(self.store.get(fileName), b'newer')
+        during = self.store.stats()
+        self.assertEqual(during['retiredVersions'] - before['retiredVersions'], 1)
+        self.assertEqual(during['rawBytes'] - before['rawBytes'], 5)
+
+        snapshot.release()
+        snapshot.release()
+        after = self.store.stats()
+        self.assertEqual(after['retiredVersions'], before['retiredVersions'])
+        self.assertEqual(after['rawBytes'] - before['rawBytes'], 2)
+
+    def test_overwriteInvalidatesCache(self):
+        a = self.store
+        a.configureCompression(codecs=('zlib',))
+        self.addCleanup(a.configureCompression, codecs=())
+        fileName = uuid.uuid1()
+        old = bytes(str(uuid.uuid1()) * 100, 'utf-8')
+        new = bytes(str(uuid.uuid1()) * 100, 'utf-8')
+        a.put(fileName, old)
+        self.assertEqual(a.get(fileName), old)
+        a.put(fileName, new, overwrite=True)
+        self.assertEqual(a.get(fileName), new)
+
+class TestNegativeCache(unittest.TestCase):
+    def setUp(self):
+        self.store = storage.Storage()
+        self.addCleanup(self.store.configureNegativeCache)
+
+    def test_markMissing(self):
+        fileName = str(uuid.uuid1())
+        self.assertFalse(self.store.isMissing(fileName))
+        self.store.markMissing(fileName)
+        self.assertTrue(self.store.isMissing(fileName))
+
+    def test_putInvalidates(self):
+        fileName = str(uuid.uuid1())
+        self.store.markMissing(fileName)
+        self.store.put(fileName, b'here now')
+        self.assertFalse(self.store.isMissing(fileName))
+
+    def test_expires(self):
+        self.store.configureNegativeCache(ttl=0.05)
+        fileName = str(uuid.uuid1())
+        self.store.markMissing(fileName)
+        time.sleep(0.1)
+        self.assertFalse(self.store.isMissing(fileName))
+
+    def test_bounded(self):
+        self.store.configureNegativeCache(size=2)
+        names = [str(uuid.uuid1()) for i in range(3)]
+        for name in names:
+            self.store.markMissing(name)
+        self.assertFalse(self.store.isMissing(names[0]))
+        self.assertTrue(self.store.isMissing(names[2]))
+        self.assertEqual(self.store.stats()['missingPaths'], 2)
+
+    def test_disabled(self):
+        self.store.configureNegativeCache(size=0)
+        fileName = str(uuid.uuid1())
+        self.store.markMissing(fileName)
+        self.assertFalse(self.store.isMissing(fileName))
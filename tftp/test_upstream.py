@@ -0,0 +1,89 @@
+import asyncio
+import multiprocessing
+import threading
+import unittest
+from unittest import mock
+
+import client
+import loadgen
+import server
+import storage
+import upstream
+
+SMALL = 3000
+LARGE = 2000000
+
+class TestUpstream(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # The origin runs in its own process so it has its own Storage
+        parent, child = multiprocessing.Pipe()
+        cls.origin = multiprocessing.Process(
+            target=loadgen.serve, args=((SMALL, LARGE), child), daemon=True)
+        cls.origin.start()
+        address = parent.recv()
+        upstream.Upstream().configure(*address)
+
+        cls.edge = server.Server(('127.0.0.1', 0), server.Handler)
+        cls.thread = threading.Thread(target=cls.edge.serve_forever)
+        cls.thread.start()
+        cls.client = client.Client(*cls.edge.server_address, bind='127.0.0.1')
+
+    @classmethod
+    def tearDownClass(cls):
+        upstream.Upstream().configure()
+        cls.edge.shutdown()
+        cls.edge.server_close()
+        cls.origin.terminate()
+        cls.origin.join()
+
+    def test_readThrough(self):
+        name = loadgen.fileName(SMALL)
+        data = asyncio.run(self.client.get(name))
+        self.assertEqual(data, loadgen.fileData(SMALL))
+        self.assertEqual(storage.Storage().get(name), data)
+
+        data = asyncio.run(self.client.get(name, server.Modes['NETASCII']))
+        self.assertEqual(data, loadgen.fileData(SMALL))
+
+    def test_missingUpstream(self):
+        with self.assertRaises(client.ErrorRemote) as cm:
+            asyncio.run(self.client.get('not_upstream_either'))
+        self.assertEqual(cm.exception.code, server.Errors['FILE_NOT_FOUND'])
+
+    def test_unexpectedErrorFinishesFill(self):
+        name = 'malformed_upstream'
+        with mock.patch.object(client.Client, 'get',
+                side_effect=server.ErrorMalformedPacket("short DATA")):
+            with self.assertLogs(level='INFO') as logs:
+                self.assertRaises(
+                    upstream.ErrorUpstreamFailed, upstream.Upstream().fetch, name)
+        self.assertEqual(upstream.Upstream().stats()['inProgress'], 0)
+        self.assertIn(
+            "Upstream fetch of 'malformed_upstream' failed: short DATA",
+            logs.output[-1])
+        self.assertEqual(logs.output[-1].count("failed:"), 1)
+
+    def test_storeFailureStillServed(self):
+        name = loadgen.fileName(SMALL)
+        with mock.patch.object(storage.Storage(), 'put',
+                side_effect=OSError("journal write failed")):
+            fill = upstream.Upstream().fetch(name)
+            self.assertEqual(fill.result(), loadgen.fileData(SMALL))
+        self.assertEqual(upstream.Upstream().stats()['inProgress'], 0)
+
+    def test_concurrentMissesCoalesced(self):
+        name = loadgen.fileName(LARGE)
+        before = upstream.Upstream().stats()
+        first = upstream.Upstream().fetch(name)
+        second = upstream.Upstream().fetch(name)
+        self.assertIs(first, second)
+        self.assertEqual(first.result(), loadgen.fileData(LARGE))
+
+        after = upstream.Upstream().stats()
+        self.assertEqual(after['fetches'] - before['fetches'], 1)
+        self.assertEqual(after['coalesced'] - before['coalesced'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import threading
+import time
+import unittest
+
+import virtual
+
+class TestVirtualFiles(unittest.TestCase):
+    def setUp(self):
+        self.pattern = r'pxelinux\.cfg/01-(?P<mac>[0-9a-f-]+)'
+        self.vf = virtual.VirtualFiles()
+
+    def tearDown(self):
+        self.vf.unregister(self.pattern)
+
+    def test_singleton(self):
+        self.assertEqual(virtual.VirtualFiles(), self.vf)
+
+    def test_templateFields(self):
+        self.assertEqual(
+            virtual.templateFields('{ip} {mac.upper} {0} {} {items[1]}'),
+            {'ip', 'mac', '0', 'items'})
+
+    def test_noMatch(self):
+        self.vf.register(self.pattern, 'mac {mac}')
+        self.assertIsNone(self.vf.render(('127.0.0.1', 1), 'not_a_file'))
+
+    def test_renderTemplate(self):
+        self.vf.register(self.pattern, 'mac {mac} ip {ip} first {0}')
+        data = self.vf.render(('10.0.0.1', 1), 'pxelinux.cfg/01-aa-bb')
+        self.assertEqual(data, b'mac aa-bb ip 10.0.0.1 first aa-bb')
+
+    def test_renderCachedAcrossClients(self):
+        self.vf.register(self.pattern, 'mac {mac}')
+        renders = self.vf.renders
+        a = self.vf.render(('10.0.0.1', 1), 'pxelinux.cfg/01-aa-bb')
+        b = self.vf.render(('10.0.0.2', 2), 'pxelinux.cfg/01-aa-bb')
+        self.assertIs(a, b)
+        self.assertEqual(self.vf.renders - renders, 1)
+
+    def test_renderCallable(self):
+        calls = []
+        def generate(inputs):
+            calls.append(inputs)
+            return bytes(inputs['ip'], 'utf-8')
+        self.vf.register(self.pattern, generate, fields=('ip',))
+        self.vf.render(('10.0.0.1', 1), 'pxelinux.cfg/01-aa')
+        self.vf.render(('10.0.0.1', 2), 'pxelinux.cfg/01-bb')
+        data = self.vf.render(('10.0.0.2', 1), 'pxelinux.cfg/01-aa')
+        self.assertEqual(data, b'10.0.0.2')
+        self.assertEqual(len(calls), 2)
+
+    def test_renderCallableIgnoresPort(self):
+        calls = []
+        def generate(inputs):
+            calls.append(inputs)
+            return bytes(inputs['mac'], 'utf-8')
+        self.vf.register(self.pattern, generate)
+        self.vf.render(('10.0.0.1', 1000), 'pxelinux.cfg/01-aa')
+        self.vf.render(('10.0.0.1', 1001), 'pxelinux.cfg/01-aa')
+        self.assertEqual(len(calls), 1)
+
+    def test_concurrentMissesRenderOnce(self):
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+        def generate(inputs):
+            calls.append(inputs)
+            started.set()
+            release.wait(5)
+            return b'slow'
+        self.vf.register(self.pattern, generate, fields=('mac',))
+        results = []
+        threads = [
+            threading.Thread(target=lambda i=i: results.append(
+                self.vf.render(('10.0.0.{}'.format(i), 1), 'pxelinux.cfg/01-aa')))
+            for i in range(4)]
+        threads[0].start()
+        started.wait(5)
+        for t in threads[1:]:
+            t.start()
+        # Give the followers time to find the render in progress
+        time.sleep(0.1)
+        release.set()
+        for t in threads:
+            t.join()
+        self.assertEqual(results, [b'slow'] * 4)
+        self.assertEqual(len(calls), 1)
+
+    def test_renderFailed(self):
+        self.vf.register(self.pattern, '{not_an_input}')
+        self.assertRaises(
+            virtual.ErrorRenderFailed,
+            self.vf.render,
+            ('10.0.0.1', 1),
+            'pxelinux.cfg/01-aa')
+
+
+if __name__ == '__main__':
+    unittest.main()
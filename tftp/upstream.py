@@ -0,0 +1,171 @@
+import asyncio
+import logging
+import threading
+
+import storage
+
+class ErrorUpstreamFailed(Exception):
+    pass
+
+class Fill(object):
+    """A file being fetched from the upstream server. Slices block until
+    the bytes they cover have arrived, so clients can be served while the
+    file is still being fetched.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.data = bytearray()
+        self.done = False
+        self.error = None
+        self.cond = threading.Condition()
+
+    def append(self, data):
+        with self.cond:
+            self.data.extend(data)
+            self.cond.notify_all()
+
+    def finish(self, error=None):
+        with self.cond:
+            self.done = True
+            self.error = error
+            self.cond.notify_all()
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            raise TypeError("Fill only supports slicing")
+        with self.cond:
+            while not self.done and (
+                    key.stop is None or len(self.data) < key.stop):
+                self.cond.wait()
+            self._raise()
+            return bytes(self.data[key])
+
+    def started(self):
+        """Waits for the first bytes or the end of the fetch.
+        Raises storage.ErrorFileNotFound if upstream doesn't have the file
+        and ErrorUpstreamFailed if the fetch failed otherwise.
+        """
+        with self.cond:
+            while not self.done and not self.data:
+                self.cond.wait()
+            self._raise()
+
+    def result(self):
+        """Returns the whole file once fetched"""
+        with self.cond:
+            while not self.done:
+                self.cond.wait()
+            self._raise()
+            return bytes(self.data)
+
+    def _raise(self):
+        if self.error:
+            raise self.error
+
+class Upstream(object):
+    """Maintains a singleton of the upstream server files missing from
+    storage are read through from, and the fetches in progress. Concurrent
+    misses for the same file share one fetch, and fetched files are stored
+    so later requests are served locally.
+    """
+    __instance = None
+
+    def __new__(cls):
+        if not Upstream.__instance:
+            Upstream.__instance = Upstream.__Upstream()
+        return Upstream.__instance
+
+    class __Upstream():
+        def __init__(self):
+            self.mutex = threading.Lock()
+            self.address = None
+            self.timeout = None
+            self.fills = {}
+            self.fetches = 0
+            self.coalesced = 0
+            self.failures = 0
+            self.fetchedBytes = 0
+
+        def configure(self, host=None, port=20069, timeout=None):
+            """Reads files missing from storage through from the TFTP server
+            at host and port. None stops reading through.
+            """
+            with self.mutex:
+                self.address = (host, port) if host else None
+                self.timeout = timeout
+
+        def fetch(self, filename):
+            """Returns a Fill for filename once its first bytes have arrived,
+            joining a fetch already in progress. Returns None if no upstream
+            is configured.
+            Raises storage.ErrorFileNotFound if upstream doesn't have the file
+            and ErrorUpstreamFailed if the fetch failed otherwise.
+            """
+            with self.mutex:
+                if not self.address:
+                    return None
+                fill = self.fills.get(filename)
+                if fill:
+                    self.coalesced += 1
+                else:
+                    fill = Fill(filename)
+                    self.fills[filename] = fill
+                    self.fetches += 1
+                    threading.Thread(
+                        target=self.run, args=(fill, self.address, self.timeout),
+                        name='upstream', daemon=True).start()
+            fill.started()
+            return fill
+
+        def run(self, fill, address, timeout):
+            # Imported here as server imports this module
+            import client
+            import server
+
+            logging.info(
+                "Fetching '{0}' from upstream [{1}:{2}]"\
+                .format(fill.filename, *address))
+            error = None
+            data = b''
+            try:
+                kwargs = {'timeout': timeout} if timeout else {}
+                tftp = client.Client(address[0], address[1], **kwargs)
+                data = asyncio.run(tftp.get(fill.filename, onData=fill.append))
+                try:
+                    storage.Storage().put(fill.filename, data)
+                except storage.ErrorFileExists:
+                    pass
+                except (storage.ErrorAllocationExceeded, OSError) as ex:
+                    # The fetch itself succeeded, so readers still get the file
+                    logging.warning(
+                        "Not caching '{0}' from upstream: {1}"\
+                        .format(fill.filename, ex))
+            except client.ErrorRemote as ex:
+                if ex.code == server.Errors['FILE_NOT_FOUND'] and not fill.data:
+                    error = storage.ErrorFileNotFound(ex.msg)
+                else:
+                    error = ErrorUpstreamFailed(str(ex))
+            except Exception as ex:
+                # Such as a malformed packet from upstream; readers mustn't
+                # be left waiting for a fill that never finishes
+                error = ErrorUpstreamFailed(str(ex))
+            finally:
+                with self.mutex:
+                    del self.fills[fill.filename]
+                    if error:
+                        self.failures += 1
+                    else:
+                        self.fetchedBytes += len(data)
+                fill.finish(error)
+            if error:
+                logging.info("Upstream fetch of '{0}' failed: {1}"\
+                    .format(fill.filename, error))
+
+        def stats(self):
+            with self.mutex:
+                return {
+                    'inProgress': len(self.fills),
+                    'fetches': self.fetches,
+                    'coalesced': self.coalesced,
+                    'failures': self.failures,
+                    'fetchedBytes': self.fetchedBytes}
@@ -0,0 +1,160 @@
+import re
+import string
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import storage
+
+# Maximum number of rendered files kept in the render cache
+RENDER_CACHE_SIZE = 1024
+# Inputs left out of a callable's cache key unless it asks for them; the
+# client port changes with every request
+UNCACHED_INPUTS = ('port',)
+
+class ErrorRenderFailed(Exception):
+    pass
+
+def templateFields(template):
+    """Returns the set of top-level field names referenced by a str.format
+    template, e.g. {'ip', 'mac'} for 'host {ip} mac {mac.upper}'.
+    """
+    fields = set()
+    auto = 0
+    for _, field, _, _ in string.Formatter().parse(template):
+        if field is None:
+            continue
+        name = re.split(r'[.\[]', field, 1)[0]
+        # Empty names are automatically numbered positional fields
+        if not name:
+            name = str(auto)
+            auto += 1
+        fields.add(name)
+    return fields
+
+class Provider(object):
+    """Renders the content of files whose name matches pattern.
+
+    provider is either a str.format template or a callable taking a
+    dictionary of inputs and returning bytes. Inputs are the client 'ip' and
+    'port', the requested 'filename' and the pattern's capture groups, both
+    by name and by position. Rendered files are cached by the values of the
+    inputs they depend on: the fields used by a template, or fields for a
+    callable. Without fields a callable is keyed by every input except the
+    client port, so a callable rendering by port must list it in fields.
+    """
+    def __init__(self, pattern, provider, fields=None):
+        self.pattern = re.compile(pattern)
+        self.provider = provider
+        if fields is None and isinstance(provider, str):
+            fields = templateFields(provider)
+        self.fields = None if fields is None else tuple(sorted(fields))
+
+    def inputs(self, address, match):
+        inputs = {'ip': address[0], 'port': address[1], 'filename': match.string}
+        for i, group in enumerate(match.groups()):
+            inputs[str(i)] = group
+        inputs.update(match.groupdict())
+        return inputs
+
+    def key(self, inputs):
+        fields = self.fields
+        if fields is None:
+            fields = sorted(f for f in inputs if f not in UNCACHED_INPUTS)
+        return (self.pattern.pattern, tuple(inputs.get(f) for f in fields))
+
+    def render(self, inputs):
+        if isinstance(self.provider, str):
+            groups = []
+            while str(len(groups)) in inputs:
+                groups.append(inputs[str(len(groups))])
+            return bytes(self.provider.format(*groups, **inputs), 'utf-8')
+        return bytes(self.provider(inputs))
+
+class VirtualFiles(object):
+    """Maintains a singleton registry of virtual file providers."""
+    __instance = None
+
+    def __new__(cls):
+        if not VirtualFiles.__instance:
+            VirtualFiles.__instance = VirtualFiles.__VirtualFiles()
+        return VirtualFiles.__instance
+
+    class __VirtualFiles():
+        def __init__(self):
+            self.providers = []
+            self.cache = OrderedDict()
+            self.cacheSize = RENDER_CACHE_SIZE
+            # Futures of renders in progress, by cache key
+            self.rendering = {}
+            self.mutex = threading.Lock()
+            self.renders = 0
+            self.cacheHits = 0
+
+        def register(self, pattern, provider, fields=None):
+            """Serves files whose whole name matches pattern from provider.
+            Providers are tried in registration order.
+            """
+            p = Provider(pattern, provider, fields)
+            with self.mutex:
+                self.providers = self.providers + [p]
+            # Names it serves may have been remembered as missing
+            storage.Storage().forgetMissing()
+
+        def unregister(self, pattern):
+            with self.mutex:
+                self.providers = [
+                    p for p in self.providers if p.pattern.pattern != pattern]
+                for key in [k for k in self.cache if k[0] == pattern]:
+                    del self.cache[key]
+
+        def render(self, address, filename):
+            """Returns the rendered content of filename for the client at
+            address, or None if no provider matches filename.
+            Raises ErrorRenderFailed if the provider fails.
+            """
+            with self.mutex:
+                providers = self.providers
+            for p in providers:
+                match = p.pattern.fullmatch(filename)
+                if match:
+                    break
+            else:
+                return None
+
+            inputs = p.inputs(address, match)
+            key = p.key(inputs)
+            with self.mutex:
+                if key in self.cache:
+                    self.cache.move_to_end(key)
+                    self.cacheHits += 1
+                    return self.cache[key]
+                # Concurrent misses on one key wait for a single render
+                future = self.rendering.get(key)
+                leader = future is None
+                if leader:
+                    future = Future()
+                    self.rendering[key] = future
+                else:
+                    self.cacheHits += 1
+            if not leader:
+                return future.result()
+
+            try:
+                data = p.render(inputs)
+            except Exception as ex:
+                error = ErrorRenderFailed(
+                    "Couldn't render '{0}': {1}".format(filename, ex))
+                with self.mutex:
+                    del self.rendering[key]
+                future.set_exception(error)
+                raise error
+
+            with self.mutex:
+                del self.rendering[key]
+                self.renders += 1
+                self.cache[key] = data
+                while len(self.cache) > self.cacheSize:
+                    self.cache.popitem(last=False)
+            future.set_result(data)
+            return data